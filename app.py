@@ -1,36 +1,287 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, g
+import time
 import sqlite3
 import os
-from models.final_emotion_model import FinalEmotionAnalyzer as EmotionAnalyzer
-from utils.helpers import get_mental_health_suggestions
+import gc
+import math
+import atexit
+from datetime import datetime, timedelta
+from config import Config
+from models.final_emotion_model import FinalEmotionAnalyzer as EmotionAnalyzer, emotion_score
+from models.result_cache import make_normalizer
+from models.cascade import CascadeAnalyzer
+from models.ruleset import RulesetSource
+from models.crisis import CrisisDetector
+from database.store import Store
+from database.writer import AnalysisWriter
+from utils.helpers import get_mental_health_suggestions, encode_cursor, decode_cursor
+from utils.alerts import AlertDispatcher, make_alert_sink
+from utils.metrics import CONTENT_TYPE, Registry
+from utils.ratelimit import RateLimiter, RateLimited
+from utils.singleflight import SingleFlight
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-here-change-this-in-production'
 
+# Metrics shared by the analyzer, the database layer and the routes (see /metrics)
+metrics = Registry(enabled=Config.METRICS_ENABLED)
+request_seconds = metrics.histogram('http_request_seconds', 'Request latency by endpoint', ('endpoint',))
+request_stage_seconds = metrics.histogram('http_request_stage_seconds', 'Time per request stage', ('stage',))
+
+# Rule data shared by the analyzer and the suggestions, hot-reloaded on change
+ruleset_source = RulesetSource(Config.RULESET_PATH, check_interval=Config.RULESET_RELOAD_INTERVAL or None)
+
 # Initialize emotion analyzer
-emotion_analyzer = EmotionAnalyzer()
+def load_model_backend():
+    from models.transformer_backend import TransformerBackend
+    return TransformerBackend(
+        Config.MODEL_DIR,
+        max_length=Config.MAX_TEXT_LENGTH,
+        quantize=Config.MODEL_QUANTIZE,
+        max_batch_size=Config.MODEL_MAX_BATCH_SIZE,
+        max_wait=Config.MODEL_MAX_WAIT
+    )
+
+def load_rules_analyzer():
+    return EmotionAnalyzer(
+        ruleset_source=ruleset_source,
+        metrics=metrics,
+        cache_size=Config.ANALYSIS_CACHE_SIZE,
+        cache_normalize=make_normalizer(
+            lowercase=Config.ANALYSIS_CACHE_LOWERCASE,
+            collapse_whitespace=Config.ANALYSIS_CACHE_COLLAPSE_WHITESPACE,
+            strip_punctuation=Config.ANALYSIS_CACHE_STRIP_PUNCTUATION
+        )
+    )
+
+if Config.ANALYZER_BACKEND == 'transformer':
+    emotion_analyzer = load_model_backend()
+elif Config.ANALYZER_BACKEND == 'cascade':
+    # The model tier is used only when a local checkpoint is present
+    emotion_analyzer = CascadeAnalyzer(
+        load_rules_analyzer(),
+        model=load_model_backend() if os.path.isdir(Config.MODEL_DIR) else None,
+        rules_min_confidence=Config.CASCADE_RULES_MIN_CONFIDENCE,
+        sentiment_min_confidence=Config.CASCADE_SENTIMENT_MIN_CONFIDENCE,
+        model_min_confidence=Config.CASCADE_MODEL_MIN_CONFIDENCE,
+        metrics=metrics
+    )
+else:
+    emotion_analyzer = load_rules_analyzer()
+if Config.ANALYZER_WARM_UP:
+    emotion_analyzer.warm_up()
+
+# Rows are stored with the version of the ruleset that scored them when the
+# rules alone produced them, so that python -m database.rescore can redo them
+# (the cascade lets VADER override weak rule results, which rescoring would undo)
+tag_ruleset_version = isinstance(emotion_analyzer, EmotionAnalyzer)
+
+# Crisis phrases are checked ahead of the analyzer; alerts are delivered in the background
+crisis_alerts = None
+alert_sink = make_alert_sink(Config.CRISIS_ALERT_SINK,
+                             path=Config.CRISIS_ALERT_PATH,
+                             url=Config.CRISIS_ALERT_WEBHOOK_URL)
+if alert_sink is not None:
+    crisis_alerts = AlertDispatcher(alert_sink, max_queue=Config.CRISIS_ALERT_QUEUE_SIZE, metrics=metrics)
+    atexit.register(crisis_alerts.close)
+crisis_detector = CrisisDetector(ruleset_source, alerts=crisis_alerts, metrics=metrics)
 
 # Database setup
+store = Store(Config.DATABASE_PATH,
+              pool_size=Config.DATABASE_POOL_SIZE,
+              busy_timeout=Config.DATABASE_BUSY_TIMEOUT,
+              metrics=metrics)
+
+# Analyses are persisted off the request path when write-behind is enabled
+analysis_writer = None
+if Config.ANALYSIS_WRITE_BEHIND:
+    analysis_writer = AnalysisWriter(store,
+                                     batch_size=Config.WRITE_BATCH_SIZE,
+                                     flush_interval=Config.WRITE_FLUSH_INTERVAL,
+                                     max_queue=Config.WRITE_QUEUE_SIZE,
+                                     metrics=metrics)
+    atexit.register(analysis_writer.close)
+
+# Per-user request budget, and sharing of duplicate /analyze submissions
+rate_limiter = None
+if Config.RATE_LIMIT_PER_MINUTE:
+    rate_limiter = RateLimiter(Config.RATE_LIMIT_PER_MINUTE / 60.0, Config.RATE_LIMIT_BURST, metrics=metrics)
+# A batch takes a token per text, so it may not be larger than a full bucket
+max_batch_texts = Config.BATCH_MAX_TEXTS
+if rate_limiter is not None:
+    max_batch_texts = min(max_batch_texts, rate_limiter.burst)
+analysis_flights = SingleFlight(linger=Config.ANALYZE_COALESCE_WINDOW)
+metrics.callback('analysis_coalesced_total', 'Submissions answered by an identical one in flight or just finished',
+                 lambda: analysis_flights.shared, kind='counter')
+
+def record_ruleset(ruleset):
+    try:
+        store.record_ruleset(ruleset)
+    except sqlite3.Error:
+        app.logger.exception("Could not record ruleset version %s", ruleset.version)
+
 def init_db():
-    conn = sqlite3.connect('database/users.db')
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS users
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  username TEXT UNIQUE NOT NULL,
-                  email TEXT UNIQUE NOT NULL,
-                  password TEXT NOT NULL,
-                  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS user_analyses
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  user_id INTEGER,
-                  text_input TEXT,
-                  emotion TEXT,
-                  confidence REAL,
-                  timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                  FOREIGN KEY (user_id) REFERENCES users (id))''')
-    conn.commit()
-    conn.close()
+    store.init_schema()
+    # Every version rows are tagged with is kept, for re-scoring against later ones
+    record_ruleset(ruleset_source.get())
+    ruleset_source.on_swap(record_ruleset)
+
+def prepare_for_fork():
+    """Build every lazily built piece of analyzer state in a preforking master
+    (see gunicorn.conf.py), so workers share it copy-on-write instead of each
+    rebuilding it, then move it out of the garbage collector's reach: a
+    collection in a worker would otherwise write to, and so copy, every page
+    holding a tracked object."""
+    emotion_analyzer.warm_up()
+    gc.collect()
+    gc.freeze()
+
+# Analysis steps shared by the Flask routes and the ASGI server (asgi.py)
+def classify_text(text, document_mode=False, user_id=None, top_k=None):
+    """Return (emotion, confidence, document, scores).
+
+    document is None unless document_mode; scores is the top_k ranking from
+    analyze_emotion_scores, or None unless top_k is given.
+    """
+    with request_stage_seconds.time('classify'):
+        # A crisis phrase is flagged and alerted before anything else runs
+        crisis = crisis_detector.check(text, user_id=user_id)
+        if crisis is not None and not document_mode:
+            scores = [emotion_score(*crisis)] if top_k else None
+            return crisis[0], crisis[1], None, scores
+        if document_mode:
+            document = emotion_analyzer.analyze_document(text)
+            return document['emotion'], document['confidence'], document, None
+        if top_k:
+            scores = emotion_analyzer.analyze_emotion_scores(text, top_k)
+            return scores[0]['emotion'], scores[0]['confidence'], None, scores
+        emotion, confidence = emotion_analyzer.analyze_emotion(text)
+        return emotion, confidence, None, None
+
+def save_analysis(user_id, text, emotion, confidence, ruleset=None):
+    # ruleset is the snapshot that scored a plain text analysis; None when unknown
+    ruleset_version = ruleset.version if ruleset is not None and tag_ruleset_version else None
+    with request_stage_seconds.time('db_write'):
+        if analysis_writer is not None:
+            analysis_writer.submit((user_id, text, emotion, confidence, ruleset_version))
+        else:
+            store.add_analysis(user_id, text, emotion, confidence, ruleset_version)
+
+def analyze_once(user_id, text, document_mode=False, top_k=None):
+    """Classify and save one submission; returns (ruleset, emotion, confidence, document, scores).
+
+    Identical submissions by the same user that are in flight, or finished
+    less than Config.ANALYZE_COALESCE_WINDOW seconds ago, share a single
+    classification and a single saved row. Raises RateLimited when the user
+    is over budget.
+    """
+    def analyze():
+        if rate_limiter is not None:
+            rate_limiter.check(user_id)
+        ruleset = ruleset_source.get()
+        emotion, confidence, document, scores = classify_text(text, document_mode, user_id, top_k)
+        save_analysis(user_id, text, emotion, confidence, ruleset if document is None else None)
+        return ruleset, emotion, confidence, document, scores
+    return analysis_flights.do((user_id, text, document_mode, top_k), analyze)
+
+def retry_after(exc):
+    """Retry-After header value for a RateLimited error"""
+    return str(max(1, math.ceil(exc.retry_after)))
+
+def analysis_payload(emotion, confidence, document=None, ruleset=None, scores=None, suggestions=False):
+    """Response body for one analysis.
+
+    Suggestions are only inlined when asked for; clients normally fetch
+    them from the cacheable /suggestions/<emotion> endpoint instead.
+    """
+    # Callers pass the snapshot taken when the request started
+    if ruleset is None:
+        ruleset = ruleset_source.get()
+    payload = {
+        'emotion': emotion,
+        'confidence': round(confidence * 100, 2),
+        'ruleset_version': ruleset.version
+    }
+    if suggestions:
+        with request_stage_seconds.time('suggestions'):
+            payload['suggestions'] = get_mental_health_suggestions(emotion, ruleset)
+    if scores is not None:
+        payload['emotions'] = [dict(score, confidence=round(score['confidence'] * 100, 2))
+                               for score in scores]
+    if document is not None:
+        payload.update({
+            'crisis': document['crisis'],
+            'timeline': [dict(item, confidence=round(item['confidence'] * 100, 2))
+                         for item in document['timeline']],
+            'distribution': document['distribution']
+        })
+    return payload
+
+def first_day(days):
+    """First UTC day (YYYY-MM-DD) of a window of days ending today"""
+    return (datetime.utcnow().date() - timedelta(days=days - 1)).isoformat()
+
+def days_error(days):
+    """Validation message for a days window (None when not an integer), or None when it is valid"""
+    if days is None or not 1 <= days <= 366:
+        return 'days must be between 1 and 366'
+    return None
+
+def top_k_error(top_k):
+    """Validation message for an /analyze top_k value, or None when it is valid"""
+    if top_k is not None and (isinstance(top_k, bool) or not isinstance(top_k, int) or top_k < 1):
+        return 'top_k must be a positive integer'
+    return None
+
+def batch_error(texts):
+    """Validation message for a /analyze/batch body, or None when it is valid"""
+    if not isinstance(texts, list) or not texts:
+        return 'Expected a JSON array of texts'
+    if not all(isinstance(text, str) and text for text in texts):
+        return 'Every item must be a non-empty string'
+    return None
+
+def batch_size_error(texts):
+    """Message for a /analyze/batch body with too many texts (413), or None"""
+    if len(texts) > max_batch_texts:
+        return 'At most %d texts per batch' % max_batch_texts
+    return None
+
+def analyze_and_save_batch(user_id, texts, suggestions=False):
+    # Each text counts against the user's budget (batch_size_error keeps a
+    # batch within a full bucket); raises RateLimited when over it
+    if rate_limiter is not None:
+        rate_limiter.check(user_id, cost=len(texts))
+    
+    # Flag crises first, analyze the rest in one pass, then save them in a single transaction
+    ruleset = ruleset_source.get()
+    with request_stage_seconds.time('classify'):
+        crises = [crisis_detector.check(text, user_id=user_id) for text in texts]
+        analyzed = iter(emotion_analyzer.analyze_batch(
+            [text for text, crisis in zip(texts, crises) if crisis is None]))
+        analyses = [crisis[:2] if crisis is not None else next(analyzed) for crisis in crises]
+    ruleset_version = ruleset.version if tag_ruleset_version else None
+    with request_stage_seconds.time('db_write'):
+        store.add_analyses([(user_id, text, emotion, confidence, ruleset_version)
+                            for text, (emotion, confidence) in zip(texts, analyses)])
+    return [analysis_payload(emotion, confidence, ruleset=ruleset, suggestions=suggestions)
+            for emotion, confidence in analyses]
+
+if metrics.enabled:
+    @app.before_request
+    def start_request_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def observe_request_time(response):
+        request_seconds.observe(time.perf_counter() - g.request_start, request.endpoint or 'unmatched')
+        return response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    if not metrics.enabled:
+        return jsonify({'error': 'Metrics are disabled'}), 404
+    return app.response_class(metrics.render(), content_type=CONTENT_TYPE)
 
 @app.route('/')
 def index():
@@ -43,18 +294,12 @@ def register():
         email = request.form['email']
         password = request.form['password']
         
-        conn = sqlite3.connect('database/users.db')
-        c = conn.cursor()
         try:
-            c.execute("INSERT INTO users (username, email, password) VALUES (?, ?, ?)",
-                     (username, email, password))
-            conn.commit()
+            store.create_user(username, email, password)
             flash('Registration successful! Please login.', 'success')
             return redirect(url_for('login'))
         except sqlite3.IntegrityError:
             flash('Username or email already exists!', 'error')
-        finally:
-            conn.close()
     
     return render_template('register.html')
 
@@ -64,11 +309,7 @@ def login():
         username = request.form['username']
         password = request.form['password']
         
-        conn = sqlite3.connect('database/users.db')
-        c = conn.cursor()
-        c.execute("SELECT * FROM users WHERE username = ? AND password = ?", (username, password))
-        user = c.fetchone()
-        conn.close()
+        user = store.find_user(username, password)
         
         if user:
             session['user_id'] = user[0]
@@ -95,42 +336,152 @@ def analyze_text():
     if not text:
         return jsonify({'error': 'No text provided'}), 400
     
-    # Analyze emotion
-    emotion, confidence = emotion_analyzer.analyze_emotion(text)
-    suggestions = get_mental_health_suggestions(emotion)
+    # Opt-in ranking of every detected emotion, best first
+    top_k = request.json.get('top_k')
+    error = top_k_error(top_k)
+    if error:
+        return jsonify({'error': error}), 400
     
-    # Save analysis to database
-    conn = sqlite3.connect('database/users.db')
-    c = conn.cursor()
-    c.execute("INSERT INTO user_analyses (user_id, text_input, emotion, confidence) VALUES (?, ?, ?, ?)",
-             (session['user_id'], text, emotion, confidence))
-    conn.commit()
-    conn.close()
+    # Analyze emotion, sentence by sentence for long documents when asked, and save it
+    try:
+        ruleset, emotion, confidence, document, scores = analyze_once(
+            session['user_id'], text, bool(request.json.get('document')), top_k)
+    except RateLimited as exc:
+        return jsonify({'error': 'Too many requests, please slow down'}), 429, {'Retry-After': retry_after(exc)}
     
-    return jsonify({
-        'emotion': emotion,
-        'confidence': round(confidence * 100, 2),
-        'suggestions': suggestions
-    })
+    payload = analysis_payload(emotion, confidence, document, ruleset, scores,
+                               bool(request.json.get('suggestions')))
+    with request_stage_seconds.time('serialize'):
+        return jsonify(payload)
+
+@app.route('/analyze/batch', methods=['POST'])
+def analyze_batch():
+    if 'user_id' not in session:
+        return jsonify({'error': 'Please login first'}), 401
+
+    texts = request.json
+    error = batch_error(texts)
+    if error:
+        return jsonify({'error': error}), 400
+    error = batch_size_error(texts)
+    if error:
+        return jsonify({'error': error}), 413
+
+    suggestions = request.args.get('suggestions', '').lower() in ('1', 'true', 'yes')
+    try:
+        return jsonify(analyze_and_save_batch(session['user_id'], texts, suggestions))
+    except RateLimited as exc:
+        return jsonify({'error': 'Too many requests, please slow down'}), 429, {'Retry-After': retry_after(exc)}
+
+@app.route('/suggestions/<emotion>')
+def get_suggestions(emotion):
+    # Same for every user, so it is public and cached by the browser
+    body, etag = ruleset_source.get().suggestion_payload(emotion)
+    response = app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = Config.SUGGESTIONS_MAX_AGE
+    return response.make_conditional(request)
 
 @app.route('/history')
 def get_history():
     if 'user_id' not in session:
         return jsonify({'error': 'Please login first'}), 401
     
-    conn = sqlite3.connect('database/users.db')
-    c = conn.cursor()
-    c.execute("SELECT text_input, emotion, confidence, timestamp FROM user_analyses WHERE user_id = ? ORDER BY timestamp DESC LIMIT 10",
-             (session['user_id'],))
-    history = c.fetchall()
-    conn.close()
-    
-    return jsonify([{
-        'text': row[0][:100] + '...' if len(row[0]) > 100 else row[0],
-        'emotion': row[1],
-        'confidence': row[2],
-        'timestamp': row[3]
+    # Make queued analyses visible before reading them back; a stalled
+    # writer only makes the answer stale
+    if analysis_writer is not None:
+        analysis_writer.flush(timeout=Config.WRITE_FLUSH_TIMEOUT)
+    
+    limit = request.args.get('limit', 10, type=int)
+    if limit is None or not 1 <= limit <= 100:
+        return jsonify({'error': 'limit must be between 1 and 100'}), 400
+    
+    after = None
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            after = decode_cursor(cursor)
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
+    
+    history = store.history_page(session['user_id'], limit=limit, after=after)
+    
+    response = jsonify([{
+        'text': row[1],
+        'emotion': row[2],
+        'confidence': row[3],
+        'timestamp': row[4]
     } for row in history])
+    
+    # Cursor for the next (older) page, only when this page was full
+    if len(history) == limit:
+        last = history[-1]
+        response.headers['X-Next-Cursor'] = encode_cursor(last[4], last[0])
+    return response
+
+@app.route('/history/summary')
+def get_history_summary():
+    if 'user_id' not in session:
+        return jsonify({'error': 'Please login first'}), 401
+    
+    period = request.args.get('period', 'day')
+    if period not in ('day', 'week'):
+        return jsonify({'error': "period must be 'day' or 'week'"}), 400
+    
+    # days=N covers today and the N - 1 days before it (UTC, like the stored timestamps)
+    since = ''
+    if 'days' in request.args:
+        days = request.args.get('days', type=int)
+        error = days_error(days)
+        if error:
+            return jsonify({'error': error}), 400
+        since = first_day(days)
+    
+    if analysis_writer is not None:
+        analysis_writer.flush(timeout=Config.WRITE_FLUSH_TIMEOUT)
+    
+    totals, series = store.emotion_summary(session['user_id'], period=period, since=since)
+    
+    return jsonify({
+        'period': period,
+        'emotions': [{
+            'emotion': emotion,
+            'count': count,
+            'average_confidence': round(avg_confidence, 3)
+        } for emotion, count, avg_confidence in totals],
+        'series': [{
+            'period': bucket,
+            'emotion': emotion,
+            'count': count,
+            'average_confidence': round(avg_confidence, 3)
+        } for bucket, emotion, count, avg_confidence in series]
+    })
+
+@app.route('/history/trend')
+def get_history_trend():
+    if 'user_id' not in session:
+        return jsonify({'error': 'Please login first'}), 401
+    
+    days = request.args.get('days', 7, type=int)
+    error = days_error(days)
+    if error:
+        return jsonify({'error': error}), 400
+    
+    if analysis_writer is not None:
+        analysis_writer.flush(timeout=Config.WRITE_FLUSH_TIMEOUT)
+    
+    # One entry per day that has analyses, built from the rollup rows
+    trend = []
+    for day, emotion, count, confidence_sum in store.daily_rollup(session['user_id'], since=first_day(days)):
+        if not trend or trend[-1]['day'] != day:
+            trend.append({'day': day, 'total': 0, 'emotions': {}})
+        trend[-1]['total'] += count
+        trend[-1]['emotions'][emotion] = {
+            'count': count,
+            'average_confidence': round(confidence_sum / count, 3)
+        }
+    return jsonify({'days': days, 'trend': trend})
 
 @app.route('/logout')
 def logout():
@@ -0,0 +1,243 @@
+"""ASGI entry point with bounded, admission-controlled analysis.
+
+Run with any ASGI server, for example:
+    uvicorn asgi:application
+
+POST /analyze and POST /analyze/batch are handled natively: classification
+and saving run on a fixed-size thread pool (Config.ASGI_WORKERS), saves
+normally only queueing the row for the app's write-behind writer, so the
+event loop never blocks on either. Every
+other path (pages, login, /history, static files) is passed to the Flask
+app through a small WSGI bridge on the same pool, so routes, sessions and
+JSON shapes are the same as when running app.py directly.
+
+Once Config.ASGI_WORKERS + Config.ASGI_MAX_QUEUE requests are in flight, new
+requests are refused with 503 and a Retry-After header instead of queueing
+without bound.
+"""
+import asyncio
+import io
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qs
+
+from itsdangerous import BadSignature
+
+import app as webapp
+from config import Config
+
+
+def _wsgi_environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': client[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        environ[name] = environ[name] + ',' + value if name in environ else value
+    return environ
+
+
+def call_wsgi(wsgi_app, scope, body):
+    """Run a WSGI app for one ASGI request; returns (status, headers, body)"""
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = headers
+
+    result = wsgi_app(_wsgi_environ(scope, body), start_response)
+    try:
+        content = b''.join(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return response['status'], response['headers'], content
+
+
+class AnalysisServer:
+    def __init__(self, flask_app, workers=4, max_queue=64, retry_after=1, metrics=None):
+        self.flask_app = flask_app
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix='analysis')
+        self.max_in_flight = workers + max_queue
+        self.retry_after = retry_after
+        self.in_flight = 0  # only touched from the event loop thread
+        self.rejected = 0
+        if metrics is not None:
+            metrics.callback('asgi_requests_in_flight', 'Requests admitted and not yet finished',
+                             lambda: self.in_flight)
+            metrics.callback('asgi_rejected_total', 'Requests refused with 503 by admission control',
+                             lambda: self.rejected, kind='counter')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        if self.in_flight >= self.max_in_flight:
+            self.rejected += 1
+            await self._send(send, 503, {'error': 'Server is busy, please retry shortly'},
+                             [('Retry-After', str(self.retry_after))])
+            return
+
+        self.in_flight += 1
+        try:
+            body = await self._read_body(receive)
+            route = (scope['method'], scope['path'])
+            if route == ('POST', '/analyze'):
+                await self._analyze(scope, body, send)
+            elif route == ('POST', '/analyze/batch'):
+                await self._analyze_batch(scope, body, send)
+            else:
+                await self._flask(scope, body, send)
+        finally:
+            self.in_flight -= 1
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                webapp.init_db()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if webapp.analysis_writer is not None:
+                    webapp.analysis_writer.close()
+                self.pool.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _read_body(self, receive):
+        chunks = []
+        while True:
+            message = await receive()
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                return b''.join(chunks)
+
+    async def _send(self, send, status, payload, headers=()):
+        body = json.dumps(payload).encode('utf-8')
+        await self._send_raw(send, status, [('Content-Type', 'application/json')] + list(headers), body)
+
+    async def _send_raw(self, send, status, headers, body):
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    def _session_user(self, scope):
+        """user_id from the Flask session cookie, or None"""
+        cookie_header = ','.join(value.decode('latin-1') for name, value in scope.get('headers', [])
+                                 if name == b'cookie')
+        cookie = SimpleCookie()
+        cookie.load(cookie_header)
+        morsel = cookie.get(self.flask_app.config['SESSION_COOKIE_NAME'])
+        if morsel is None:
+            return None
+        serializer = self.flask_app.session_interface.get_signing_serializer(self.flask_app)
+        try:
+            data = serializer.loads(morsel.value,
+                                    max_age=int(self.flask_app.permanent_session_lifetime.total_seconds()))
+        except BadSignature:
+            return None
+        return data.get('user_id')
+
+    def _json_body(self, body):
+        try:
+            return json.loads(body)
+        except ValueError:
+            return None
+
+    async def _analyze(self, scope, body, send):
+        user_id = self._session_user(scope)
+        if user_id is None:
+            await self._send(send, 401, {'error': 'Please login first'})
+            return
+        data = self._json_body(body)
+        text = data.get('text', '') if isinstance(data, dict) else ''
+        if not text:
+            await self._send(send, 400, {'error': 'No text provided'})
+            return
+        top_k = data.get('top_k')
+        error = webapp.top_k_error(top_k)
+        if error:
+            await self._send(send, 400, {'error': error})
+            return
+
+        loop = asyncio.get_running_loop()
+        try:
+            ruleset, emotion, confidence, document, scores = await loop.run_in_executor(
+                self.pool, webapp.analyze_once, user_id, text, bool(data.get('document')), top_k)
+        except webapp.RateLimited as exc:
+            await self._rate_limited(send, exc)
+            return
+        await self._send(send, 200, webapp.analysis_payload(emotion, confidence, document, ruleset, scores,
+                                                            bool(data.get('suggestions'))))
+
+    async def _analyze_batch(self, scope, body, send):
+        user_id = self._session_user(scope)
+        if user_id is None:
+            await self._send(send, 401, {'error': 'Please login first'})
+            return
+        texts = self._json_body(body)
+        error = webapp.batch_error(texts)
+        if error:
+            await self._send(send, 400, {'error': error})
+            return
+        error = webapp.batch_size_error(texts)
+        if error:
+            await self._send(send, 413, {'error': error})
+            return
+
+        loop = asyncio.get_running_loop()
+        query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+        suggestions = query.get('suggestions', [''])[0].lower() in ('1', 'true', 'yes')
+        try:
+            payload = await loop.run_in_executor(self.pool, webapp.analyze_and_save_batch,
+                                                 user_id, texts, suggestions)
+        except webapp.RateLimited as exc:
+            await self._rate_limited(send, exc)
+            return
+        await self._send(send, 200, payload)
+
+    async def _rate_limited(self, send, exc):
+        await self._send(send, 429, {'error': 'Too many requests, please slow down'},
+                         [('Retry-After', webapp.retry_after(exc))])
+
+    async def _flask(self, scope, body, send):
+        loop = asyncio.get_running_loop()
+        status, headers, content = await loop.run_in_executor(
+            self.pool, call_wsgi, self.flask_app.wsgi_app, scope, body)
+        await self._send_raw(send, status, headers, content)
+
+
+application = AnalysisServer(
+    webapp.app,
+    workers=Config.ASGI_WORKERS,
+    max_queue=Config.ASGI_MAX_QUEUE,
+    retry_after=Config.ASGI_RETRY_AFTER,
+    metrics=webapp.metrics
+)
@@ -0,0 +1,58 @@
+"""Cold-start benchmark: time to import and first-use the analyzer in a fresh process.
+
+Usage:
+    python benchmarks/cold_start.py [--runs N]
+
+Each run starts a new interpreter, so module imports and lazily built state
+are measured exactly as a freshly spawned server worker would pay for them.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = r'''
+import json, sys, time
+sys.path.insert(0, sys.argv[1])
+t0 = time.perf_counter()
+from models.final_emotion_model import FinalEmotionAnalyzer
+t1 = time.perf_counter()
+analyzer = FinalEmotionAnalyzer()
+t2 = time.perf_counter()
+analyzer.analyze_emotion("I feel so overwhelmed by everything")
+t3 = time.perf_counter()
+analyzer.analyze_emotion("Lovely afternoon, nice tea outside")
+t4 = time.perf_counter()
+print(json.dumps({
+    'import_s': t1 - t0,
+    'construct_s': t2 - t1,
+    'first_phrase_call_s': t3 - t2,
+    'first_vader_call_s': t4 - t3,
+    'total_s': t4 - t0,
+}))
+'''
+
+
+def run_once():
+    output = subprocess.run([sys.executable, '-c', PROBE, ROOT],
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    runs = [run_once() for _ in range(args.runs)]
+    summary = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+    print(json.dumps({'runs': args.runs, 'median': summary}, indent=2))
+    return summary
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""Load test for POST /analyze against a running server.
+
+Usage:
+    python benchmarks/load_test.py --url http://127.0.0.1:5000 [--concurrency 32] [--requests 2000]
+
+Registers and logs in a throwaway user, then keeps --concurrency clients
+posting to /analyze until --requests have completed. Prints throughput,
+latency percentiles and status counts as JSON, so the Flask server
+(python app.py) and the ASGI server (uvicorn asgi:application) can be
+compared on the same machine. Start the server with RATE_LIMIT_PER_MINUTE=0
+and ANALYZE_COALESCE_WINDOW=0, or the single test user is rate limited and
+its repeated texts are answered without being analyzed.
+"""
+import argparse
+import http.client
+import json
+import statistics
+import threading
+import time
+import uuid
+from collections import Counter
+from urllib.parse import urlencode, urlsplit
+
+TEXTS = [
+    "I feel so overwhelmed by everything I have to do this week.",
+    "The deadlines at the office keep piling up again",
+    "Lovely afternoon, nice tea outside",
+    "I'm so grateful for all the wonderful people in my life.",
+]
+
+
+def request(url, method, path, body=None, headers=None):
+    parts = urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+    try:
+        conn.request(method, path, body=body, headers=headers or {})
+        response = conn.getresponse()
+        response.read()
+        return response.status, response.getheader('Set-Cookie')
+    finally:
+        conn.close()
+
+
+def login(url):
+    """Register a fresh user and return its session cookie"""
+    name = 'load-' + uuid.uuid4().hex[:12]
+    form = {'Content-Type': 'application/x-www-form-urlencoded'}
+    request(url, 'POST', '/register',
+            urlencode({'username': name, 'email': name + '@example.com', 'password': name}), form)
+    status, cookie = request(url, 'POST', '/login', urlencode({'username': name, 'password': name}), form)
+    if status != 302 or not cookie:
+        raise SystemExit('Login failed with status %d' % status)
+    return cookie.split(';', 1)[0]
+
+
+def percentile(values, fraction):
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    headers = {'Content-Type': 'application/json', 'Cookie': login(args.url)}
+    latencies = []
+    statuses = Counter()
+    lock = threading.Lock()
+    remaining = [args.requests]
+
+    def client(worker):
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+                n = remaining[0]
+            body = json.dumps({'text': TEXTS[(worker + n) % len(TEXTS)]})
+            start = time.perf_counter()
+            try:
+                status, _ = request(args.url, 'POST', '/analyze', body, headers)
+            except OSError:
+                status = 'error'
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                statuses[status] += 1
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+
+    latencies.sort()
+    print(json.dumps({
+        'url': args.url,
+        'concurrency': args.concurrency,
+        'requests': len(latencies),
+        'seconds': round(wall, 3),
+        'throughput_rps': round(len(latencies) / wall, 1),
+        'latency_ms': {
+            'mean': round(statistics.mean(latencies) * 1000, 2),
+            'p50': round(percentile(latencies, 0.50) * 1000, 2),
+            'p95': round(percentile(latencies, 0.95) * 1000, 2),
+            'p99': round(percentile(latencies, 0.99) * 1000, 2),
+        },
+        'statuses': {str(status): count for status, count in sorted(statuses.items(), key=str)},
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
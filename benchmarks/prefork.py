@@ -0,0 +1,130 @@
+"""Prefork benchmark: memory and start-up time of forked server workers (Linux).
+
+Usage:
+    python benchmarks/prefork.py [--workers N] [--requests N]
+
+Mimics a preforking server such as gunicorn. In every mode a fresh master
+process forks --workers children; each analyzes --requests texts and runs a
+garbage collection, as a worker does during its life, and then the memory
+of every worker is read from /proc/<pid>/smaps_rollup. Modes:
+
+    import          each worker imports app.py itself (no preloading)
+    preload         the master imports app.py and warms the analyzer up
+    preload_frozen  the master imports app.py and calls app.prepare_for_fork()
+
+private_mb is memory used by that worker alone, i.e. the cost of one more
+worker; pss_mb also counts an even share of the pages it shares with the
+others. spawn_s is the time from fork until the first text is analyzed.
+"""
+import argparse
+import gc
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODES = ('import', 'preload', 'preload_frozen')
+
+# Phrase, keyword and VADER paths, so every part of the analyzer is used
+TEXTS = [
+    "I feel so overwhelmed by everything I have to do this week.",
+    "The deadlines at the office keep piling up again",
+    "Lovely afternoon, nice tea outside",
+    "I'm so grateful for all the wonderful people in my life.",
+]
+
+
+def memory_mb(pid):
+    """(private, pss) of a process in MB"""
+    fields = {}
+    with open('/proc/%d/smaps_rollup' % pid) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1])
+    return (fields['Private_Clean'] + fields['Private_Dirty']) / 1024, fields['Pss'] / 1024
+
+
+def work(requests):
+    """Body of one worker; returns when its first text was analyzed"""
+    import app
+    first = None
+    for i in range(requests):
+        app.emotion_analyzer.analyze_emotion(TEXTS[i % len(TEXTS)])
+        if first is None:
+            first = time.monotonic()
+    gc.collect()
+    return first
+
+
+def run_master(mode, workers, requests):
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+    if mode != 'import':
+        import app
+        if mode == 'preload_frozen':
+            app.prepare_for_fork()
+        else:
+            app.emotion_analyzer.warm_up()
+
+    children = []
+    for _ in range(workers):
+        report_r, report_w = os.pipe()
+        release_r, release_w = os.pipe()
+        forked = time.monotonic()
+        pid = os.fork()
+        if pid == 0:
+            os.close(report_r)
+            os.close(release_w)
+            try:
+                os.write(report_w, repr(work(requests) - forked).encode())
+                os.close(report_w)
+                os.read(release_r, 1)
+            finally:
+                os._exit(0)
+        os.close(report_w)
+        os.close(release_r)
+        children.append((pid, report_r, release_w))
+
+    # Measure once every worker is done, while they all still run
+    spawn = [float(os.read(report_r, 64)) for _, report_r, _ in children]
+    memory = [memory_mb(pid) for pid, _, _ in children]
+    # Later workers inherited the earlier release pipes: close them all before waiting
+    for _, _, release_w in children:
+        os.close(release_w)
+    for pid, _, _ in children:
+        os.waitpid(pid, 0)
+    return {
+        'spawn_s': statistics.median(spawn),
+        'private_mb': statistics.mean(private for private, _ in memory),
+        'pss_mb': statistics.mean(pss for _, pss in memory),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=1000, help='texts analyzed by each worker')
+    parser.add_argument('--mode', choices=MODES, help=argparse.SUPPRESS)  # one master, run as a subprocess
+    args = parser.parse_args(argv)
+
+    if args.mode:
+        print(json.dumps(run_master(args.mode, args.workers, args.requests)))
+        return
+
+    results = {}
+    for mode in MODES:
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), '--mode', mode,
+                                 '--workers', str(args.workers), '--requests', str(args.requests)],
+                                check=True, capture_output=True, text=True).stdout
+        results[mode] = json.loads(output.strip().splitlines()[-1])
+    print(json.dumps({'workers': args.workers, 'requests': args.requests, 'results': results}, indent=2))
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""Benchmark and regression suite for the analyzer and the Flask endpoints.
+
+Usage:
+    python benchmarks/run.py [--output results.json] [--compare baseline.json] [--threshold 0.2]
+
+Benchmarks:
+    analyze.*   analyze_emotion split by code path (phrase hit, keyword
+                fallback, VADER fallback)
+    detailed.*  get_detailed_analysis at increasing text lengths
+    http.*      end-to-end /analyze and /history through the Flask test
+                client against a temporary database
+
+With --compare, every benchmark also present in the baseline file is
+checked and the script exits with status 1 if any got slower by more than
+--threshold (a fraction: 0.2 means 20%).
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# One input per analyze_emotion code path
+CODE_PATH_TEXTS = {
+    'phrase_hit': "I feel so overwhelmed by everything I have to do this week.",
+    'keyword_fallback': "The deadlines at the office keep piling up again",
+    'vader_fallback': "Lovely afternoon, nice tea outside",
+}
+
+FILLER = "Today I went to the market and then walked home along the river. "
+TEXT_LENGTHS = [100, 1000, 10000]
+
+
+def measure(func, min_time=0.2, repeat=5):
+    """Median seconds per call of func over repeat timing rounds"""
+    func()  # warm up lazily built state
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        if time.perf_counter() - start >= min_time / repeat:
+            break
+        loops *= 2
+
+    rounds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        rounds.append((time.perf_counter() - start) / loops)
+    return statistics.median(rounds)
+
+
+def text_of_length(length):
+    text = (FILLER * (length // len(FILLER) + 1))[:length - 30]
+    return text + " I am so stressed about work."
+
+
+def bench_analyzer(results, min_time):
+    from models.final_emotion_model import FinalEmotionAnalyzer
+    analyzer = FinalEmotionAnalyzer()
+
+    for path, text in CODE_PATH_TEXTS.items():
+        results['analyze.' + path] = measure(lambda: analyzer.analyze_emotion(text), min_time)
+
+    for length in TEXT_LENGTHS:
+        text = text_of_length(length)
+        results['detailed.len_%d' % length] = measure(lambda: analyzer.get_detailed_analysis(text), min_time)
+
+
+def bench_http(results, min_time):
+    workdir = tempfile.mkdtemp(prefix='emotion-bench-')
+    os.environ['DATABASE_PATH'] = os.path.join(workdir, 'bench.db')
+    # One user repeats the same texts: measure every request, not the limiter or coalescing
+    os.environ['RATE_LIMIT_PER_MINUTE'] = '0'
+    os.environ['ANALYZE_COALESCE_WINDOW'] = '0'
+    import app as webapp
+
+    webapp.init_db()
+    client = webapp.app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+        sess['username'] = 'bench'
+
+    payload = {'text': CODE_PATH_TEXTS['phrase_hit']}
+    results['http.analyze'] = measure(lambda: client.post('/analyze', json=payload), min_time)
+    results['http.history'] = measure(lambda: client.get('/history'), min_time)
+
+    if webapp.analysis_writer is not None:
+        webapp.analysis_writer.close()
+    webapp.store.close()
+
+
+def compare(results, baseline, threshold):
+    """Print a comparison table; return the names that regressed"""
+    regressions = []
+    print("%-28s %12s %12s %8s" % ('benchmark', 'baseline us', 'current us', 'change'))
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        old, new = baseline[name] * 1e6, results[name] * 1e6
+        change = new / old - 1 if old else 0.0
+        flag = ''
+        if change > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print("%-28s %12.2f %12.2f %+7.1f%%%s" % (name, old, new, change * 100, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--compare', help='baseline JSON file to check for regressions')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed slowdown fraction (default 0.2)')
+    parser.add_argument('--min-time', type=float, default=0.2, help='seconds spent timing each benchmark')
+    parser.add_argument('--skip-http', action='store_true', help='only run the analyzer benchmarks')
+    args = parser.parse_args(argv)
+
+    results = {}
+    bench_analyzer(results, args.min_time)
+    if not args.skip_http:
+        bench_http(results, args.min_time)
+
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'seconds_per_op': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['seconds_per_op']
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print("\nRegressed beyond %.0f%%: %s" % (args.threshold * 100, ', '.join(regressions)))
+            return 1
+    else:
+        for name in sorted(results):
+            print("%-28s %10.2f us/op" % (name, results[name] * 1e6))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
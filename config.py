@@ -2,11 +2,78 @@ import os
 
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-secret-key-change-in-production'
-    DATABASE_PATH = 'database/users.db'
+    DATABASE_PATH = os.environ.get('DATABASE_PATH') or 'database/users.db'
+    DATABASE_POOL_SIZE = 8
+    DATABASE_BUSY_TIMEOUT = 5.0  # seconds to wait on a locked database
+    
+    # Write-behind queue for user_analyses inserts
+    ANALYSIS_WRITE_BEHIND = True
+    WRITE_BATCH_SIZE = 100
+    WRITE_FLUSH_INTERVAL = 0.05  # seconds
+    WRITE_QUEUE_SIZE = 10000
+    WRITE_FLUSH_TIMEOUT = 1.0  # seconds reads wait for queued rows before serving what is committed
+    
+    # Columnar archive of old analyses (python -m database.archive)
+    ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR') or 'database/archive'
+    ARCHIVE_RETENTION_DAYS = int(os.environ.get('ARCHIVE_RETENTION_DAYS', 180))  # days kept in SQLite
+    ARCHIVE_SEGMENT_ROWS = 50000
     
     # Model configuration
     MODEL_NAME = "j-hartmann/emotion-english-distilroberta-base"
     MAX_TEXT_LENGTH = 512
     
+    # 'rules' (FinalEmotionAnalyzer), 'transformer' (local MODEL_NAME checkpoint)
+    # or 'cascade' (rules first, then VADER, then the model for low-confidence texts)
+    ANALYZER_BACKEND = os.environ.get('ANALYZER_BACKEND') or 'rules'
+    MODEL_DIR = os.environ.get('MODEL_DIR') or 'models/emotion-english-distilroberta-base'
+    MODEL_QUANTIZE = os.environ.get('MODEL_QUANTIZE', '').lower() in ('1', 'true', 'yes')
+    MODEL_MAX_BATCH_SIZE = 16
+    MODEL_MAX_WAIT = 0.005  # seconds to wait for more requests to join a batch
+    CASCADE_RULES_MIN_CONFIDENCE = 0.85     # rule results below this go on to VADER
+    CASCADE_SENTIMENT_MIN_CONFIDENCE = 0.7  # VADER labels below this (Neutral) go on to the model
+    CASCADE_MODEL_MIN_CONFIDENCE = 0.5      # model results below this keep the rule label
+    
+    # Versioned emotion patterns and suggestions; re-read on change (0 disables)
+    RULESET_PATH = os.environ.get('RULESET_PATH') or 'models/ruleset.json'
+    RULESET_RELOAD_INTERVAL = 2.0  # seconds between file change checks
+    
+    # Crisis fast path: alerts go to 'file', 'webhook', 'queue' or 'none'
+    CRISIS_ALERT_SINK = os.environ.get('CRISIS_ALERT_SINK') or 'file'
+    CRISIS_ALERT_PATH = os.environ.get('CRISIS_ALERT_PATH') or 'database/crisis_alerts.jsonl'
+    CRISIS_ALERT_WEBHOOK_URL = os.environ.get('CRISIS_ALERT_WEBHOOK_URL', '')
+    CRISIS_ALERT_QUEUE_SIZE = 1000  # alerts waiting for delivery before new ones are dropped
+    
+    # Browser cache lifetime of /suggestions/<emotion> (revalidated by ETag after)
+    SUGGESTIONS_MAX_AGE = 300  # seconds
+    
+    # Analysis result cache (0 disables it)
+    ANALYSIS_CACHE_SIZE = int(os.environ.get('ANALYSIS_CACHE_SIZE', 0))
+    ANALYSIS_CACHE_LOWERCASE = True
+    ANALYSIS_CACHE_COLLAPSE_WHITESPACE = True
+    ANALYSIS_CACHE_STRIP_PUNCTUATION = False
+    
+    # Build VADER at import (gunicorn.conf.py does this, and more, in the master)
+    ANALYZER_WARM_UP = os.environ.get('ANALYZER_WARM_UP', '').lower() in ('1', 'true', 'yes')
+    
+    # ASGI server (asgi.py): classification threads, queued requests before 503
+    ASGI_WORKERS = int(os.environ.get('ASGI_WORKERS', 4))
+    ASGI_MAX_QUEUE = int(os.environ.get('ASGI_MAX_QUEUE', 64))
+    ASGI_RETRY_AFTER = 1  # seconds, sent with 503 responses
+    
+    # Per-user analysis budget: sustained requests per minute and burst size (0 disables)
+    RATE_LIMIT_PER_MINUTE = int(os.environ.get('RATE_LIMIT_PER_MINUTE', 60))
+    RATE_LIMIT_BURST = 10
+    
+    # Texts accepted in one /analyze/batch request; never more than RATE_LIMIT_BURST
+    # while rate limiting is on, as each text takes a token
+    BATCH_MAX_TEXTS = 1000
+    
+    # Repeats of an /analyze submission by the same user within this window
+    # share the first one's result and saved row (in-flight repeats always do)
+    ANALYZE_COALESCE_WINDOW = float(os.environ.get('ANALYZE_COALESCE_WINDOW', 2.0))  # seconds
+    
+    # Prometheus-style /metrics endpoint and stage timers
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1').lower() in ('1', 'true', 'yes')
+    
     # Session configuration
     PERMANENT_SESSION_LIFETIME = 3600  # 1 hour
\ No newline at end of file
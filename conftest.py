@@ -0,0 +1,50 @@
+import sys
+import os
+import importlib
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+from config import Config
+
+# Keeps app imports in tests off the real database, alert file and analyzer choice
+APP_SETTINGS = {
+    'CRISIS_ALERT_SINK': 'queue',
+    'ANALYSIS_WRITE_BEHIND': False,
+    'ANALYZER_BACKEND': 'rules',
+    'RATE_LIMIT_PER_MINUTE': 0,
+}
+
+
+@pytest.fixture(scope='module')
+def load_app(tmp_path_factory):
+    """Returns load(**settings), which imports a fresh app module (and asgi)
+    with those Config settings on a database of its own. The settings and
+    any app module imported before are put back afterwards."""
+    saved_settings = {}
+    saved_modules = {name: sys.modules.pop(name, None) for name in ('app', 'asgi')}
+    loaded = []
+
+    def load(**settings):
+        settings = dict(APP_SETTINGS, DATABASE_PATH=str(tmp_path_factory.mktemp('app') / 'users.db'), **settings)
+        for name, value in settings.items():
+            saved_settings.setdefault(name, getattr(Config, name))
+            setattr(Config, name, value)
+        for name in ('app', 'asgi'):
+            sys.modules.pop(name, None)
+        app = importlib.import_module('app')
+        loaded.append(app)
+        app.init_db()
+        app.store.create_user('test', 'test@example.com', 'secret')
+        return app
+
+    yield load
+    for app in loaded:
+        if app.crisis_alerts is not None:
+            app.crisis_alerts.close()
+        app.store.close()
+    for name, value in saved_settings.items():
+        setattr(Config, name, value)
+    for name, module in saved_modules.items():
+        sys.modules.pop(name, None)
+        if module is not None:
+            sys.modules[name] = module
@@ -0,0 +1,254 @@
+"""Move analyses past the retention window out of SQLite into columnar segments.
+
+Usage:
+    python -m database.archive [--database PATH] [--directory PATH]
+                               [--retention-days N] [--segment-rows N] [--vacuum]
+    python -m database.archive --export [--user ID] [--since TIME] [--until TIME] > analyses.jsonl
+
+Rows of user_analyses from before the first day of the retention window are
+written in id order to append-only segment files (database.segments), which
+are listed with their min/max timestamps in archive_segments. A segment is
+synced to disk before the transaction that lists it and deletes its rows
+commits, so every row is in exactly one of the two places; an interrupted
+run leaves at most an unlisted segment file behind, which readers ignore.
+Rows re-scored while their segment is written are noticed when deleting and
+their chunk is archived again. Archived rows then leave the trigram search
+index, if database.rescore created one, whose segments are merged afterwards
+to give their space back, in short transactions of their own.
+
+The daily rollup keeps counting archived rows, so summaries and trends are
+unchanged. History pages and database.rescore only see user_analyses:
+archived results are final. SQLite reuses the freed pages for new rows;
+--vacuum also shrinks the file, locking the database while it runs.
+
+With --export, the archived rows matching the filters are written to stdout
+as JSON lines instead, streamed one segment at a time (see Archive).
+"""
+import argparse
+import calendar
+import json
+import os
+import sys
+import time
+from datetime import date, datetime, timedelta, timezone
+import numpy as np
+from config import Config
+from database.segments import COLUMNS, Segment, write_segment
+from database.store import Store, search_words
+
+SELECT_ARCHIVABLE = ("SELECT id, user_id, CAST(strftime('%s', timestamp) AS INTEGER), text_input, emotion, "
+                     "confidence, ruleset_version FROM user_analyses "
+                     "WHERE id > ? AND timestamp < ? AND strftime('%s', timestamp) IS NOT NULL "
+                     "ORDER BY id LIMIT ?")
+INSERT_SEGMENT = ("INSERT INTO archive_segments "
+                  "(name, rows, min_id, max_id, min_timestamp, max_timestamp, archived_before) "
+                  "VALUES (?, ?, ?, ?, ?, ?, ?)")
+SELECT_INDEXED_THROUGH = "SELECT last_id FROM user_analyses_search_progress"
+# An external content index is told the words it holds for a row to forget it
+UNINDEX_ROW = "INSERT INTO user_analyses_search (user_analyses_search, rowid, words) VALUES ('delete', ?, ?)"
+# Deletions only add tombstones; merging segments drops them and the entries
+# they delete. Each step merges about this many pages, in a transaction of its own
+MERGE_SEARCH = "INSERT INTO user_analyses_search (user_analyses_search, rank) VALUES ('merge', -200)"
+DELETE_ROW = ("DELETE FROM user_analyses "
+              "WHERE id = ? AND emotion IS ? AND confidence IS ? AND ruleset_version IS ?")
+VACUUM = "VACUUM"
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+class _Changed(Exception):
+    pass
+
+
+def archive(store, directory, before, segment_rows=50000):
+    """Archive the rows timestamped before the day before (YYYY-MM-DD);
+    returns (segments written, rows archived)"""
+    before = date.fromisoformat(before).isoformat()
+    os.makedirs(directory, exist_ok=True)
+    indexed = store.search_index_available()
+    segments = archived = 0
+    last_id = 0
+    while True:
+        with store.connection() as conn:
+            rows = conn.execute(SELECT_ARCHIVABLE, (last_id, before, segment_rows)).fetchall()
+        if not rows:
+            if archived and indexed:
+                _merge_search_index(store)
+            return segments, archived
+        # A chunk with rows changed meanwhile is read again
+        if _archive_chunk(store, directory, before, rows, indexed):
+            segments += 1
+            archived += len(rows)
+            last_id = rows[-1][0]
+
+
+def _archive_chunk(store, directory, before, rows, indexed=True):
+    name = 'segment-%012d-%012d.col' % (rows[0][0], rows[-1][0])
+    path = os.path.join(directory, name)
+    header = write_segment(path, rows)
+    committed = False
+    try:
+        with store.transaction('archive') as conn:
+            conn.execute(INSERT_SEGMENT, (name, header['rows'], header['min_id'], header['max_id'],
+                                          header['min_timestamp'], header['max_timestamp'], before))
+            deleted = conn.executemany(DELETE_ROW, [(row[0],) + row[4:] for row in rows]).rowcount
+            if deleted != len(rows):
+                raise _Changed()
+        committed = True
+    except _Changed:
+        pass
+    finally:
+        if not committed:
+            os.remove(path)
+    if committed and indexed:
+        _unindex(store, rows)
+    return committed
+
+
+def _unindex(store, rows, chunk_size=1000):
+    """Drop archived rows from the search index, in short transactions.
+
+    Done after the rows are gone, since the search only has to find every
+    row still in user_analyses: entries of deleted rows are merely dead
+    weight, the same as when a run stops before getting here.
+    """
+    for start in range(0, len(rows), chunk_size):
+        with store.transaction('archive') as conn:
+            indexed_through = conn.execute(SELECT_INDEXED_THROUGH).fetchone()[0]
+            conn.executemany(UNINDEX_ROW, [(row[0], search_words(row[3]))
+                                           for row in rows[start:start + chunk_size]
+                                           if row[0] <= indexed_through and row[3] is not None])
+
+
+def _merge_search_index(store):
+    while True:
+        with store.transaction('archive') as conn:
+            changes = conn.total_changes
+            conn.execute(MERGE_SEARCH)
+            # FTS5 makes fewer than two changes when there was nothing left to merge
+            if conn.total_changes - changes < 2:
+                return
+
+
+def unix_time(value):
+    """Unix seconds of a 'YYYY-MM-DD[ HH:MM:SS]' UTC time; None stays None"""
+    if value is None:
+        return None
+    return calendar.timegm(datetime.fromisoformat(value).timetuple())
+
+
+class Archive:
+    """Streaming queries over the archived analyses.
+
+    Segments are picked by the min/max timestamps listed for them and read
+    one at a time through a memory map, so memory use stays bounded by one
+    segment however large the archive grows. since and until are
+    'YYYY-MM-DD[ HH:MM:SS]' UTC times; since is inclusive, until exclusive.
+    """
+
+    def __init__(self, store, directory=Config.ARCHIVE_DIR):
+        self.store = store
+        self.directory = directory
+
+    def _selections(self, user_id, since, until):
+        """Yield (segment, indices of its matching rows) for every segment with matches"""
+        since, until = unix_time(since), unix_time(until)
+        for name, _, min_timestamp, max_timestamp in self.store.archive_segments(since, until):
+            with Segment(os.path.join(self.directory, name)) as segment:
+                mask = np.ones(segment.rows, dtype=bool)
+                if user_id is not None:
+                    mask &= segment.column('user_id') == user_id
+                # Segments wholly inside the range skip the timestamp column
+                if (since is not None and min_timestamp < since) or (until is not None and max_timestamp >= until):
+                    timestamps = segment.column('timestamp')
+                    if since is not None:
+                        mask &= timestamps >= since
+                    if until is not None:
+                        mask &= timestamps < until
+                selection = np.flatnonzero(mask)
+                if len(selection):
+                    yield segment, selection
+
+    def scan(self, columns, user_id=None, since=None, until=None):
+        """Yield a {column: NumPy array} batch of the matching rows per segment,
+        reading only the columns asked for"""
+        for segment, selection in self._selections(user_id, since, until):
+            yield {column: segment.texts(selection) if column == 'text_input'
+                   else segment.column(column)[selection] for column in columns}
+
+    def rows(self, user_id=None, since=None, until=None):
+        """Yield the matching rows as dicts with the columns of user_analyses, in id order.
+
+        Confidences were stored as float32 and are rounded to 4 decimals,
+        which gives back every value that had 4 decimals or fewer.
+        """
+        for batch in self.scan(COLUMNS, user_id, since, until):
+            for values in zip(*(batch[column].tolist() for column in COLUMNS)):
+                row = dict(zip(COLUMNS, values))
+                row['timestamp'] = time.strftime(TIMESTAMP_FORMAT, time.gmtime(row['timestamp']))
+                confidence = row['confidence']
+                row['confidence'] = None if confidence != confidence else round(confidence, 4)
+                yield row
+
+    def emotion_totals(self, user_id=None, since=None, until=None):
+        """{emotion: (count, confidence sum)} over the matching rows, from the
+        emotion codes and confidences alone"""
+        totals = {}
+        for segment, selection in self._selections(user_id, since, until):
+            dictionary, codes = segment.codes('emotion')
+            codes = codes[selection]
+            counts = np.bincount(codes, minlength=len(dictionary))
+            sums = np.bincount(codes, weights=segment.column('confidence')[selection], minlength=len(dictionary))
+            for emotion, count, confidence_sum in zip(dictionary, counts.tolist(), sums.tolist()):
+                if count:
+                    previous = totals.get(emotion, (0, 0.0))
+                    totals[emotion] = (previous[0] + count, previous[1] + confidence_sum)
+        return totals
+
+
+def export(archive, out, user_id=None, since=None, until=None):
+    """Write the matching archived rows to out as JSON lines; returns the row count"""
+    count = 0
+    for row in archive.rows(user_id, since, until):
+        out.write(json.dumps(row) + '\n')
+        count += 1
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Archive old analyses, or export archived ones.')
+    parser.add_argument('--database', default=Config.DATABASE_PATH, help='SQLite database file')
+    parser.add_argument('--directory', default=Config.ARCHIVE_DIR, help='directory of the segment files')
+    parser.add_argument('--retention-days', type=int, default=Config.ARCHIVE_RETENTION_DAYS,
+                        help='days of analyses kept in the database')
+    parser.add_argument('--segment-rows', type=int, default=Config.ARCHIVE_SEGMENT_ROWS, help='rows per segment')
+    parser.add_argument('--vacuum', action='store_true', help='shrink the database file afterwards')
+    parser.add_argument('--export', action='store_true', help='write archived rows to stdout as JSON lines')
+    parser.add_argument('--user', type=int, help='export only this user')
+    parser.add_argument('--since', help='export from this UTC time on (YYYY-MM-DD[ HH:MM:SS])')
+    parser.add_argument('--until', help='export up to this UTC time, exclusive')
+    args = parser.parse_args(argv)
+
+    store = Store(args.database, pool_size=1, busy_timeout=Config.DATABASE_BUSY_TIMEOUT)
+    try:
+        store.init_schema()
+        if args.export:
+            count = export(Archive(store, args.directory), sys.stdout, args.user, args.since, args.until)
+        else:
+            before = (datetime.now(timezone.utc).date() - timedelta(days=args.retention_days)).isoformat()
+            segments, count = archive(store, args.directory, before, args.segment_rows)
+            if args.vacuum:
+                with store.connection() as conn:
+                    conn.execute(VACUUM)
+    except ValueError as exc:
+        parser.exit(1, 'error: %s\n' % exc)
+    finally:
+        store.close()
+    if args.export:
+        print('Exported %d archived rows' % count, file=sys.stderr)
+    else:
+        print('Archived %d rows from before %s in %d segments' % (count, before, segments), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+"""Re-score stored analyses after the ruleset changes.
+
+Usage:
+    python -m database.rescore [--database PATH] [--ruleset PATH] [--chunk-size N]
+                               [--assume-version VERSION]
+
+Analyses produced by the rules are stored with the version of the ruleset
+that scored them, and the app records the definition of every version it
+loads. The job first adds the rows stored since its last run to the trigram
+index over the texts, creating the index on the first run. Then, for each
+older version still found in user_analyses, it diffs that definition against
+the target ruleset (models.ruleset.changed_phrases) and looks up the texts
+containing a changed phrase, or one of its words as a word; no other text
+can be classified differently. Where SQLite lacks FTS5 or its trigram
+tokenizer, the texts of that version are scanned for those terms instead.
+Only those rows are re-classified, in chunks that are each written in one
+transaction together with a checkpoint, so an interrupted run resumes where
+it stopped. Re-scored rows are tagged with the target version; the rest keep
+their version, whose result is still the current one.
+
+Archived rows (database.archive) are no longer in user_analyses and keep
+their results.
+
+Rows without a version (stored before versions were kept, or scored by a
+model backend or as documents) are left alone. When every such row came
+from the rules, --assume-version tags them with the version that scored
+them first, so they are included.
+"""
+import argparse
+import sys
+from config import Config
+from database.store import Store, WORD_SEPARATORS, search_words
+from models.final_emotion_model import FinalEmotionAnalyzer
+from models.phrase_matcher import PhraseMatcher
+from models.ruleset import Ruleset, changed_phrases
+
+SELECT_SOURCE_VERSIONS = ("SELECT DISTINCT ruleset_version FROM user_analyses "
+                          "WHERE ruleset_version IS NOT NULL AND ruleset_version != ? ORDER BY ruleset_version")
+TAG_UNVERSIONED = ("UPDATE user_analyses SET ruleset_version = ? WHERE id IN "
+                   "(SELECT id FROM user_analyses WHERE ruleset_version IS NULL LIMIT ?)")
+SELECT_INDEXED_THROUGH = "SELECT last_id FROM user_analyses_search_progress"
+SELECT_UNINDEXED = "SELECT id, words FROM user_analyses_search_text WHERE id > ? ORDER BY id LIMIT ?"
+INDEX_ROW = "INSERT INTO user_analyses_search (rowid, words) VALUES (?, ?)"
+SET_INDEXED_THROUGH = "UPDATE user_analyses_search_progress SET last_id = ?"
+SELECT_CHECKPOINT = "SELECT last_id FROM rescore_checkpoints WHERE target_version = ? AND source_version = ?"
+SAVE_CHECKPOINT = ("INSERT INTO rescore_checkpoints (target_version, source_version, last_id, rescored, changed) "
+                   "VALUES (?, ?, ?, ?, ?) ON CONFLICT (target_version, source_version) DO UPDATE "
+                   "SET last_id = excluded.last_id, rescored = rescored + excluded.rescored, "
+                   "changed = changed + excluded.changed")
+
+# Candidate row ids are collected once per source version into a temporary table
+CREATE_CANDIDATES = "CREATE TEMP TABLE IF NOT EXISTS rescore_candidates (id INTEGER PRIMARY KEY)"
+CLEAR_CANDIDATES = "DELETE FROM rescore_candidates"
+MATCH_CANDIDATES = ("INSERT OR IGNORE INTO rescore_candidates SELECT rowid FROM user_analyses_search "
+                    "WHERE user_analyses_search MATCH ? AND rowid > ?")
+LIKE_CANDIDATES = ("INSERT OR IGNORE INTO rescore_candidates SELECT id FROM user_analyses_search_text "
+                   "WHERE words LIKE ? ESCAPE '\\' AND id > ?")
+ALL_CANDIDATES = ("INSERT OR IGNORE INTO rescore_candidates SELECT id FROM user_analyses "
+                  "WHERE ruleset_version = ? AND id > ?")
+SELECT_SOURCE_TEXTS = ("SELECT id, text_input FROM user_analyses WHERE ruleset_version = ? AND id > ? "
+                       "ORDER BY id LIMIT ?")
+INSERT_CANDIDATE = "INSERT OR IGNORE INTO rescore_candidates (id) VALUES (?)"
+SELECT_CHUNK = ("SELECT a.id, a.text_input, a.emotion, a.confidence FROM rescore_candidates c "
+                "JOIN user_analyses a ON a.id = c.id WHERE c.id > ? AND a.ruleset_version = ? "
+                "ORDER BY c.id LIMIT ?")
+UPDATE_RESULT = "UPDATE user_analyses SET emotion = ?, confidence = ?, ruleset_version = ? WHERE id = ?"
+UPDATE_VERSION = "UPDATE user_analyses SET ruleset_version = ? WHERE id = ?"
+
+
+def changed_terms(phrases):
+    """Substrings of the search words (database.store.search_words) of exactly
+    the texts containing one of phrases, or one of their words as a word.
+
+    Texts are held with their separators folded to spaces and a space at
+    either end, so ' word ' matches whole words only.
+    """
+    terms = set()
+    for phrase in phrases:
+        for separator in WORD_SEPARATORS:
+            phrase = phrase.replace(separator, ' ')
+        terms.add(phrase)
+        terms.update(' %s ' % word for word in phrase.split())
+    return terms
+
+
+def search_terms(phrases):
+    """(FTS5 query or None, LIKE patterns) for the changed_terms of phrases.
+
+    The trigram index cannot look up terms shorter than three characters;
+    those are scanned for with LIKE instead.
+    """
+    terms = changed_terms(phrases)
+    query = ' OR '.join('"%s"' % term.replace('"', '""') for term in sorted(terms) if len(term) >= 3)
+    patterns = ['%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+                for term in sorted(terms) if len(term) < 3]
+    return query or None, patterns
+
+
+def classify(analyzer, texts):
+    """(emotion, confidence) per text, as classify_text in app.py gives them;
+    the analyzer ranks crisis phrases first itself, and nothing is alerted"""
+    return analyzer.analyze_batch(texts)
+
+
+def index_new_rows(store, chunk_size=5000):
+    """Add the rows stored since the last call to the search index; returns the row count.
+
+    Texts are never changed once stored and ids are not reused, so the
+    index only has to follow the highest id. Ids of deleted rows stay in it
+    and are dropped when candidates are joined back to user_analyses.
+    """
+    indexed = 0
+    while True:
+        with store.transaction('rescore') as conn:
+            last_id = conn.execute(SELECT_INDEXED_THROUGH).fetchone()[0]
+            rows = conn.execute(SELECT_UNINDEXED, (last_id, chunk_size)).fetchall()
+            if not rows:
+                return indexed
+            conn.executemany(INDEX_ROW, rows)
+            conn.execute(SET_INDEXED_THROUGH, (rows[-1][0],))
+        indexed += len(rows)
+
+
+def tag_unversioned(store, version, chunk_size=500):
+    """Tag rows without a ruleset version with version; returns the row count"""
+    tagged = 0
+    while True:
+        with store.transaction('rescore') as conn:
+            count = conn.execute(TAG_UNVERSIONED, (version, chunk_size)).rowcount
+        if not count:
+            return tagged
+        tagged += count
+
+
+def rescore(store, analyzer, chunk_size=500):
+    """Re-score rows scored with older rulesets using analyzer's ruleset.
+
+    Returns {source version: (rows re-scored, rows whose result changed)}
+    for this run. Raises ValueError when the target version was recorded
+    before with another definition, since rows tagged with it would be wrong.
+    """
+    target = analyzer.ruleset
+    if not store.record_ruleset(target):
+        raise ValueError("ruleset version %s is already recorded with other contents; "
+                         "bump the version in the ruleset file" % target.version)
+
+    indexed = store.create_search_index()
+    if indexed:
+        index_new_rows(store)
+    with store.connection() as conn:
+        sources = [row[0] for row in conn.execute(SELECT_SOURCE_VERSIONS, (target.version,))]
+
+    results = {}
+    for source in sources:
+        definition = store.ruleset_definition(source)
+        # Without the old definition there is nothing to diff: every row is a candidate
+        phrases = None if definition is None else changed_phrases(Ruleset.from_dict(definition), target)
+        if phrases == set():
+            continue
+        results[source] = _rescore_version(store, analyzer, target, source, phrases, chunk_size, indexed)
+    return results
+
+
+def _scan_candidates(conn, source, phrases, last_id, chunk_size=5000):
+    """Collect the candidates without the search index, from the texts of the source version"""
+    matcher = PhraseMatcher((term, None) for term in changed_terms(phrases))
+    while True:
+        rows = conn.execute(SELECT_SOURCE_TEXTS, (source, last_id, chunk_size)).fetchall()
+        if not rows:
+            return
+        conn.executemany(INSERT_CANDIDATE, [(row_id,) for row_id, text in rows
+                                            if text is not None and matcher.find_phrases(search_words(text.lower()))])
+        last_id = rows[-1][0]
+
+
+def _rescore_version(store, analyzer, target, source, phrases, chunk_size, indexed=True):
+    # The temporary table belongs to this connection, so it is held throughout
+    with store.connection() as conn:
+        row = conn.execute(SELECT_CHECKPOINT, (target.version, source)).fetchone()
+        last_id = row[0] if row else 0
+        with conn:
+            conn.execute(CREATE_CANDIDATES)
+            conn.execute(CLEAR_CANDIDATES)
+            if phrases is None:
+                conn.execute(ALL_CANDIDATES, (source, last_id))
+            elif not indexed:
+                _scan_candidates(conn, source, phrases, last_id)
+            else:
+                query, patterns = search_terms(phrases)
+                if query:
+                    conn.execute(MATCH_CANDIDATES, (query, last_id))
+                for pattern in patterns:
+                    conn.execute(LIKE_CANDIDATES, (pattern, last_id))
+
+        rescored = changed = 0
+        while True:
+            rows = conn.execute(SELECT_CHUNK, (last_id, source, chunk_size)).fetchall()
+            if not rows:
+                return rescored, changed
+            results = classify(analyzer, [row[1] for row in rows])
+
+            chunk_changed = 0
+            with conn:
+                for (row_id, _, emotion, confidence), result in zip(rows, results):
+                    if result != (emotion, confidence):
+                        conn.execute(UPDATE_RESULT, result + (target.version, row_id))
+                        chunk_changed += 1
+                    else:
+                        conn.execute(UPDATE_VERSION, (target.version, row_id))
+                last_id = rows[-1][0]
+                conn.execute(SAVE_CHECKPOINT, (target.version, source, last_id, len(rows), chunk_changed))
+            rescored += len(rows)
+            changed += chunk_changed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Re-score stored analyses after a ruleset change.')
+    parser.add_argument('--database', default=Config.DATABASE_PATH, help='SQLite database file')
+    parser.add_argument('--ruleset', default=Config.RULESET_PATH, help='ruleset file to re-score with')
+    parser.add_argument('--chunk-size', type=int, default=500, help='rows per transaction and checkpoint')
+    parser.add_argument('--assume-version', help='tag rows without a ruleset version with this one first')
+    args = parser.parse_args(argv)
+
+    analyzer = FinalEmotionAnalyzer(ruleset_path=args.ruleset)
+    store = Store(args.database, pool_size=1, busy_timeout=Config.DATABASE_BUSY_TIMEOUT)
+    try:
+        store.init_schema()
+        if args.assume_version:
+            tagged = tag_unversioned(store, args.assume_version, args.chunk_size)
+            print('Tagged %d rows with ruleset version %s' % (tagged, args.assume_version), file=sys.stderr)
+        results = rescore(store, analyzer, args.chunk_size)
+    except ValueError as exc:
+        parser.exit(1, 'error: %s\n' % exc)
+    finally:
+        store.close()
+    for source, (rescored, changed) in results.items():
+        print('Ruleset %s -> %s: re-scored %d rows, %d changed' % (source, analyzer.ruleset.version,
+                                                                    rescored, changed), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+"""Backfill or rebuild the per-user daily emotion rollup.
+
+Usage:
+    python -m database.rollup [--database PATH] [--user ID ...]
+
+New analyses are added to user_emotion_rollup by a trigger as they are
+inserted, and the rollup migration adds those stored before it. Run this at
+any time to rebuild the rollup from user_analyses. Days
+moved to the archive (database.archive) are kept as they are. Each
+user is rebuilt in a transaction of its own, so the write lock is only held
+briefly and the app can keep running.
+"""
+import argparse
+import sys
+from config import Config
+from database.store import Store
+
+
+def backfill(store, user_ids=None):
+    """Rebuild the rollup for user_ids (default: every user with analyses); returns the user count"""
+    if user_ids is None:
+        user_ids = store.rollup_user_ids()
+    for user_id in user_ids:
+        store.rebuild_rollup(user_id)
+    return len(user_ids)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Backfill or rebuild the per-user daily emotion rollup.')
+    parser.add_argument('--database', default=Config.DATABASE_PATH, help='SQLite database file')
+    parser.add_argument('--user', type=int, action='append', help='only rebuild this user (repeatable)')
+    args = parser.parse_args(argv)
+
+    store = Store(args.database, pool_size=1, busy_timeout=Config.DATABASE_BUSY_TIMEOUT)
+    try:
+        store.init_schema()
+        count = backfill(store, args.user)
+    finally:
+        store.close()
+    print('Rebuilt the rollup for %d users' % count, file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+"""Columnar segment files holding archived analyses.
+
+A segment stores a run of user_analyses rows column by column:
+
+    b'EMOSEG01' | header length (uint32, little-endian) | JSON header | blocks
+
+The header gives the row count, the id and timestamp ranges, the
+dictionaries of the dictionary-encoded columns and the offset, length and
+dtype of every block. Each block is compressed with zlib:
+
+    id, timestamp     int64 deltas (ids ascend and timestamps nearly do)
+    user_id           int64, 0 for NULL
+    user_id_nulls     bool, True where user_id is NULL
+    emotion           codes into the segment's dictionary, uint8 (uint16 past 256 values)
+    ruleset_version   codes, as emotion
+    confidence        float32
+    text_lengths      uint32 byte length of every text
+    text_bytes        the UTF-8 texts, concatenated (NULL texts are empty)
+    text_nulls        bool, True where text_input is NULL
+
+NULL emotions and ruleset versions are dictionary values like any other and
+NULL confidences are stored as NaN. Timestamps are Unix seconds (UTC).
+Segments are written to a temporary file, synced and renamed into place,
+and never modified afterwards. A reader maps the file and decompresses only
+the blocks of the columns it asks for, so scans that do not need the texts
+never page them in.
+"""
+import json
+import mmap
+import os
+import struct
+import zlib
+import numpy as np
+
+MAGIC = b'EMOSEG01'
+HEADER_LENGTH = struct.Struct('<I')
+COMPRESS_LEVEL = 6
+
+COLUMNS = ('id', 'user_id', 'timestamp', 'text_input', 'emotion', 'confidence', 'ruleset_version')
+DICTIONARY_COLUMNS = ('emotion', 'ruleset_version')
+DELTA_COLUMNS = ('id', 'timestamp')
+
+
+def _encode_dictionary(values):
+    """(sorted distinct values, NumPy array of their codes)"""
+    dictionary = sorted(set(values), key=lambda value: (value is None, value or ''))
+    codes = {value: code for code, value in enumerate(dictionary)}
+    if len(dictionary) <= 1 << 8:
+        dtype = np.uint8
+    elif len(dictionary) <= 1 << 16:
+        dtype = np.uint16
+    else:
+        dtype = np.uint32
+    return dictionary, np.fromiter((codes[value] for value in values), dtype=dtype, count=len(values))
+
+
+def _fsync_directory(path):
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def write_segment(path, rows):
+    """Write rows of (id, user_id, timestamp, text_input, emotion, confidence,
+    ruleset_version), in ascending id order, as a segment at path; returns its header"""
+    ids, user_ids, timestamps, texts, emotions, confidences, versions = zip(*rows)
+    ids = np.array(ids, dtype=np.int64)
+    timestamps = np.array(timestamps, dtype=np.int64)
+    user_id_nulls = np.array([user_id is None for user_id in user_ids], dtype=np.bool_)
+    user_ids = np.array([0 if user_id is None else user_id for user_id in user_ids], dtype=np.int64)
+    text_nulls = np.array([text is None for text in texts], dtype=np.bool_)
+    texts = [(text or '').encode('utf-8') for text in texts]
+    emotion_dictionary, emotion_codes = _encode_dictionary(emotions)
+    version_dictionary, version_codes = _encode_dictionary(versions)
+
+    header = {
+        'rows': len(ids),
+        'min_id': int(ids.min()),
+        'max_id': int(ids.max()),
+        'min_timestamp': int(timestamps.min()),
+        'max_timestamp': int(timestamps.max()),
+        'dictionaries': {'emotion': emotion_dictionary, 'ruleset_version': version_dictionary},
+        'blocks': {},
+    }
+    blocks = [
+        ('id', np.diff(ids, prepend=0)),
+        ('user_id', user_ids),
+        ('user_id_nulls', user_id_nulls),
+        ('timestamp', np.diff(timestamps, prepend=0)),
+        ('emotion', emotion_codes),
+        ('ruleset_version', version_codes),
+        ('confidence', np.array(confidences, dtype=np.float32)),
+        ('text_lengths', np.array([len(text) for text in texts], dtype=np.uint32)),
+        ('text_bytes', b''.join(texts)),
+        ('text_nulls', text_nulls),
+    ]
+
+    compressed = []
+    offset = 0
+    for name, values in blocks:
+        data = zlib.compress(values if isinstance(values, bytes) else values.tobytes(), COMPRESS_LEVEL)
+        header['blocks'][name] = {
+            'offset': offset,
+            'length': len(data),
+            'dtype': None if isinstance(values, bytes) else values.dtype.str,
+        }
+        compressed.append(data)
+        offset += len(data)
+    encoded = json.dumps(header, separators=(',', ':')).encode('utf-8')
+
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(MAGIC)
+            f.write(HEADER_LENGTH.pack(len(encoded)))
+            f.write(encoded)
+            for data in compressed:
+                f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    _fsync_directory(path)
+    return header
+
+
+class Segment:
+    """A segment file mapped read-only into memory; close it, or use it as a context manager"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if self._map[:len(MAGIC)] != MAGIC:
+                raise ValueError("%s is not an analysis segment" % path)
+            start = len(MAGIC) + HEADER_LENGTH.size
+            (length,) = HEADER_LENGTH.unpack_from(self._map, len(MAGIC))
+            self.header = json.loads(self._map[start:start + length].decode('utf-8'))
+        except BaseException:
+            self._map.close()
+            raise
+        self._data_start = start + length
+        self.rows = self.header['rows']
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._map.close()
+
+    def _block(self, name):
+        block = self.header['blocks'][name]
+        start = self._data_start + block['offset']
+        with memoryview(self._map)[start:start + block['length']] as compressed:
+            data = zlib.decompress(compressed)
+        return data if block['dtype'] is None else np.frombuffer(data, dtype=block['dtype'])
+
+    def codes(self, name):
+        """(dictionary, NumPy array of codes) of a dictionary-encoded column"""
+        return self.header['dictionaries'][name], self._block(name)
+
+    def column(self, name):
+        """Every value of a column as a NumPy array (of objects for texts, dictionary
+        columns and user ids with NULLs among them, which hold None)"""
+        if name == 'text_input':
+            return self.texts()
+        if name in DICTIONARY_COLUMNS:
+            dictionary, codes = self.codes(name)
+            values = np.empty(len(dictionary), dtype=object)
+            values[:] = dictionary
+            return values[codes]
+        values = self._block(name)
+        if name == 'user_id':
+            nulls = self._block('user_id_nulls')
+            if nulls.any():
+                values = values.astype(object)
+                values[nulls] = None
+            return values
+        return np.cumsum(values) if name in DELTA_COLUMNS else values
+
+    def texts(self, selection=None):
+        """Texts of the rows at the indices in selection (default: all rows)"""
+        lengths = self._block('text_lengths')
+        ends = np.cumsum(lengths, dtype=np.int64)
+        starts = ends - lengths
+        data = self._block('text_bytes')
+        nulls = self._block('text_nulls')
+        if selection is None:
+            selection = range(self.rows)
+        texts = np.empty(len(selection), dtype=object)
+        texts[:] = [None if nulls[i] else data[starts[i]:ends[i]].decode('utf-8') for i in selection]
+        return texts
@@ -0,0 +1,393 @@
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from utils.metrics import DISABLED
+
+logger = logging.getLogger(__name__)
+
+# Statements are kept as module constants so sqlite3's per-connection
+# statement cache reuses the prepared form across requests
+CREATE_USERS = '''CREATE TABLE IF NOT EXISTS users
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  username TEXT UNIQUE NOT NULL,
+                  email TEXT UNIQUE NOT NULL,
+                  password TEXT NOT NULL,
+                  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)'''
+
+CREATE_USER_ANALYSES = '''CREATE TABLE IF NOT EXISTS user_analyses
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  user_id INTEGER,
+                  text_input TEXT,
+                  emotion TEXT,
+                  confidence REAL,
+                  timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                  FOREIGN KEY (user_id) REFERENCES users (id))'''
+
+INSERT_USER = "INSERT INTO users (username, email, password) VALUES (?, ?, ?)"
+SELECT_USER = "SELECT * FROM users WHERE username = ? AND password = ?"
+INSERT_ANALYSIS = ("INSERT INTO user_analyses (user_id, text_input, emotion, confidence, ruleset_version) "
+                   "VALUES (?, ?, ?, ?, ?)")
+# Long inputs are cut down in SQL so full texts never leave the database
+_PREVIEW = "CASE WHEN length(text_input) > 100 THEN substr(text_input, 1, 100) || '...' ELSE text_input END"
+SELECT_HISTORY_PAGE = ("SELECT id, " + _PREVIEW + ", emotion, confidence, timestamp FROM user_analyses "
+                       "WHERE user_id = ? ORDER BY timestamp DESC, id DESC LIMIT ?")
+SELECT_HISTORY_PAGE_AFTER = ("SELECT id, " + _PREVIEW + ", emotion, confidence, timestamp FROM user_analyses "
+                             "WHERE user_id = ? AND (timestamp, id) < (?, ?) "
+                             "ORDER BY timestamp DESC, id DESC LIMIT ?")
+
+# Per-user daily counts, read instead of aggregating user_analyses, so
+# summaries cost O(days x emotions) however many analyses a user has
+SELECT_EMOTION_TOTALS = ("SELECT emotion, SUM(count), SUM(confidence_sum) / SUM(count) FROM user_emotion_rollup "
+                         "WHERE user_id = ? AND day >= ? "
+                         "GROUP BY emotion ORDER BY SUM(count) DESC, emotion")
+SELECT_EMOTION_SERIES = ("SELECT strftime(?, day) AS period, emotion, SUM(count), SUM(confidence_sum) / SUM(count) "
+                         "FROM user_emotion_rollup WHERE user_id = ? AND day >= ? "
+                         "GROUP BY period, emotion ORDER BY period, emotion")
+SELECT_DAILY_ROLLUP = ("SELECT day, emotion, count, confidence_sum FROM user_emotion_rollup "
+                       "WHERE user_id = ? AND day >= ? ORDER BY day, emotion")
+SELECT_ROLLUP_USERS = "SELECT DISTINCT user_id FROM user_analyses ORDER BY user_id"
+# Days before the archive cutoff are no longer in user_analyses; their rollup rows are kept
+_NOT_ARCHIVED = "(SELECT COALESCE(MAX(archived_before), '') FROM archive_segments)"
+DELETE_USER_ROLLUP = "DELETE FROM user_emotion_rollup WHERE user_id = ? AND day >= " + _NOT_ARCHIVED
+INSERT_USER_ROLLUP = ("INSERT INTO user_emotion_rollup (user_id, day, emotion, count, confidence_sum) "
+                      "SELECT user_id, date(timestamp), emotion, COUNT(*), SUM(confidence) FROM user_analyses "
+                      "WHERE user_id = ? AND date(timestamp) >= " + _NOT_ARCHIVED + " "
+                      "GROUP BY date(timestamp), emotion")
+
+INSERT_RULESET = "INSERT OR IGNORE INTO rulesets (version, definition) VALUES (?, ?)"
+SELECT_RULESET = "SELECT definition FROM rulesets WHERE version = ?"
+
+SELECT_ARCHIVE_SEGMENTS = ("SELECT name, rows, min_timestamp, max_timestamp FROM archive_segments "
+                           "WHERE max_timestamp >= ? AND min_timestamp < ? ORDER BY min_id")
+
+PERIOD_FORMATS = {'day': '%Y-%m-%d', 'week': '%Y-W%W'}
+
+# Characters other than ' ' that str.split() breaks words at
+WORD_SEPARATORS = ('\t\n\x0b\x0c\r\x1c\x1d\x1e\x1f\x85\xa0\u1680\u2000\u2001\u2002\u2003\u2004'
+                   '\u2005\u2006\u2007\u2008\u2009\u200a\u2028\u2029\u202f\u205f\u3000')
+
+
+def search_words(text):
+    """text as user_analyses_search_text holds it"""
+    for separator in WORD_SEPARATORS:
+        text = text.replace(separator, ' ')
+    return ' %s ' % text
+
+
+def _fold_separators(column, separators):
+    for separator in separators:
+        column = "replace(%s, char(%d), ' ')" % (column, ord(separator))
+    return column
+
+
+# Texts as the search index holds them: separators folded to spaces and a
+# space at each end, so that ' word ' finds exactly the texts whose split()
+# has that word. Folding is split over a subquery to keep SQLite's parser
+# stack shallow.
+_HALF = len(WORD_SEPARATORS) // 2
+CREATE_SEARCH_TEXT = ("CREATE VIEW IF NOT EXISTS user_analyses_search_text AS "
+                      "SELECT id, ' ' || %s || ' ' AS words FROM (SELECT id, %s AS words FROM user_analyses)"
+                      % (_fold_separators('words', WORD_SEPARATORS[_HALF:]),
+                         _fold_separators('text_input', WORD_SEPARATORS[:_HALF])))
+
+# Trigram index over the texts, for finding the rows a ruleset change can
+# affect. It indexes the view above, so texts are not stored twice, and it
+# is not kept up to date on insert: database.rescore creates it on first use
+# and adds the new rows before every search, off the request path. It needs
+# FTS5 with the trigram tokenizer (SQLite 3.34+), which the app does not.
+CREATE_SEARCH_INDEX = """CREATE VIRTUAL TABLE IF NOT EXISTS user_analyses_search
+       USING fts5(words, content='user_analyses_search_text', content_rowid='id', tokenize='trigram')"""
+PROBE_SEARCH_INDEX = "SELECT rowid FROM user_analyses_search LIMIT 0"
+
+# Schema migrations, applied in order and tracked with PRAGMA user_version
+MIGRATIONS = [
+    "CREATE INDEX IF NOT EXISTS idx_user_analyses_user_time ON user_analyses (user_id, timestamp, id)",
+    """CREATE TABLE IF NOT EXISTS user_emotion_rollup
+                 (user_id INTEGER NOT NULL,
+                  day TEXT NOT NULL,
+                  emotion TEXT NOT NULL,
+                  count INTEGER NOT NULL,
+                  confidence_sum REAL NOT NULL,
+                  PRIMARY KEY (user_id, day, emotion)) WITHOUT ROWID""",
+    # Analyses stored before the rollup existed, added in the same run as the
+    # table; rows its NOT NULL columns cannot hold are skipped
+    """INSERT INTO user_emotion_rollup (user_id, day, emotion, count, confidence_sum)
+       SELECT user_id, date(timestamp), emotion, COUNT(*), SUM(confidence) FROM user_analyses
+       WHERE user_id IS NOT NULL AND date(timestamp) IS NOT NULL AND emotion IS NOT NULL AND confidence IS NOT NULL
+       GROUP BY user_id, date(timestamp), emotion""",
+    # The rollup row is updated inside the transaction of the insert itself
+    """CREATE TRIGGER IF NOT EXISTS user_analyses_rollup AFTER INSERT ON user_analyses
+       BEGIN
+           INSERT INTO user_emotion_rollup (user_id, day, emotion, count, confidence_sum)
+           VALUES (NEW.user_id, date(NEW.timestamp), NEW.emotion, 1, NEW.confidence)
+           ON CONFLICT (user_id, day, emotion) DO UPDATE
+           SET count = count + 1, confidence_sum = confidence_sum + excluded.confidence_sum;
+       END""",
+    # Version of the ruleset that scored each row (NULL: unknown, not re-scored)
+    "ALTER TABLE user_analyses ADD COLUMN ruleset_version TEXT",
+    "CREATE INDEX IF NOT EXISTS idx_user_analyses_ruleset ON user_analyses (ruleset_version, id)",
+    """CREATE TABLE IF NOT EXISTS rulesets
+                 (version TEXT PRIMARY KEY,
+                  definition TEXT NOT NULL,
+                  recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)""",
+    """CREATE TABLE IF NOT EXISTS rescore_checkpoints
+                 (target_version TEXT NOT NULL,
+                  source_version TEXT NOT NULL,
+                  last_id INTEGER NOT NULL,
+                  rescored INTEGER NOT NULL,
+                  changed INTEGER NOT NULL,
+                  PRIMARY KEY (target_version, source_version))""",
+    # Re-scored rows move between rollup rows
+    """CREATE TRIGGER IF NOT EXISTS user_analyses_rollup_update AFTER UPDATE OF emotion, confidence ON user_analyses
+       BEGIN
+           UPDATE user_emotion_rollup SET count = count - 1, confidence_sum = confidence_sum - OLD.confidence
+           WHERE user_id = OLD.user_id AND day = date(OLD.timestamp) AND emotion = OLD.emotion;
+           DELETE FROM user_emotion_rollup
+           WHERE user_id = OLD.user_id AND day = date(OLD.timestamp) AND emotion = OLD.emotion AND count <= 0;
+           INSERT INTO user_emotion_rollup (user_id, day, emotion, count, confidence_sum)
+           VALUES (NEW.user_id, date(NEW.timestamp), NEW.emotion, 1, NEW.confidence)
+           ON CONFLICT (user_id, day, emotion) DO UPDATE
+           SET count = count + 1, confidence_sum = confidence_sum + excluded.confidence_sum;
+       END""",
+    # Texts as the search index holds them, and how far it got (see CREATE_SEARCH_INDEX)
+    CREATE_SEARCH_TEXT,
+    "CREATE TABLE IF NOT EXISTS user_analyses_search_progress (last_id INTEGER NOT NULL)",
+    "INSERT INTO user_analyses_search_progress (last_id) VALUES (0)",
+    # Index of the columnar segments database.archive moved old rows into;
+    # timestamps are Unix seconds, archived_before the cutoff day (YYYY-MM-DD)
+    """CREATE TABLE IF NOT EXISTS archive_segments
+                 (name TEXT PRIMARY KEY,
+                  rows INTEGER NOT NULL,
+                  min_id INTEGER NOT NULL,
+                  max_id INTEGER NOT NULL,
+                  min_timestamp INTEGER NOT NULL,
+                  max_timestamp INTEGER NOT NULL,
+                  archived_before TEXT NOT NULL,
+                  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)""",
+]
+
+
+class Store:
+    """Pooled SQLite access for the app.
+
+    Connections are opened once, tuned for concurrent use (WAL journal,
+    busy timeout) and handed out from a bounded pool instead of being
+    reconnected on every request. With a metrics Registry, pool waits,
+    write transaction times (lock waits included) and "database is locked"
+    failures are recorded.
+    """
+
+    def __init__(self, path, pool_size=8, busy_timeout=5.0, metrics=None):
+        self.path = path
+        self.pool_size = pool_size
+        self.busy_timeout = busy_timeout
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._connections = []
+        
+        metrics = metrics or DISABLED
+        self.pool_wait = metrics.histogram('db_pool_wait_seconds', 'Time spent waiting for a pooled connection')
+        self.transaction_seconds = metrics.histogram('db_transaction_seconds',
+                                                     'Duration of write transactions, lock waits included',
+                                                     ('operation',))
+        self.lock_errors = metrics.counter('db_lock_errors_total', 'Statements that failed with "database is locked"')
+        self.pool_exhausted = metrics.counter('db_pool_exhausted_total',
+                                              'Requests that found no free pooled connection in time')
+        metrics.callback('db_pool_connections', 'Pooled connections by state',
+                         lambda: {('open',): len(self._connections), ('idle',): self._idle.qsize()},
+                         ('state',))
+
+    def _connect(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout,
+                               check_same_thread=False, cached_statements=128)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=%d" % int(self.busy_timeout * 1000))
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-8000")  # ~8 MB page cache
+        return conn
+
+    def acquire(self):
+        """Take a connection from the pool, opening one while under pool_size.
+
+        Raises sqlite3.OperationalError when every connection stays in use
+        for busy_timeout seconds.
+        """
+        with self.pool_wait.time():
+            return self._acquire()
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if len(self._connections) < self.pool_size:
+                conn = self._connect()
+                self._connections.append(conn)
+                return conn
+        try:
+            return self._idle.get(timeout=self.busy_timeout)
+        except queue.Empty:
+            self.pool_exhausted.inc()
+            raise sqlite3.OperationalError("connection pool exhausted: all %d connections in use for %.1f seconds"
+                                           % (self.pool_size, self.busy_timeout)) from None
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    @contextmanager
+    def transaction(self, operation='other'):
+        """Connection whose work is committed on success and rolled back on error"""
+        with self.connection() as conn:
+            try:
+                with self.transaction_seconds.time(operation):
+                    with conn:
+                        yield conn
+            except sqlite3.OperationalError as exc:
+                if 'locked' in str(exc):
+                    self.lock_errors.inc()
+                raise
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+            self._idle = queue.LifoQueue()
+
+    def init_schema(self):
+        with self.transaction() as conn:
+            conn.execute(CREATE_USERS)
+            conn.execute(CREATE_USER_ANALYSES)
+        self.migrate()
+
+    def migrate(self):
+        """Apply any migrations newer than the database's user_version"""
+        with self.transaction() as conn:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            for number, statement in enumerate(MIGRATIONS[version:], start=version + 1):
+                conn.execute(statement)
+                conn.execute("PRAGMA user_version = %d" % number)
+
+    def search_index_available(self):
+        """Whether the trigram search index exists and this SQLite can use it"""
+        try:
+            with self.connection() as conn:
+                conn.execute(PROBE_SEARCH_INDEX).fetchall()
+        except sqlite3.OperationalError:
+            return False
+        return True
+
+    def create_search_index(self):
+        """Create the trigram search index unless it exists; returns False
+        when this SQLite has no FTS5 or no trigram tokenizer"""
+        try:
+            with self.transaction('search_index') as conn:
+                conn.execute(CREATE_SEARCH_INDEX)
+        except sqlite3.OperationalError as exc:
+            if 'locked' in str(exc):
+                raise
+            return False
+        return self.search_index_available()
+
+    def create_user(self, username, email, password):
+        """Insert a user; raises sqlite3.IntegrityError on a duplicate"""
+        with self.transaction('create_user') as conn:
+            conn.execute(INSERT_USER, (username, email, password))
+
+    def find_user(self, username, password):
+        with self.connection() as conn:
+            return conn.execute(SELECT_USER, (username, password)).fetchone()
+
+    def add_analysis(self, user_id, text, emotion, confidence, ruleset_version=None):
+        with self.transaction('add_analysis') as conn:
+            conn.execute(INSERT_ANALYSIS, (user_id, text, emotion, confidence, ruleset_version))
+
+    def add_analyses(self, rows):
+        """Insert many (user_id, text, emotion, confidence, ruleset_version) rows in one transaction"""
+        with self.transaction('add_analyses') as conn:
+            conn.executemany(INSERT_ANALYSIS, rows)
+
+    def history_page(self, user_id, limit=10, after=None):
+        """Newest-first page of (id, preview, emotion, confidence, timestamp).
+
+        after is the (timestamp, id) of the last row of the previous page;
+        the composite index lets each page start where the last one ended.
+        """
+        with self.connection() as conn:
+            if after is None:
+                return conn.execute(SELECT_HISTORY_PAGE, (user_id, limit)).fetchall()
+            return conn.execute(SELECT_HISTORY_PAGE_AFTER, (user_id, after[0], after[1], limit)).fetchall()
+
+    def emotion_summary(self, user_id, period='day', since=''):
+        """Per-emotion totals plus a per-period series, read from the daily rollup.
+
+        since is the first day (YYYY-MM-DD) to include; '' includes all days.
+        """
+        period_format = PERIOD_FORMATS[period]
+        with self.connection() as conn:
+            totals = conn.execute(SELECT_EMOTION_TOTALS, (user_id, since)).fetchall()
+            series = conn.execute(SELECT_EMOTION_SERIES, (period_format, user_id, since)).fetchall()
+        return totals, series
+
+    def daily_rollup(self, user_id, since=''):
+        """(day, emotion, count, confidence_sum) rows from since (YYYY-MM-DD) on"""
+        with self.connection() as conn:
+            return conn.execute(SELECT_DAILY_ROLLUP, (user_id, since)).fetchall()
+
+    def rollup_user_ids(self):
+        with self.connection() as conn:
+            return [row[0] for row in conn.execute(SELECT_ROLLUP_USERS)]
+
+    def rebuild_rollup(self, user_id):
+        """Recompute one user's rollup rows from user_analyses, in one transaction.
+
+        Rows for days that were archived are left as they are.
+        """
+        with self.transaction('rebuild_rollup') as conn:
+            conn.execute(DELETE_USER_ROLLUP, (user_id,))
+            conn.execute(INSERT_USER_ROLLUP, (user_id,))
+
+    def record_ruleset(self, ruleset):
+        """Keep the definition of ruleset.version for later re-scoring; returns
+        False when that version was already recorded with other contents"""
+        definition = json.dumps(ruleset.to_dict(), sort_keys=True)
+        with self.transaction('record_ruleset') as conn:
+            conn.execute(INSERT_RULESET, (ruleset.version, definition))
+            recorded = conn.execute(SELECT_RULESET, (ruleset.version,)).fetchone()[0]
+        if recorded != definition:
+            logger.warning("Ruleset version %s changed without a version bump; "
+                           "rows scored with it cannot be re-scored accurately", ruleset.version)
+            return False
+        return True
+
+    def ruleset_definition(self, version):
+        """Recorded definition (a dict) of a ruleset version, or None"""
+        with self.connection() as conn:
+            row = conn.execute(SELECT_RULESET, (version,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def archive_segments(self, since=None, until=None):
+        """(name, rows, min_timestamp, max_timestamp) of the archive segments
+        that may hold rows from since up to until (Unix seconds, None: unbounded)"""
+        with self.connection() as conn:
+            return conn.execute(SELECT_ARCHIVE_SEGMENTS, (-2 ** 63 if since is None else since,
+                                                          2 ** 63 - 1 if until is None else until)).fetchall()
@@ -0,0 +1,187 @@
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from utils.metrics import DISABLED
+
+logger = logging.getLogger(__name__)
+
+
+class _Flush:
+    def __init__(self):
+        self.done = threading.Event()
+
+
+_STOP = object()
+
+
+class AnalysisWriter:
+    """Write-behind queue for user_analyses rows.
+
+    Requests hand their row to submit() and return immediately; a background
+    thread commits queued rows in group transactions of up to batch_size rows
+    or every flush_interval seconds, whichever comes first. When the queue is
+    full, submit() waits up to put_timeout and then writes the row inline,
+    so a stalled disk slows callers down instead of growing memory.
+
+    Callers were already answered, so rows are not given up on: a failed
+    group commit is retried up to retries times with exponential backoff
+    (retry_backoff doubling up to max_backoff), then the rows are written
+    one by one so a single bad row cannot sink the rest. Rows still failing
+    with sqlite3.OperationalError (a locked or unavailable database) are
+    held and retried ahead of newer rows; once max_queue rows are held, new
+    rows back up in the queue and submit() writes them inline. Only rows
+    the database rejects outright, and rows still held at close(), are lost,
+    and both are counted.
+    """
+
+    def __init__(self, store, batch_size=100, flush_interval=0.05, max_queue=10000, put_timeout=1.0,
+                 retries=3, retry_backoff=0.05, max_backoff=1.0, metrics=None):
+        self.store = store
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.max_queue = max_queue
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.max_backoff = max_backoff
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._closing = threading.Event()
+        self._thread = None
+        self._pid = None
+        
+        metrics = metrics or DISABLED
+        # outcome: written, inline, deferred (held for another attempt), rejected or lost
+        self.rows_written = metrics.counter('analysis_writer_rows_total', 'Rows handled by the writer by outcome',
+                                            ('outcome',))
+        metrics.callback('analysis_writer_queue_depth', 'Rows waiting to be written', self.pending)
+
+    def _ensure_started(self):
+        # Restart after a fork: the writer thread does not survive into children
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='analysis-writer', daemon=True)
+            self._thread.start()
+
+    def submit(self, row):
+        """Queue one (user_id, text, emotion, confidence, ruleset_version) row for writing"""
+        self._ensure_started()
+        try:
+            self._queue.put(row, timeout=self.put_timeout)
+        except queue.Full:
+            self.rows_written.inc('inline')
+            self.store.add_analysis(*row)
+
+    def flush(self, timeout=None):
+        """Block until every row submitted so far is committed; returns False
+        when that did not happen within timeout seconds (None: no limit).
+
+        A full queue is waited on for at most timeout, or put_timeout when
+        there is none, so readers fall back to what is already committed.
+        """
+        if self._thread is None or not self._thread.is_alive():
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        marker = _Flush()
+        try:
+            self._queue.put(marker, timeout=self.put_timeout if timeout is None else timeout)
+        except queue.Full:
+            return False
+        return marker.done.wait(None if deadline is None else max(0.0, deadline - time.monotonic()))
+
+    def close(self):
+        """Commit everything still queued and stop the writer thread"""
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        self._closing.set()
+        self._queue.put(_STOP)
+        thread.join()
+        self._thread = None
+        self._closing.clear()
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _run(self):
+        held = []     # rows not written yet, retried ahead of newer ones
+        waiting = []  # flush markers, released once nothing before them is held
+        while True:
+            if len(held) >= self.max_queue and not self._closing.is_set():
+                # Enough held already: let new rows back up into the queue
+                time.sleep(self.max_backoff)
+                batch = []
+            else:
+                batch = self._next_batch(self.max_backoff if held else None)
+
+            rows = held + [item for item in batch if isinstance(item, tuple)]
+            held = self._write(rows) if rows else []
+            waiting.extend(item for item in batch if isinstance(item, _Flush))
+            stopping = bool(batch) and batch[-1] is _STOP
+            if stopping and held:
+                self.rows_written.inc('lost', amount=len(held))
+                logger.error("Writer stopped with %d analyses it could not write", len(held))
+                held = []
+            if not held:
+                for marker in waiting:
+                    marker.done.set()
+                waiting = []
+            if stopping:
+                return
+
+    def _next_batch(self, timeout):
+        """Up to batch_size items, waiting timeout seconds for the first (None: forever)"""
+        try:
+            batch = [self._queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while (len(batch) < self.batch_size
+               and not isinstance(batch[-1], _Flush) and batch[-1] is not _STOP):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, rows):
+        """Write rows; returns the rows to hold for another attempt"""
+        for attempt in range(self.retries + 1):
+            try:
+                self.store.add_analyses(rows)
+                self.rows_written.inc('written', amount=len(rows))
+                return []
+            except sqlite3.OperationalError:
+                if attempt == self.retries:
+                    logger.warning("Group commit of %d analyses failed %d times; writing them one by one",
+                                   len(rows), attempt + 1, exc_info=True)
+                    break
+                time.sleep(min(self.max_backoff, self.retry_backoff * 2 ** attempt))
+            except Exception:
+                logger.warning("Group commit of %d analyses failed; writing them one by one",
+                               len(rows), exc_info=True)
+                break
+
+        for i, row in enumerate(rows):
+            try:
+                self.store.add_analysis(*row)
+                self.rows_written.inc('written')
+            except sqlite3.OperationalError:
+                # The database is unavailable rather than this row bad: hold the rest
+                self.rows_written.inc('deferred', amount=len(rows) - i)
+                logger.exception("Holding %d analyses for another attempt", len(rows) - i)
+                return rows[i:]
+            except Exception:
+                self.rows_written.inc('rejected')
+                logger.exception("Could not store an analysis for user %s", row[0])
+        return []
@@ -0,0 +1,25 @@
+"""Gunicorn settings for preforked deployments, picked up from the working directory:
+
+    gunicorn app:app
+    gunicorn -k uvicorn.workers.UvicornWorker asgi:application
+
+The app is imported once, in the master (preload_app), which also builds the
+analyzer state (compiled ruleset, keyword matrix, VADER lexicon) before any
+worker exists. Workers are forked from it and share those pages
+copy-on-write instead of each importing and building their own, so they
+start in milliseconds and add little memory per worker; see
+benchmarks/prefork.py.
+"""
+import os
+
+bind = os.environ.get('BIND', '127.0.0.1:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', 4))
+preload_app = True
+
+
+def when_ready(server):
+    # Runs in the master after preloading, before the first worker is forked
+    import app
+    app.init_db()
+    app.store.close()  # SQLite connections must not be carried across fork
+    app.prepare_for_fork()
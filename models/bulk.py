@@ -0,0 +1,191 @@
+"""Bulk emotion classification for large JSONL or CSV corpora.
+
+Usage:
+    python -m models.bulk INPUT [-o OUTPUT] [--text-field text] [--workers N] [--alerts]
+
+Records are streamed from INPUT, grouped into chunks and classified by a
+pool of worker processes that each build one FinalEmotionAnalyzer at start
+up. Only a bounded number of chunks is in flight at any time and results
+are written as soon as they are ready, in input order, so memory use does
+not depend on the size of the input. Each output record is the input record
+with 'emotion', 'confidence' and 'crisis' (whether a crisis phrase was
+found) added, written in the input's format. Crisis texts get the same
+label as from the app; with --alerts they are also sent to the crisis alert
+sink configured for the app (Config.CRISIS_ALERT_SINK). Alerts are delivered
+one at a time as they are found, never dropped, and the command exits with
+status 1 when any could not be delivered.
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+from collections import deque
+from itertools import islice
+from multiprocessing import get_context
+from models.crisis import crisis_alert
+from utils.alerts import describe, make_alert_sink
+
+logger = logging.getLogger(__name__)
+
+_analyzer = None
+
+
+def _init_worker():
+    global _analyzer
+    from models.final_emotion_model import FinalEmotionAnalyzer
+    _analyzer = FinalEmotionAnalyzer()
+
+
+def _classify_chunk(texts):
+    """(emotion, confidence, crisis alert or None) per text"""
+    ruleset = _analyzer.ruleset
+    results = []
+    for text, (emotion, confidence) in zip(texts, _analyzer.analyze_batch(texts)):
+        match = ruleset.crisis_match(text.lower())
+        alert = crisis_alert(match, text, ruleset.version) if match is not None else None
+        results.append((emotion, confidence, alert))
+    return results
+
+
+def detect_format(path):
+    return 'csv' if path.lower().endswith('.csv') else 'jsonl'
+
+
+def read_records(stream, fmt):
+    """Yield one dict per input record"""
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+        return
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        record = json.loads(line)
+        yield record if isinstance(record, dict) else {'text': record}
+
+
+def chunked(records, size):
+    records = iter(records)
+    while True:
+        chunk = list(islice(records, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def classify_stream(records, text_field='text', workers=None, chunk_size=256, max_pending=None):
+    """Yield (record, emotion, confidence, crisis alert or None) in input order.
+
+    At most max_pending chunks (default: two per worker) are queued in the
+    pool at once, which keeps memory flat for inputs of any size.
+    """
+    workers = workers or os.cpu_count() or 1
+    chunks = chunked(records, chunk_size)
+
+    def texts_of(chunk):
+        return [str(record.get(text_field) or '') for record in chunk]
+
+    if workers == 1:
+        _init_worker()
+        for chunk in chunks:
+            for record, result in zip(chunk, _classify_chunk(texts_of(chunk))):
+                yield (record,) + result
+        return
+
+    max_pending = max_pending or workers * 2
+    with get_context().Pool(workers, initializer=_init_worker) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append((chunk, pool.apply_async(_classify_chunk, (texts_of(chunk),))))
+            if len(pending) >= max_pending:
+                yield from _drain_one(pending)
+        while pending:
+            yield from _drain_one(pending)
+
+
+def _drain_one(pending):
+    chunk, result = pending.popleft()
+    for record, classified in zip(chunk, result.get()):
+        yield (record,) + classified
+
+
+class BlockingAlerts:
+    """Deliver each alert to the sink before returning, counting failures.
+
+    Unlike the app's AlertDispatcher nothing is queued or dropped: an
+    offline run can afford to wait for the sink.
+    """
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.sent = 0
+        self.failed = 0
+
+    def send(self, alert):
+        try:
+            self.sink.send(alert)
+            self.sent += 1
+        except Exception:
+            self.failed += 1
+            logger.exception("Failed to deliver alert: %s", describe(alert))
+
+
+def write_results(results, stream, fmt, alerts=None):
+    """Write classified records incrementally, sending crisis alerts to
+    alerts (e.g. BlockingAlerts) if given; returns the number written"""
+    count = 0
+    writer = None
+    for record, emotion, confidence, alert in results:
+        if alert is not None and alerts is not None:
+            alerts.send(alert)
+        row = dict(record, emotion=emotion, confidence=confidence, crisis=alert is not None)
+        if fmt == 'csv':
+            if writer is None:
+                writer = csv.DictWriter(stream, fieldnames=list(row))
+                writer.writeheader()
+            writer.writerow(row)
+        else:
+            stream.write(json.dumps(row, ensure_ascii=False) + '\n')
+        count += 1
+    stream.flush()
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Classify the emotion of every record in a JSONL or CSV file.')
+    parser.add_argument('input', help='JSONL or CSV file to classify')
+    parser.add_argument('-o', '--output', help='output file (default: stdout)')
+    parser.add_argument('--format', choices=['jsonl', 'csv'], help='input/output format (default: from extension)')
+    parser.add_argument('--text-field', default='text', help="field holding the text (default: 'text')")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='worker processes')
+    parser.add_argument('--chunk-size', type=int, default=256, help='records per task sent to a worker')
+    parser.add_argument('--alerts', action='store_true', help="send crisis alerts to the app's alert sink")
+    args = parser.parse_args(argv)
+
+    alerts = None
+    if args.alerts:
+        from config import Config
+        sink = make_alert_sink(Config.CRISIS_ALERT_SINK, path=Config.CRISIS_ALERT_PATH,
+                               url=Config.CRISIS_ALERT_WEBHOOK_URL)
+        if sink is not None:
+            alerts = BlockingAlerts(sink)
+
+    fmt = args.format or detect_format(args.input)
+    with open(args.input, newline='', encoding='utf-8') as source:
+        output = open(args.output, 'w', newline='', encoding='utf-8') if args.output else sys.stdout
+        try:
+            results = classify_stream(read_records(source, fmt), text_field=args.text_field,
+                                      workers=args.workers, chunk_size=args.chunk_size)
+            count = write_results(results, output, fmt, alerts)
+        finally:
+            if output is not sys.stdout:
+                output.close()
+    print('Classified %d records' % count, file=sys.stderr)
+    if alerts is not None and alerts.failed:
+        parser.exit(1, '%d crisis alerts could not be delivered\n' % alerts.failed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+import threading
+import time
+from models.document import analyze_document
+from models.final_emotion_model import emotion_score
+from utils.metrics import DISABLED, LatencyHistogram
+
+TIERS = ('rules', 'sentiment', 'model')
+
+
+class CascadeAnalyzer:
+    """Tiered classification: cheap rules first, heavier scorers only when needed.
+
+    1. rules: phrase and keyword matching from FinalEmotionAnalyzer. A result
+       at or above rules_min_confidence, or for a text too short to
+       analyze, is returned straight away.
+    2. sentiment: VADER on the rule analyzer for the remaining texts. A
+       polar label, at or above sentiment_min_confidence, is returned.
+    3. model: optional heavier backend (e.g. TransformerBackend), last. Its
+       answer is used when it reaches model_min_confidence or when the rules
+       found nothing.
+
+    Texts no tier settles keep the rule result, or else the sentiment
+    label. Per-tier answer counts and latency histograms are available from
+    stats() and, when a metrics Registry is given, exported as
+    cascade_tier_seconds and cascade_answered_total.
+    """
+
+    def __init__(self, rules, model=None, rules_min_confidence=0.85, sentiment_min_confidence=0.7,
+                 model_min_confidence=0.5, metrics=None):
+        self.rules = rules
+        self.model = model
+        self.rules_min_confidence = rules_min_confidence
+        self.sentiment_min_confidence = sentiment_min_confidence
+        self.model_min_confidence = model_min_confidence
+        self._lock = threading.Lock()
+        self.answered = dict.fromkeys(TIERS, 0)
+        self.latency = {tier: LatencyHistogram() for tier in TIERS}
+        
+        metrics = metrics or DISABLED
+        tier_seconds = metrics.histogram('cascade_tier_seconds', 'Time spent in each cascade tier', ('tier',))
+        for tier in TIERS:
+            tier_seconds.attach(self.latency[tier], tier)
+        metrics.callback('cascade_answered_total', 'Texts answered by each cascade tier',
+                         lambda: {(tier,): count for tier, count in self.answered.items()},
+                         ('tier',), kind='counter')
+
+    def _record(self, tier, seconds, answered):
+        with self._lock:
+            if seconds is not None:
+                self.latency[tier].observe(seconds)
+            if answered:
+                self.answered[tier] += 1
+
+    def _rules(self, text):
+        start = time.perf_counter()
+        scores = self.rules.rule_scores(text)
+        # Texts too short to analyze are not worth escalating either
+        confident = bool(scores) and (scores[0]['path'] == 'short'
+                                      or scores[0]['confidence'] >= self.rules_min_confidence)
+        self._record('rules', time.perf_counter() - start, confident)
+        return scores, confident
+
+    def _sentiment(self, text):
+        start = time.perf_counter()
+        result = self.rules.sentiment_label(text)
+        confident = result[1] >= self.sentiment_min_confidence
+        self._record('sentiment', time.perf_counter() - start, confident)
+        return result, confident
+
+    def _use_model(self, rule_emotion, model_confidence, seconds):
+        use_model = rule_emotion is None or model_confidence >= self.model_min_confidence
+        self._record('model', seconds, use_model)
+        return use_model
+
+    def _unsettled(self, rules_matched):
+        """Tier answering a text no tier settled: the rules if they matched, else sentiment"""
+        tier = 'rules' if rules_matched else 'sentiment'
+        self._record(tier, None, True)
+        return tier
+
+    def analyze_emotion(self, text):
+        top = self.analyze_emotion_scores(text, 1)[0]
+        return top['emotion'], top['confidence']
+
+    def analyze_emotion_scores(self, text, k=None):
+        """Ranked emotions from whichever tier answers (see FinalEmotionAnalyzer)"""
+        scores, confident = self._rules(text)
+        if confident:
+            return scores[:k]
+        sentiment, confident = self._sentiment(text)
+        if confident:
+            return [emotion_score(*sentiment, 'sentiment')]
+        if self.model is not None:
+            start = time.perf_counter()
+            model_scores = self.model.analyze_emotion_scores(text, k)
+            rule_emotion = scores[0]['emotion'] if scores else None
+            if self._use_model(rule_emotion, model_scores[0]['confidence'], time.perf_counter() - start):
+                return model_scores
+        if self._unsettled(bool(scores)) == 'rules':
+            return scores[:k]
+        return [emotion_score(*sentiment, 'sentiment')]
+
+    def analyze_batch(self, texts):
+        results = [None] * len(texts)
+        escalated = []
+        for i, text in enumerate(texts):
+            scores, confident = self._rules(text)
+            top = (scores[0]['emotion'], scores[0]['confidence']) if scores else (None, None)
+            if confident:
+                results[i] = top
+                continue
+            sentiment, confident = self._sentiment(text)
+            if confident:
+                results[i] = sentiment
+            else:
+                escalated.append((i, top, sentiment))
+
+        model_results = [None] * len(escalated)
+        per_text = None
+        if escalated and self.model is not None:
+            start = time.perf_counter()
+            model_results = self.model.analyze_batch([texts[i] for i, _, _ in escalated])
+            per_text = (time.perf_counter() - start) / len(escalated)
+        for (i, top, sentiment), model_result in zip(escalated, model_results):
+            if model_result is not None and self._use_model(top[0], model_result[1], per_text):
+                results[i] = model_result
+            else:
+                results[i] = top if self._unsettled(top[0] is not None) == 'rules' else sentiment
+        return results
+
+    @property
+    def ruleset(self):
+        return self.rules.ruleset
+
+    def get_detailed_analysis(self, text):
+        emotion, confidence = self.analyze_emotion(text)
+        return {
+            'primary_emotion': emotion,
+            'confidence': confidence,
+            'intensity': 'High' if confidence > 0.9 else 'Medium' if confidence > 0.8 else 'Low'
+        }
+
+    def analyze_document(self, source, max_sentence_chars=1000):
+        return analyze_document(source, self.analyze_emotion, self.rules.detect_crisis, max_sentence_chars)
+
+    def warm_up(self):
+        self.rules.warm_up()
+        if self.model is not None:
+            self.model.warm_up()
+        return self
+
+    def stats(self):
+        """Per-tier answer counts, hit rates and latency histograms"""
+        with self._lock:
+            total = sum(self.answered.values())
+            return {
+                'total': total,
+                'tiers': {
+                    tier: {
+                        'answered': self.answered[tier],
+                        'hit_rate': self.answered[tier] / total if total else 0.0,
+                        'latency': self.latency[tier].snapshot()
+                    } for tier in TIERS
+                }
+            }
@@ -0,0 +1,94 @@
+import threading
+import time
+from utils.metrics import DISABLED, LatencyHistogram
+
+# Crisis flags carry the analyzer's maximum confidence
+CRISIS_CONFIDENCE = 0.98
+
+
+def crisis_entry(match):
+    """Ranking entry (emotion, confidence, path, phrases) of a text with a
+    crisis match (see Ruleset.crisis_match); it overrides every other result"""
+    _, emotion, _, phrase = match
+    return emotion, CRISIS_CONFIDENCE, 'crisis', (phrase,)
+
+
+def crisis_alert(match, text, ruleset_version, user_id=None):
+    """Alert sent for a text with a crisis match"""
+    return {
+        'emotion': match[1],
+        'phrase': match[3],
+        'user_id': user_id,
+        'text': text,
+        'ruleset_version': ruleset_version,
+        'flagged_at': time.time()
+    }
+
+
+class CrisisDetector:
+    """Dedicated crisis check that runs before any other analysis.
+
+    Only the crisis groups of the current ruleset are scanned, through their
+    own small matcher, so the cost does not grow with the rest of the pattern
+    table or depend on the analyzer backend. A match short-circuits the
+    pipeline: the caller gets the crisis_entry straight away, with no
+    conflict resolution, and an alert is queued on the dispatcher, if any.
+    The rules analyzer ranks crisis matches the same way, so every entry
+    point labels a crisis text alike.
+
+    Latency of every check and of checks that flagged (time-to-flag,
+    including queuing the alert) is kept in separate histograms, exported
+    when a metrics Registry is given.
+    """
+
+    def __init__(self, ruleset_source, alerts=None, metrics=None):
+        self.ruleset_source = ruleset_source
+        self.alerts = alerts
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.flagged = 0
+        self.check_latency = LatencyHistogram()
+        self.flag_latency = LatencyHistogram()
+        
+        metrics = metrics or DISABLED
+        metrics.histogram('crisis_check_seconds', 'Duration of every crisis check').attach(self.check_latency)
+        metrics.histogram('crisis_time_to_flag_seconds',
+                          'Duration of crisis checks that flagged, alert queuing included').attach(self.flag_latency)
+        metrics.callback('crisis_checks_total', 'Texts checked for crisis phrases',
+                         lambda: self.checked, kind='counter')
+        metrics.callback('crisis_flagged_total', 'Texts flagged as a crisis',
+                         lambda: self.flagged, kind='counter')
+
+    def check(self, text, user_id=None):
+        """crisis_entry of text when it contains a crisis phrase, else None"""
+        start = time.perf_counter()
+        ruleset = self.ruleset_source.get()
+        match = ruleset.crisis_match(text.lower())
+        if match is None:
+            self._record(time.perf_counter() - start, False)
+            return None
+        
+        if self.alerts is not None:
+            self.alerts.send(crisis_alert(match, text, ruleset.version, user_id))
+        self._record(time.perf_counter() - start, True)
+        return crisis_entry(match)
+
+    def _record(self, seconds, flagged):
+        with self._lock:
+            self.checked += 1
+            self.check_latency.observe(seconds)
+            if flagged:
+                self.flagged += 1
+                self.flag_latency.observe(seconds)
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                'checked': self.checked,
+                'flagged': self.flagged,
+                'check_latency': self.check_latency.snapshot(),
+                'time_to_flag': self.flag_latency.snapshot()
+            }
+        if self.alerts is not None:
+            stats['alerts'] = self.alerts.stats()
+        return stats
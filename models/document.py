@@ -0,0 +1,102 @@
+import re
+from models.crisis import CRISIS_CONFIDENCE
+
+# Sentence ends: terminal punctuation followed by whitespace, or a line break
+_SENTENCE_END = re.compile(r'[.!?]+(?=\s)|\n')
+
+
+def iter_sentences(source, max_sentence_chars=1000, read_size=4096):
+    """Yield sentences from a string or an iterable of text chunks.
+
+    Only the current unfinished sentence is buffered, and a run of text
+    with no sentence break is cut at max_sentence_chars (at the last space
+    where possible), so memory stays bounded however long the input is.
+    """
+    if isinstance(source, str):
+        text = source
+        source = (text[i:i + read_size] for i in range(0, len(text), read_size))
+
+    buffer = ''
+    for chunk in source:
+        buffer += chunk
+        start = 0
+        for match in _SENTENCE_END.finditer(buffer):
+            sentence = buffer[start:match.end()].strip()
+            if sentence:
+                yield sentence
+            start = match.end()
+        buffer = buffer[start:]
+
+        while len(buffer) > max_sentence_chars:
+            cut = buffer.rfind(' ', 0, max_sentence_chars)
+            if cut <= 0:
+                cut = max_sentence_chars
+            sentence = buffer[:cut].strip()
+            if sentence:
+                yield sentence
+            buffer = buffer[cut:]
+
+    sentence = buffer.strip()
+    if sentence:
+        yield sentence
+
+
+def analyze_document(source, classify, detect_crisis=None, max_sentence_chars=1000):
+    """Classify a long text sentence by sentence.
+
+    classify(sentence) -> (emotion, confidence). detect_crisis(sentence)
+    returns a crisis emotion or None and runs first, so crisis sentences
+    are not classified; the first one stops the scan and decides the
+    document's emotion, with CRISIS_CONFIDENCE. Otherwise the document's
+    emotion is the most frequent sentence emotion, ties going to the
+    higher summed confidence.
+    """
+    timeline = []
+    totals = {}
+    crisis = None
+
+    for index, sentence in enumerate(iter_sentences(source, max_sentence_chars)):
+        crisis_emotion = detect_crisis(sentence) if detect_crisis is not None else None
+        if crisis_emotion is not None:
+            emotion, confidence = crisis_emotion, CRISIS_CONFIDENCE
+        else:
+            emotion, confidence = classify(sentence)
+
+        timeline.append({
+            'index': index,
+            'text': sentence,
+            'emotion': emotion,
+            'confidence': confidence
+        })
+        count, confidence_sum = totals.get(emotion, (0, 0.0))
+        totals[emotion] = (count + 1, confidence_sum + confidence)
+
+        if crisis_emotion is not None:
+            crisis = {'emotion': crisis_emotion, 'sentence_index': index}
+            break
+
+    sentences = len(timeline)
+    distribution = {
+        emotion: {
+            'count': count,
+            'share': round(count / sentences, 3),
+            'average_confidence': round(confidence_sum / count, 3)
+        } for emotion, (count, confidence_sum) in totals.items()
+    }
+
+    if crisis is not None:
+        emotion = crisis['emotion']
+    elif totals:
+        emotion = max(totals, key=lambda e: totals[e])
+    else:
+        emotion = "Neutral"
+    confidence = distribution[emotion]['average_confidence'] if emotion in distribution else 0.5
+
+    return {
+        'emotion': emotion,
+        'confidence': confidence,
+        'sentences': sentences,
+        'crisis': crisis,
+        'timeline': timeline,
+        'distribution': distribution
+    }
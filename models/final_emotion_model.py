@@ -1,126 +1,135 @@
 import re
-import nltk
-from nltk.sentiment import SentimentIntensityAnalyzer
+import threading
+from models.crisis import crisis_entry
+from models.result_cache import ResultCache
+from models.ruleset import CRISIS_PRIORITY, DEFAULT_RULESET_PATH, RulesetSource
+from models.document import analyze_document
+from utils.metrics import DISABLED
+
+VADER_LEXICON = 'sentiment/vader_lexicon.zip'
+
+
+def has_nltk_resource(resource):
+    """Check for a local NLTK resource without touching the network"""
+    import nltk
+    try:
+        nltk.data.find(resource)
+        return True
+    except LookupError:
+        return False
+
+
+# Batches with at least this many keyword-fallback texts score them with NumPy
+VECTORIZED_KEYWORD_MIN_TEXTS = 64
+
+# Ranking given to texts too short to analyze
+SHORT_TEXT_RANKING = (("Neutral", 0.5, 'short', ()),)
+
+
+def emotion_score(emotion, confidence, path, phrases=()):
+    """One entry of an analyze_emotion_scores ranking"""
+    return {'emotion': emotion, 'confidence': confidence, 'path': path, 'phrases': list(phrases)}
 
-# Download required NLTK data
-try:
-    nltk.download('vader_lexicon', quiet=True)
-    nltk.download('punkt', quiet=True)
-except:
-    pass
 
 class FinalEmotionAnalyzer:
-    def __init__(self):
-        self.sia = SentimentIntensityAnalyzer()
-        
-        # PRECISE emotion mapping with priority ordering
-        self.emotion_patterns = [
-            # CRITICAL: Mental health crisis detection (highest priority)
-            {'emotion': 'Depression', 'patterns': [
-                "want to die", "end it all", "kill myself", "suicidal",
-                "no point in anything", "everything feels meaningless"
-            ], 'priority': 100},
-            
-            {'emotion': 'Panic', 'patterns': [
-                "panic attack", "can't breathe", "freaking out"
-            ], 'priority': 95},
-            
-            # Hopelessness (specific patterns)
-            {'emotion': 'Hopelessness', 'patterns': [
-                "so hopeless", "nothing works out", "never get better", 
-                "always fail", "no hope", "completely hopeless"
-            ], 'priority': 90},
-            
-            # Loneliness (specific patterns)
-            {'emotion': 'Loneliness', 'patterns': [
-                "completely alone", "no one cares", "isolated", "abandoned",
-                "no friends", "by myself", "all alone"
-            ], 'priority': 85},
-            
-            # Overwhelm (specific patterns)
-            {'emotion': 'Overwhelm', 'patterns': [
-                "so overwhelmed", "too much on my plate", "don't know where to start",
-                "drowning in work", "can't handle everything", "swamped"
-            ], 'priority': 85},
-            
-            # Stress (specific patterns)
-            {'emotion': 'Stress', 'patterns': [
-                "too many deadlines", "not enough time", "stretched thin",
-                "pressure", "juggling too much", "exhausted from work"
-            ], 'priority': 80},
-            
-            # Anxiety
-            {'emotion': 'Anxiety', 'patterns': [
-                "worrying about everything", "could go wrong", "heart racing",
-                "can't stop thinking", "overthinking", "restless", "nervous"
-            ], 'priority': 75},
-            
-            # Fear
-            {'emotion': 'Fear', 'patterns': [
-                "terrified", "scared to death", "what might happen",
-                "fail this test", "afraid of", "fearful that"
-            ], 'priority': 70},
-            
-            # Anger & Frustration
-            {'emotion': 'Anger', 'patterns': [
-                "so furious", "blood boil", "can't believe it",
-                "enraged", "livid", "outraged"
-            ], 'priority': 65},
-            
-            {'emotion': 'Frustration', 'patterns': [
-                "so difficult", "tired of this", "why people",
-                "frustrated", "stuck", "can't progress"
-            ], 'priority': 60},
-            
-            {'emotion': 'Irritability', 'patterns': [
-                "so irritated", "constant interruptions", "annoyed",
-                "bothered", "aggravated", "on my nerves"
-            ], 'priority': 55},
-            
-            # Positive Emotions
-            {'emotion': 'Excitement', 'patterns': [
-                "so excited", "can't wait", "promoted at work", "new opportunity",
-                "thrilled about", "looking forward to"
-            ], 'priority': 50},
-            
-            {'emotion': 'Joy', 'patterns': [
-                "so happy", "overjoyed", "elated", "blissful", "ecstatic"
-            ], 'priority': 45},
-            
-            {'emotion': 'Happiness', 'patterns': [
-                "absolutely perfect", "great weather", "amazing food", 
-                "wonderful company", "very happy", "good mood"
-            ], 'priority': 40},
-            
-            {'emotion': 'Pride', 'patterns': [
-                "achieved my goal", "proud of myself", "worked hard",
-                "accomplished", "succeeded", "earned it"
-            ], 'priority': 35},
-            
-            {'emotion': 'Gratitude', 'patterns': [
-                "so grateful", "thankful for", "appreciate", "blessed",
-                "fortunate to have", "lucky to be"
-            ], 'priority': 30},
-            
-            # General fallbacks (lowest priority)
-            {'emotion': 'Depression', 'patterns': [
-                "empty inside", "nothing matters", "can't get out of bed"
-            ], 'priority': 20},
-            
-            {'emotion': 'Anxiety', 'patterns': [
-                "worried", "anxious", "stressed"
-            ], 'priority': 15}
-        ]
-        
-        # Emotion conflicts resolution
-        self.conflict_resolution = {
-            'Depression': ['Hopelessness', 'Loneliness'],  # Depression overrides these
-            'Hopelessness': ['Depression'],  # But specific hopelessness patterns win
-            'Loneliness': ['Depression'],    # Specific loneliness patterns win
-            'Overwhelm': ['Stress', 'Anxiety'],  # Overwhelm is more specific than stress
-            'Stress': ['Anxiety'],  # Stress is more specific than anxiety
-            'Excitement': ['Joy', 'Happiness'],  # Excitement is more specific
-        }
+    def __init__(self, cache_size=0, cache_normalize=None, ruleset_path=None, reload_interval=None,
+                 ruleset_source=None, metrics=None):
+        # VADER is only the last fallback, so it is built on first use
+        self._sia = None
+        self._sia_lock = threading.Lock()
+        
+        # Optional result cache (disabled when cache_size is 0)
+        self.cache = ResultCache(cache_size, cache_normalize) if cache_size else None
+        
+        # Emotion patterns, priorities and conflict resolution come from a
+        # versioned ruleset file, reloaded when it changes if reload_interval is set
+        self.ruleset_source = ruleset_source or RulesetSource(ruleset_path or DEFAULT_RULESET_PATH,
+                                                              check_interval=reload_interval)
+        self.ruleset_source.on_swap(lambda ruleset: self.invalidate_cache())
+        
+        # Stage timers and result counters; no-ops unless a metrics Registry is given
+        metrics = metrics or DISABLED
+        self.stage_seconds = metrics.histogram('analyzer_stage_seconds',
+                                               'Time spent in each analyzer stage', ('stage',))
+        self.results = metrics.counter('analyzer_results_total',
+                                       'Analyses by emitted emotion and code path', ('emotion', 'path'))
+
+    @property
+    def sia(self):
+        if self._sia is None:
+            with self._sia_lock:
+                if self._sia is None:
+                    self._sia = self._build_sia()
+        return self._sia
+
+    @sia.setter
+    def sia(self, sia):
+        self._sia = sia
+
+    def _build_sia(self):
+        if not has_nltk_resource(VADER_LEXICON):
+            raise LookupError("NLTK resource 'vader_lexicon' is not installed; "
+                              "run: python -m nltk.downloader vader_lexicon")
+        from nltk.sentiment import SentimentIntensityAnalyzer
+        return SentimentIntensityAnalyzer()
+
+    def warm_up(self):
+        """Build lazy state up front, e.g. in a preforking master before workers fork"""
+        self.sia.polarity_scores("warm up")
+        self._analyze_uncached("warm up text", self.ruleset)
+        self.ruleset.keyword_scores_batch([set()])
+        return self
+
+    @property
+    def ruleset(self):
+        """The current Ruleset snapshot"""
+        return self.ruleset_source.get()
+
+    @property
+    def emotion_patterns(self):
+        return self.ruleset.emotion_patterns
+
+    @emotion_patterns.setter
+    def emotion_patterns(self, patterns):
+        self.ruleset_source.swap(self.ruleset.replace(emotion_patterns=patterns))
+
+    @property
+    def conflict_resolution(self):
+        return self.ruleset.conflict_resolution
+
+    @conflict_resolution.setter
+    def conflict_resolution(self, rules):
+        self.ruleset_source.swap(self.ruleset.replace(conflict_resolution=rules))
+
+    @property
+    def phrase_matcher(self):
+        return self.ruleset.phrase_matcher
+
+    def compile_patterns(self):
+        """Recompile the current ruleset.
+
+        Assigning emotion_patterns or conflict_resolution does this
+        automatically; call it directly after editing the table in place.
+        """
+        self.ruleset_source.swap(self.ruleset.replace())
+
+    def keyword_scores(self, text_words, ruleset=None):
+        """Score emotions by the phrase words present in text_words"""
+        return (ruleset or self.ruleset).keyword_scores(text_words)
+
+    def invalidate_cache(self):
+        """Forget cached results computed with an older pattern table"""
+        if self.cache is not None:
+            self.cache.clear()
+
+    def cache_stats(self):
+        """Hit/miss/eviction counters of the result cache, or None if disabled"""
+        return self.cache.stats() if self.cache is not None else None
+
+    def match_patterns(self, text_lower):
+        """Return every matched (emotion, priority, phrase) in a single pass"""
+        return [(emotion, priority, phrase)
+                for _, emotion, priority, phrase in self.ruleset.matched_groups(text_lower)]
 
     def exact_pattern_match(self, text, patterns):
         """Check for exact phrase matches"""
@@ -130,12 +139,13 @@ class FinalEmotionAnalyzer:
                 return True
         return False
 
-    def calculate_confidence(self, text, emotion, priority):
+    def calculate_confidence(self, text, emotion, priority, text_lower=None):
         """Calculate high confidence based on pattern match and priority"""
         base_confidence = 0.85 + (priority * 0.001)  # Higher priority = higher confidence
         
         # Boost for exact matches
-        text_lower = text.lower()
+        if text_lower is None:
+            text_lower = text.lower()
         
         # Emotional intensity indicators
         if '!' in text:
@@ -149,10 +159,12 @@ class FinalEmotionAnalyzer:
             
         return min(base_confidence, 0.98)
 
-    def resolve_emotion_conflicts(self, detected_emotions):
+    def resolve_emotion_conflicts(self, detected_emotions, conflict_resolution=None):
         """Resolve conflicts between overlapping emotions"""
         if not detected_emotions:
             return None
+        if conflict_resolution is None:
+            conflict_resolution = self.conflict_resolution
             
         # Sort by priority (highest first)
         detected_emotions.sort(key=lambda x: x['priority'], reverse=True)
@@ -163,67 +175,189 @@ class FinalEmotionAnalyzer:
         # Check for conflicts
         for emotion_data in detected_emotions[1:]:
             emotion = emotion_data['emotion']
-            if emotion in self.conflict_resolution.get(top_emotion['emotion'], []):
+            if emotion in conflict_resolution.get(top_emotion['emotion'], []):
                 # If current emotion should override the top one, swap them
-                if top_emotion['emotion'] in self.conflict_resolution.get(emotion, []):
+                if top_emotion['emotion'] in conflict_resolution.get(emotion, []):
                     top_emotion = emotion_data
         
         return top_emotion
 
     def analyze_emotion(self, text):
         """Main analysis with conflict resolution"""
+        emotion, confidence, _, _ = self._ranked(text)[0]
+        return emotion, confidence
+
+    def analyze_emotion_scores(self, text, k=None):
+        """Every detected emotion, best first, from the same single scan.
+
+        Each entry is a dict with emotion, confidence, path ('short',
+        'crisis', 'phrase', 'keyword' or 'sentiment') and the matched phrases. The
+        first entry is what analyze_emotion returns; k limits the list.
+        """
+        return [emotion_score(*entry) for entry in self._ranked(text)[:k]]
+
+    def _ranked(self, text):
         if len(text.strip()) < 5:
-            return "Neutral", 0.5
-            
-        text_lower = text.lower()
+            self.results.inc("Neutral", 'short')
+            return SHORT_TEXT_RANKING
+        
+        # One snapshot for the whole analysis, even if the ruleset is swapped meanwhile
+        ruleset = self.ruleset
+        if self.cache is not None:
+            with self.stage_seconds.time('normalize'):
+                key = (ruleset.generation, self.cache.key(text))
+            ranked = self.cache.get(key)
+            if ranked is None:
+                ranked = self._analyze_uncached(text, ruleset)
+                self.cache.put(key, ranked)
+            else:
+                self.results.inc(ranked[0][0], 'cache')
+            return ranked
+        
+        return self._analyze_uncached(text, ruleset)
+
+    def _analyze_uncached(self, text, ruleset):
+        with self.stage_seconds.time('normalize'):
+            text_lower = text.lower()
+        with self.stage_seconds.time('phrase_match'):
+            matched_groups = ruleset.matched_groups(text_lower)
+        return self._classify(text, text_lower, matched_groups, ruleset)
+
+    def analyze_batch(self, texts):
+        """Analyze many texts at once; results are returned in input order"""
+        results = [None] * len(texts)
+        ruleset = self.ruleset
+        
+        # Duplicate texts are classified once and share the result
+        pending = {}
+        for i, text in enumerate(texts):
+            if len(text.strip()) < 5:
+                self.results.inc("Neutral", 'short')
+                results[i] = ("Neutral", 0.5)
+                continue
+            if self.cache is not None:
+                cached = self.cache.get((ruleset.generation, self.cache.key(text)))
+                if cached is not None:
+                    self.results.inc(cached[0][0], 'cache')
+                    results[i] = cached[0][:2]
+                    continue
+            pending.setdefault(text, []).append(i)
+        
+        unique_texts = list(pending)
+        with self.stage_seconds.time('normalize'):
+            lowered = [text.lower() for text in unique_texts]
+        with self.stage_seconds.time('phrase_match'):
+            matched = [ruleset.groups_for_phrases(phrases)
+                       for phrases in ruleset.phrase_matcher.find_phrases_batch(lowered)]
+        
+        # Texts without a phrase match fall back to keywords; score those together
+        keyword_scores = {}
+        fallback = [j for j, matched_groups in enumerate(matched) if not matched_groups]
+        if len(fallback) >= VECTORIZED_KEYWORD_MIN_TEXTS:
+            with self.stage_seconds.time('keyword_fallback'):
+                scores = ruleset.keyword_scores_batch([set(lowered[j].split()) for j in fallback])
+            keyword_scores = dict(zip(fallback, scores))
+        
+        for j, (text, text_lower, matched_groups) in enumerate(zip(unique_texts, lowered, matched)):
+            ranked = self._classify(text, text_lower, matched_groups, ruleset, keyword_scores.get(j))
+            if self.cache is not None:
+                self.cache.put((ruleset.generation, self.cache.key(text)), ranked)
+            for i in pending[text]:
+                results[i] = ranked[0][:2]
+        
+        return results
+
+    def _classify(self, text, text_lower, matched_groups, ruleset, emotion_scores=None):
+        """Rank matched pattern groups, falling back to keywords and sentiment"""
+        ranked = self._rank_rules(text, text_lower, matched_groups, ruleset, emotion_scores)
+        if not ranked:
+            emotion, confidence = self.sentiment_label(text)
+            ranked = ((emotion, confidence, 'sentiment', ()),)
+        self.results.inc(ranked[0][0], ranked[0][2])
+        return ranked
+
+    def analyze_rules(self, text):
+        """Phrase and keyword tiers only; returns (emotion, confidence, path).
+
+        path is 'short', 'crisis', 'phrase' or 'keyword'; when neither tier
+        matches the result is (None, None, None) and no sentiment analysis is done.
+        """
+        ranked = self._rule_ranking(text)
+        if not ranked:
+            return None, None, None
+        return ranked[0][:3]
+
+    def rule_scores(self, text, k=None):
+        """analyze_emotion_scores restricted to the phrase and keyword tiers
+        (an empty list when neither matches)"""
+        return [emotion_score(*entry) for entry in self._rule_ranking(text)[:k]]
+
+    def _rule_ranking(self, text):
+        if len(text.strip()) < 5:
+            return SHORT_TEXT_RANKING
+        ruleset = self.ruleset
+        with self.stage_seconds.time('normalize'):
+            text_lower = text.lower()
+        with self.stage_seconds.time('phrase_match'):
+            matched_groups = ruleset.matched_groups(text_lower)
+        return self._rank_rules(text, text_lower, matched_groups, ruleset)
+
+    def _rank_rules(self, text, text_lower, matched_groups, ruleset, emotion_scores=None):
+        """Ranked (emotion, confidence, path, phrases) tuples from the phrase
+        tier, or else the keyword tier; empty when neither matches.
+
+        emotion_scores, when given, are the text's precomputed keyword scores.
+        A crisis phrase outranks everything else, as with CrisisDetector.
+        """
+        # matched_groups is in table order, so this is the group crisis_match finds
+        for match in matched_groups:
+            if match[2] >= CRISIS_PRIORITY:
+                return (crisis_entry(match),)
+        
         detected_emotions = []
         
-        # Check all emotion patterns in priority order
-        for emotion_data in self.emotion_patterns:
-            emotion = emotion_data['emotion']
-            patterns = emotion_data['patterns']
-            priority = emotion_data['priority']
-            
-            if self.exact_pattern_match(text_lower, patterns):
-                confidence = self.calculate_confidence(text, emotion, priority)
-                detected_emotions.append({
+        # Single scan over the text; one detection per matched pattern group
+        groups = {}
+        for index, emotion, priority, phrase in matched_groups:
+            detection = groups.get(index)
+            if detection is None:
+                detection = groups[index] = {
                     'emotion': emotion,
-                    'confidence': confidence,
-                    'priority': priority
-                })
+                    'confidence': self.calculate_confidence(text, emotion, priority, text_lower),
+                    'priority': priority,
+                    'phrases': []
+                }
+                detected_emotions.append(detection)
+            detection['phrases'].append(phrase)
         
-        # Resolve conflicts and get final emotion
+        # Resolve conflicts for the winner; the rest follow by priority
         if detected_emotions:
-            final_emotion_data = self.resolve_emotion_conflicts(detected_emotions)
+            final_emotion_data = self.resolve_emotion_conflicts(detected_emotions, ruleset.conflict_resolution)
             if final_emotion_data:
-                return final_emotion_data['emotion'], round(final_emotion_data['confidence'], 3)
+                ranked = {}
+                for detection in [final_emotion_data] + detected_emotions:
+                    emotion = detection['emotion']
+                    if emotion in ranked:
+                        # Another group for the same emotion only adds its phrases
+                        ranked[emotion][3].extend(p for p in detection['phrases'] if p not in ranked[emotion][3])
+                        continue
+                    ranked[emotion] = (emotion, round(detection['confidence'], 3), 'phrase', list(detection['phrases']))
+                return tuple((emotion, confidence, path, tuple(phrases))
+                             for emotion, confidence, path, phrases in ranked.values())
         
         # Fallback: Check for keyword presence
-        text_words = set(text_lower.split())
-        emotion_scores = {}
-        
-        for emotion_data in self.emotion_patterns:
-            emotion = emotion_data['emotion']
-            score = 0
-            for pattern in emotion_data['patterns']:
-                pattern_words = set(pattern.split())
-                if pattern_words.issubset(text_words):
-                    score += len(pattern_words) * 2
-                else:
-                    # Partial match
-                    common_words = pattern_words.intersection(text_words)
-                    score += len(common_words)
-            
-            if score > 0:
-                emotion_scores[emotion] = score
+        if emotion_scores is None:
+            with self.stage_seconds.time('keyword_fallback'):
+                emotion_scores = ruleset.keyword_scores(set(text_lower.split()))
         
-        if emotion_scores:
-            top_emotion = max(emotion_scores.items(), key=lambda x: x[1])
-            confidence = min(0.7 + (top_emotion[1] / 50), 0.85)
-            return top_emotion[0], round(confidence, 3)
-        
-        # Final fallback: Sentiment analysis
-        sentiment = self.sia.polarity_scores(text)['compound']
+        # Highest score first; ties keep table order, like max() picking the winner
+        return tuple((emotion, round(min(0.7 + (score / 50), 0.85), 3), 'keyword', ())
+                     for emotion, score in sorted(emotion_scores.items(), key=lambda x: -x[1]))
+
+    def sentiment_label(self, text):
+        """Final fallback: coarse label from VADER sentiment"""
+        with self.stage_seconds.time('vader'):
+            sentiment = self.sia.polarity_scores(text)['compound']
         if sentiment > 0.5:
             return "Positive", 0.7
         elif sentiment < -0.5:
@@ -231,9 +365,18 @@ class FinalEmotionAnalyzer:
         else:
             return "Neutral", 0.6
 
+    def detect_crisis(self, text):
+        """Return the emotion of a matched crisis pattern, or None"""
+        match = self.ruleset.crisis_match(text.lower())
+        return match[1] if match is not None else None
+
+    def analyze_document(self, source, max_sentence_chars=1000):
+        """Sentence-by-sentence analysis of a long text (or iterable of chunks)"""
+        return analyze_document(source, self.analyze_emotion, self.detect_crisis, max_sentence_chars)
+
     def get_detailed_analysis(self, text):
         """Get comprehensive analysis"""
-        emotion, confidence = self.analyze_emotion(text)
+        emotion, confidence, _, _ = self._ranked(text)[0]
         
         return {
             'primary_emotion': emotion,
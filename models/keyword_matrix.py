@@ -0,0 +1,80 @@
+"""Vectorized keyword fallback for large batches.
+
+KeywordMatrix computes the same scores as Ruleset.keyword_scores for many
+texts at once. The inverted index of the ruleset is flattened into index
+arrays, CSR style: the phrases of every vocabulary word are one slice of a
+single array. A chunk of texts becomes the (text, word) pairs of the words
+they contain, which are expanded into (text, phrase) pairs and counted with
+np.unique to give the shared words per phrase. Phrases whose words all occur
+are doubled, and since phrases are numbered in table order the counts of a
+text's pattern groups are contiguous and summed with np.add.reduceat.
+
+Memory therefore grows with the number of matches rather than with texts
+times vocabulary or phrases. Every count is an int64, so the scores are
+identical to the scalar path. Only the final per-text dicts are built in
+Python, from the non-zero group scores.
+"""
+import numpy as np
+
+
+class KeywordMatrix:
+    def __init__(self, ruleset, chunk_size=4096):
+        self.chunk_size = chunk_size
+        words = sorted(ruleset.keyword_index)
+        self.vocabulary = {word: i for i, word in enumerate(words)}
+        keys = sorted(ruleset.phrase_word_counts)  # (group index, phrase index) in table order
+        columns = {key: i for i, key in enumerate(keys)}
+
+        # The phrases of word i are word_phrases[word_starts[i]:word_starts[i + 1]]
+        lengths = [len(ruleset.keyword_index[word]) for word in words]
+        self.word_starts = np.zeros(len(words) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self.word_starts[1:])
+        self.word_phrases = np.array([columns[key] for word in words for key in ruleset.keyword_index[word]],
+                                     dtype=np.int64)
+        self.word_counts = np.array([ruleset.phrase_word_counts[key] for key in keys], dtype=np.int64)
+        self.phrase_groups = np.array([key[0] for key in keys], dtype=np.int64)
+        self.emotions = [emotion_data['emotion'] for emotion_data in ruleset.emotion_patterns]
+
+    def scores(self, word_sets):
+        """keyword_scores(words) for every set of words, in order"""
+        results = []
+        for start in range(0, len(word_sets), self.chunk_size):
+            results.extend(self._score_chunk(word_sets[start:start + self.chunk_size]))
+        return results
+
+    def _score_chunk(self, word_sets):
+        rows = []
+        columns = []
+        vocabulary = self.vocabulary
+        for row, words in enumerate(word_sets):
+            for word in words:
+                column = vocabulary.get(word)
+                if column is not None:
+                    rows.append(row)
+                    columns.append(column)
+        results = [{} for _ in word_sets]
+        if not rows:
+            return results
+        rows = np.array(rows, dtype=np.int64)
+        columns = np.array(columns, dtype=np.int64)
+
+        # Expand every (text, word) pair into the (text, phrase) pairs of its slice
+        starts = self.word_starts[columns]
+        lengths = self.word_starts[columns + 1] - starts
+        offsets = np.cumsum(lengths) - lengths
+        phrases = self.word_phrases[np.repeat(starts - offsets, lengths) + np.arange(lengths.sum())]
+        phrase_count = len(self.word_counts)
+        pairs, shared = np.unique(np.repeat(rows, lengths) * phrase_count + phrases, return_counts=True)
+        pair_rows, pair_phrases = np.divmod(pairs, phrase_count)
+        shared *= 1 + (shared == self.word_counts[pair_phrases])  # all of a phrase's words: double it
+
+        # Pairs are sorted by text, then phrase, so each group's phrases are adjacent
+        groups = pair_rows * len(self.emotions) + self.phrase_groups[pair_phrases]
+        firsts = np.flatnonzero(np.diff(groups, prepend=-1))
+        group_scores = np.add.reduceat(shared, firsts)
+
+        # Walk the scores row by row, in group order, like the scalar loop
+        hit_rows, hit_groups = np.divmod(groups[firsts], len(self.emotions))
+        for row, group, value in zip(hit_rows.tolist(), hit_groups.tolist(), group_scores.tolist()):
+            results[row][self.emotions[group]] = value
+        return results
@@ -0,0 +1,115 @@
+import re
+from bisect import bisect_right
+
+
+class PhraseMatcher:
+    """Single-pass substring matcher for a fixed table of phrases.
+
+    All phrases are folded into one trie-shaped regex that is scanned once
+    over the (already lowercased) text. At every position the regex yields
+    the longest phrase starting there; any shorter phrases that are prefixes
+    of it are recovered from a precomputed table, so the result is exactly
+    the set of phrases for which ``phrase in text`` holds.
+    """
+
+    SEPARATOR = '\x00'
+
+    def __init__(self, entries):
+        # entries: iterable of (phrase, payload); one phrase may carry many payloads
+        self.payloads = {}
+        for phrase, payload in entries:
+            if not phrase:
+                continue
+            self.payloads.setdefault(phrase, []).append(payload)
+
+        trie = {}
+        for phrase in self.payloads:
+            node = trie
+            for ch in phrase:
+                node = node.setdefault(ch, {})
+            node[''] = True
+
+        # Shorter phrases that also match wherever a longer one matches
+        self.prefixes = {}
+        for phrase in self.payloads:
+            node = trie
+            found = []
+            for i, ch in enumerate(phrase[:-1]):
+                node = node[ch]
+                if '' in node:
+                    found.append(phrase[:i + 1])
+            self.prefixes[phrase] = found
+
+        body = self._trie_pattern(trie)
+        self.regex = re.compile('(?=(' + body + '))') if body else None
+
+    def _trie_pattern(self, node):
+        branches = [re.escape(ch) + self._trie_pattern(child)
+                    for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        if '' in node:
+            body = '(?:' + body + ')?'
+        return body
+
+    def to_dict(self):
+        """JSON-compatible form of the compiled matcher (see from_dict)"""
+        return {
+            'payloads': self.payloads,
+            'prefixes': self.prefixes,
+            'pattern': self.regex.pattern if self.regex is not None else None
+        }
+
+    @classmethod
+    def from_dict(cls, data, payload=tuple):
+        """Matcher restored from to_dict() without rebuilding the trie; payload
+        turns each payload back from its JSON form"""
+        matcher = cls.__new__(cls)
+        matcher.payloads = {phrase: [payload(value) for value in values]
+                            for phrase, values in data['payloads'].items()}
+        matcher.prefixes = {phrase: list(data['prefixes'][phrase]) for phrase in matcher.payloads}
+        matcher.regex = re.compile(data['pattern']) if data['pattern'] is not None else None
+        return matcher
+
+    def find_phrases(self, text):
+        """Return the set of phrases occurring anywhere in text"""
+        found = set()
+        if self.regex is None:
+            return found
+        for match in self.regex.finditer(text):
+            phrase = match.group(1)
+            if phrase not in found:
+                found.add(phrase)
+                found.update(self.prefixes[phrase])
+        return found
+
+    def find_phrases_batch(self, texts):
+        """Return one set of matched phrases per text, scanning the batch once"""
+        if self.regex is None:
+            return [set() for _ in texts]
+        if any(self.SEPARATOR in phrase for phrase in self.payloads):
+            return [self.find_phrases(text) for text in texts]
+
+        # Phrases never contain the separator, so no match can straddle two texts
+        starts = []
+        offset = 0
+        for text in texts:
+            starts.append(offset)
+            offset += len(text) + 1
+        joined = self.SEPARATOR.join(texts)
+
+        results = [set() for _ in texts]
+        for match in self.regex.finditer(joined):
+            phrase = match.group(1)
+            found = results[bisect_right(starts, match.start()) - 1]
+            if phrase not in found:
+                found.add(phrase)
+                found.update(self.prefixes[phrase])
+        return results
+
+    def match(self, text):
+        """Return every (phrase, payload) pair matched in text"""
+        return [(phrase, payload)
+                for phrase in self.find_phrases(text)
+                for payload in self.payloads[phrase]]
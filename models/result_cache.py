@@ -0,0 +1,81 @@
+import re
+import string
+import threading
+from collections import OrderedDict
+
+_WHITESPACE = re.compile(r'\s+')
+_PUNCTUATION = str.maketrans('', '', string.punctuation)
+
+
+def make_normalizer(lowercase=True, collapse_whitespace=True, strip_punctuation=False):
+    """Build the function that maps a text to its cache key.
+
+    Every option folds more inputs onto one entry. Punctuation matters to the
+    analyzer ('!' raises confidence) and case matters to VADER, so texts that
+    differ only in those ways share whichever result was computed first.
+    """
+    def normalize(text):
+        if lowercase:
+            text = text.lower()
+        if strip_punctuation:
+            text = text.translate(_PUNCTUATION)
+        if collapse_whitespace:
+            text = _WHITESPACE.sub(' ', text).strip()
+        return text
+    return normalize
+
+
+class ResultCache:
+    """Thread-safe bounded LRU cache of analysis results keyed on normalized text"""
+
+    def __init__(self, max_entries, normalize=None):
+        if max_entries <= 0:
+            raise ValueError("max_entries must be positive")
+        self.max_entries = max_entries
+        self.normalize = normalize or make_normalizer()
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def key(self, text):
+        return self.normalize(text)
+
+    def get(self, key):
+        """Return the cached result for key, or None on a miss"""
+        with self._lock:
+            result = self._entries.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, key, result):
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Drop every entry, e.g. after the pattern table changed"""
+        with self._lock:
+            if self._entries:
+                self._entries.clear()
+                self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
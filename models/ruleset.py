@@ -0,0 +1,325 @@
+import difflib
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from models.phrase_matcher import PhraseMatcher
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RULESET_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ruleset.json')
+
+# Bump when the compiled layout changes so stale artifacts are rebuilt
+ARTIFACT_FORMAT = 1
+
+# Suggestions served per emotion
+SUGGESTION_LIMIT = 5
+
+# Pattern groups at or above this priority are mental health crisis signals
+CRISIS_PRIORITY = 100
+
+
+class Ruleset:
+    """One immutable snapshot of the rule data and its compiled indexes.
+
+    Holds the emotion patterns, conflict resolution table and suggestion
+    lists from the ruleset file, plus the phrase matcher and keyword index
+    built from them. Analyses take one snapshot and use it throughout, so a
+    reload never changes the rules halfway through a request.
+    """
+
+    def __init__(self, emotion_patterns, conflict_resolution, suggestions=None,
+                 default_suggestions=None, version='unversioned', matchers=None):
+        self.version = version
+        self.emotion_patterns = emotion_patterns
+        self.conflict_resolution = conflict_resolution
+        self.suggestions = suggestions or {}
+        self.default_suggestions = default_suggestions or []
+        self.generation = 0
+        self.compile(matchers)
+
+    @classmethod
+    def from_dict(cls, data, matchers=None):
+        return cls(data['emotion_patterns'], data['conflict_resolution'],
+                   data.get('suggestions'), data.get('default_suggestions'),
+                   str(data.get('version', 'unversioned')), matchers)
+
+    def to_dict(self):
+        return {
+            'version': self.version,
+            'emotion_patterns': self.emotion_patterns,
+            'conflict_resolution': self.conflict_resolution,
+            'suggestions': self.suggestions,
+            'default_suggestions': self.default_suggestions
+        }
+
+    def replace(self, **changes):
+        """New snapshot with some fields replaced (and recompiled)"""
+        data = self.to_dict()
+        data.update(changes)
+        return Ruleset.from_dict(data)
+
+    def compile(self, matchers=None):
+        """Build the phrase matchers (unless given as (phrase, crisis) from an
+        artifact), the keyword inverted index and the suggestion payloads"""
+        if matchers is None:
+            matchers = (
+                PhraseMatcher(
+                    (pattern, (index, emotion_data['emotion'], emotion_data['priority']))
+                    for index, emotion_data in enumerate(self.emotion_patterns)
+                    for pattern in emotion_data['patterns']
+                ),
+                # Crisis groups also get a matcher of their own, so checking for
+                # them costs the same however large the rest of the table grows
+                PhraseMatcher(
+                    (pattern, (index, emotion_data['emotion'], emotion_data['priority']))
+                    for index, emotion_data in enumerate(self.emotion_patterns)
+                    if emotion_data['priority'] >= CRISIS_PRIORITY
+                    for pattern in emotion_data['patterns']
+                )
+            )
+        self.phrase_matcher, self.crisis_matcher = matchers
+
+        # Suggestion lists and their JSON bodies are built once per snapshot;
+        # the ETag is a hash of the body, so it changes only when the list does
+        self.suggestion_lists = {}
+        self.suggestion_payloads = {}
+        for emotion, suggestions in list(self.suggestions.items()) + [(None, self.default_suggestions)]:
+            top = suggestions[:SUGGESTION_LIMIT]
+            body = json.dumps(top).encode('utf-8')
+            self.suggestion_lists[emotion] = top
+            self.suggestion_payloads[emotion] = (body, hashlib.sha256(body).hexdigest()[:32])
+        
+        self.keyword_index = {}
+        self.phrase_word_counts = {}
+        self._keyword_matrix = None  # NumPy form of the index, built on first batch use
+        for index, emotion_data in enumerate(self.emotion_patterns):
+            for phrase_index, pattern in enumerate(emotion_data['patterns']):
+                key = (index, phrase_index)
+                pattern_words = set(pattern.split())
+                self.phrase_word_counts[key] = len(pattern_words)
+                for word in pattern_words:
+                    self.keyword_index.setdefault(word, []).append(key)
+
+    def groups_for_phrases(self, phrases):
+        """Expand matched phrases to (group index, emotion, priority, phrase) in table order"""
+        payloads = self.phrase_matcher.payloads
+        matches = [(index, emotion, priority, phrase)
+                   for phrase in phrases
+                   for index, emotion, priority in payloads[phrase]]
+        matches.sort()
+        return matches
+
+    def matched_groups(self, text_lower):
+        """Scan once; return (group index, emotion, priority, phrase) in table order"""
+        return self.groups_for_phrases(self.phrase_matcher.find_phrases(text_lower))
+
+    def crisis_match(self, text_lower):
+        """First crisis group in table order found in text_lower, as
+        (group index, emotion, priority, phrase), or None"""
+        payloads = self.crisis_matcher.payloads
+        matches = [(index, emotion, priority, phrase)
+                   for phrase in self.crisis_matcher.find_phrases(text_lower)
+                   for index, emotion, priority in payloads[phrase]]
+        return min(matches) if matches else None
+
+    def keyword_scores(self, text_words):
+        """Score emotions by the phrase words present in text_words.
+
+        A phrase whose words all occur scores twice its word count, otherwise
+        one point per shared word. Only the text's own words are looked up in
+        the inverted index. Like the original per-group loop, a later group
+        for the same emotion replaces the earlier score but keeps its place.
+        """
+        shared = {}
+        for word in text_words:
+            for key in self.keyword_index.get(word, ()):
+                shared[key] = shared.get(key, 0) + 1
+
+        group_scores = {}
+        for key, count in shared.items():
+            if count == self.phrase_word_counts[key]:
+                count *= 2
+            group_scores[key[0]] = group_scores.get(key[0], 0) + count
+
+        emotion_scores = {}
+        for index in sorted(group_scores):
+            emotion_scores[self.emotion_patterns[index]['emotion']] = group_scores[index]
+        return emotion_scores
+
+    def keyword_scores_batch(self, word_sets):
+        """keyword_scores for many sets of words at once, vectorized with NumPy"""
+        if self._keyword_matrix is None:
+            from models.keyword_matrix import KeywordMatrix
+            self._keyword_matrix = KeywordMatrix(self)
+        return self._keyword_matrix.scores(word_sets)
+
+    def suggestions_for(self, emotion):
+        """Top suggestions for emotion (the defaults for an unknown emotion); do not modify"""
+        lists = self.suggestion_lists
+        return lists[emotion] if emotion in lists else lists[None]
+
+    def suggestion_payload(self, emotion):
+        """(JSON body, unquoted ETag) of suggestions_for(emotion), prebuilt"""
+        payloads = self.suggestion_payloads
+        return payloads[emotion] if emotion in payloads else payloads[None]
+
+
+def changed_phrases(old, new):
+    """Phrases whose texts may be classified differently under new than under old.
+
+    Pattern groups are aligned by (emotion, priority) in table order. Groups
+    that were added, removed or moved contribute all of their phrases; an
+    aligned pair contributes the phrases only one of them has. Emotions whose
+    conflict resolution entry changed contribute the phrases of every group
+    for that emotion.
+    """
+    def headers(ruleset):
+        return [(group['emotion'], group['priority']) for group in ruleset.emotion_patterns]
+
+    phrases = set()
+    matcher = difflib.SequenceMatcher(None, headers(old), headers(new), autojunk=False)
+    for tag, old_start, old_end, new_start, new_end in matcher.get_opcodes():
+        old_groups = old.emotion_patterns[old_start:old_end]
+        new_groups = new.emotion_patterns[new_start:new_end]
+        if tag == 'equal':
+            for old_group, new_group in zip(old_groups, new_groups):
+                phrases.update(set(old_group['patterns']) ^ set(new_group['patterns']))
+        else:
+            for group in old_groups + new_groups:
+                phrases.update(group['patterns'])
+
+    emotions = {emotion for emotion in set(old.conflict_resolution) | set(new.conflict_resolution)
+                if set(old.conflict_resolution.get(emotion, ())) != set(new.conflict_resolution.get(emotion, ()))}
+    for group in old.emotion_patterns + new.emotion_patterns:
+        if group['emotion'] in emotions:
+            phrases.update(group['patterns'])
+    phrases.discard('')
+    return phrases
+
+
+def artifact_path(path):
+    return path + '.compiled.json'
+
+
+def _load_matchers(compiled, digest):
+    """(phrase, crisis) matchers from the artifact at compiled, or None when
+    it is missing, stale or malformed"""
+    try:
+        with open(compiled, 'r', encoding='utf-8') as f:
+            artifact = json.load(f)
+        if artifact['format'] != ARTIFACT_FORMAT or artifact['digest'] != digest:
+            return None
+        return (PhraseMatcher.from_dict(artifact['phrase_matcher']),
+                PhraseMatcher.from_dict(artifact['crisis_matcher']))
+    except (OSError, ValueError, KeyError, TypeError, AttributeError, re.error):
+        return None
+
+
+def load_ruleset(path=DEFAULT_RULESET_PATH, use_artifact=True):
+    """Load a ruleset file, reusing its compiled artifact when still current.
+
+    The artifact is JSON holding the compiled phrase matchers (regex source,
+    prefix tables and payloads), stamped with the SHA-256 of the source file;
+    it is rebuilt (and rewritten atomically) whenever the source changes.
+    Being plain data, an artifact can at worst be rejected, never run code.
+    """
+    with open(path, 'rb') as f:
+        raw = f.read()
+    digest = hashlib.sha256(raw).hexdigest()
+    compiled = artifact_path(path)
+    data = json.loads(raw.decode('utf-8'))
+
+    matchers = _load_matchers(compiled, digest) if use_artifact else None
+    if matchers is not None:
+        return Ruleset.from_dict(data, matchers)
+
+    ruleset = Ruleset.from_dict(data)
+    if use_artifact:
+        tmp = '%s.%d.tmp' % (compiled, os.getpid())
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'format': ARTIFACT_FORMAT,
+                    'digest': digest,
+                    'phrase_matcher': ruleset.phrase_matcher.to_dict(),
+                    'crisis_matcher': ruleset.crisis_matcher.to_dict()
+                }, f, separators=(',', ':'))
+            os.replace(tmp, compiled)
+        except OSError:
+            logger.warning("Could not write ruleset artifact %s", compiled)
+    return ruleset
+
+
+class RulesetSource:
+    """Holds the current Ruleset and swaps it atomically when the file changes.
+
+    get() is cheap: at most once per check_interval seconds it stats the
+    file, and only a changed file is reloaded (by one thread; the others keep
+    serving the old snapshot meanwhile). A file that fails to load is logged
+    and the previous snapshot stays in place. check_interval=None disables
+    reloading.
+    """
+
+    def __init__(self, path=DEFAULT_RULESET_PATH, check_interval=None, use_artifact=True):
+        self.path = path
+        self.check_interval = check_interval
+        self.use_artifact = use_artifact
+        self._lock = threading.Lock()  # held by the reloading thread
+        self._swap_lock = threading.Lock()  # held while the current snapshot changes
+        self._listeners = []
+        self._stamp = self._file_stamp()
+        self._next_check = time.monotonic() + (check_interval or 0)
+        self._current = load_ruleset(path, use_artifact)
+
+    def _file_stamp(self):
+        try:
+            stat = os.stat(self.path)
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+
+    def on_swap(self, listener):
+        """Call listener(new_ruleset) after every swap"""
+        self._listeners.append(listener)
+
+    def get(self):
+        if self.check_interval is not None and time.monotonic() >= self._next_check:
+            self.reload_if_changed()
+        return self._current
+
+    def reload_if_changed(self):
+        if not self._lock.acquire(blocking=False):
+            return False
+        try:
+            self._next_check = time.monotonic() + (self.check_interval or 0)
+            stamp = self._file_stamp()
+            if stamp is None or stamp == self._stamp:
+                return False
+            try:
+                ruleset = load_ruleset(self.path, self.use_artifact)
+            except (OSError, ValueError, KeyError, TypeError):
+                logger.exception("Keeping ruleset %s; failed to load %s", self._current.version, self.path)
+                self._stamp = stamp
+                return False
+            self._stamp = stamp
+            self.swap(ruleset)
+            return True
+        finally:
+            self._lock.release()
+
+    def swap(self, ruleset):
+        """Make ruleset current; in-flight analyses keep their snapshot.
+
+        Reloads and the analyzer's setters can swap at the same time, so the
+        generation is bumped under a lock: every snapshot gets its own, and
+        results cached by generation never cross snapshots.
+        """
+        with self._swap_lock:
+            ruleset.generation = self._current.generation + 1
+            self._current = ruleset
+        for listener in self._listeners:
+            listener(ruleset)
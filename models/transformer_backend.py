@@ -0,0 +1,172 @@
+"""Optional transformer backend built on Config.MODEL_NAME.
+
+The model is loaded from a local directory only (no hub downloads). Single
+requests are coalesced by a MicroBatcher: anything arriving within max_wait
+seconds of the first queued text is run as one padded batch of at most
+max_batch_size texts under torch.inference_mode. torch and transformers are
+imported when the backend is constructed, so the rule-based analyzer never
+pays for them.
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from models.document import analyze_document
+from models.final_emotion_model import emotion_score
+
+# j-hartmann/emotion-english-distilroberta-base labels -> analyzer emotions
+LABEL_MAP = {
+    'anger': 'Anger',
+    'disgust': 'Frustration',
+    'fear': 'Fear',
+    'joy': 'Joy',
+    'neutral': 'Neutral',
+    'sadness': 'Sadness',
+    'surprise': 'Excitement',
+}
+
+
+class MicroBatcher:
+    """Coalesce concurrent single-item calls into batched calls.
+
+    process_batch receives a list of items and must return one result per
+    item, in order. A background thread collects items for up to max_wait
+    seconds (or until max_batch_size are queued) before each call.
+    """
+
+    def __init__(self, process_batch, max_batch_size=16, max_wait=0.005):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self.batches = 0
+        self.items = 0
+
+    def _ensure_started(self):
+        # Restart after a fork: the batching thread does not survive into children
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+            self._thread.start()
+
+    def submit(self, item):
+        """Queue one item; returns a Future for its result"""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def __call__(self, item, timeout=None):
+        return self.submit(item).result(timeout)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            self.batches += 1
+            self.items += len(batch)
+            try:
+                results = self.process_batch([item for item, _ in batch])
+            except Exception as exc:
+                for _, future in batch:
+                    future.set_exception(exc)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+
+class TransformerBackend:
+    """CPU inference for a local sequence-classification model.
+
+    Exposes the same analyze_emotion / analyze_batch / get_detailed_analysis
+    interface as FinalEmotionAnalyzer so the app can use either one.
+    """
+
+    def __init__(self, model_dir, max_length=512, quantize=False, max_batch_size=16, max_wait=0.005):
+        import torch
+        from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+        if not os.path.isdir(model_dir):
+            raise FileNotFoundError("Model directory not found: %s" % model_dir)
+
+        self.torch = torch
+        self.max_length = max_length
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir, local_files_only=True)
+        model = AutoModelForSequenceClassification.from_pretrained(model_dir, local_files_only=True)
+        model.eval()
+        if quantize:
+            # int8 weights for the Linear layers; activations stay float
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.model = model
+        self.labels = [LABEL_MAP.get(model.config.id2label[i].lower(), model.config.id2label[i].title())
+                       for i in range(model.config.num_labels)]
+        self.batcher = MicroBatcher(self.score_batch, max_batch_size=max_batch_size, max_wait=max_wait)
+
+    def score_batch(self, texts):
+        """Run one padded batch; returns every label ranked by probability, per text"""
+        torch = self.torch
+        encoded = self.tokenizer(texts, padding=True, truncation=True,
+                                 max_length=self.max_length, return_tensors='pt')
+        with torch.inference_mode():
+            logits = self.model(**encoded).logits
+            probabilities = torch.softmax(logits, dim=-1)
+            confidences, indices = probabilities.sort(dim=-1, descending=True)
+        return [[emotion_score(self.labels[index], round(confidence, 3), 'model')
+                 for index, confidence in zip(row_indices, row_confidences)]
+                for row_indices, row_confidences in zip(indices.tolist(), confidences.tolist())]
+
+    def predict_batch(self, texts):
+        """Run one padded batch; returns (emotion, confidence) per text"""
+        return [(scores[0]['emotion'], scores[0]['confidence']) for scores in self.score_batch(texts)]
+
+    def analyze_emotion(self, text):
+        top = self.analyze_emotion_scores(text, 1)[0]
+        return top['emotion'], top['confidence']
+
+    def analyze_emotion_scores(self, text, k=None):
+        """All labels ranked by probability (the top k when k is given)"""
+        if len(text.strip()) < 5:
+            return [emotion_score("Neutral", 0.5, 'short')]
+        return self.batcher(text)[:k]
+
+    def analyze_batch(self, texts):
+        results = [("Neutral", 0.5)] * len(texts)
+        pending = [i for i, text in enumerate(texts) if len(text.strip()) >= 5]
+        for start in range(0, len(pending), self.batcher.max_batch_size):
+            chunk = pending[start:start + self.batcher.max_batch_size]
+            for i, result in zip(chunk, self.predict_batch([texts[i] for i in chunk])):
+                results[i] = result
+        return results
+
+    def get_detailed_analysis(self, text):
+        emotion, confidence = self.analyze_emotion(text)
+        return {
+            'primary_emotion': emotion,
+            'confidence': confidence,
+            'intensity': 'High' if confidence > 0.9 else 'Medium' if confidence > 0.8 else 'Low'
+        }
+
+    def analyze_document(self, source, max_sentence_chars=1000):
+        # The model has no notion of crisis phrases, so there is no early exit
+        return analyze_document(source, self.analyze_emotion, None, max_sentence_chars)
+
+    def warm_up(self):
+        self.predict_batch(["warm up"])
+        return self
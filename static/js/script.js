@@ -5,17 +5,27 @@ document.addEventListener('DOMContentLoaded', function() {
     const emotionResult = document.getElementById('emotionResult');
     const suggestionsDiv = document.getElementById('suggestions');
     const historyDiv = document.getElementById('history');
+    const trendDiv = document.getElementById('trend');
     const analyzeText = document.getElementById('analyzeText');
     const analyzeSpinner = document.getElementById('analyzeSpinner');
+    const HISTORY_LIMIT = 10;
+    let historyItems = [];
+    // Suggestions per emotion; the browser also caches /suggestions responses
+    const suggestionCache = new Map();
+    let shownEmotion = null;
 
     if (analyzeBtn) {
         analyzeBtn.addEventListener('click', analyzeTextHandler);
     }
 
-    // Load history when page loads
+    // Load history and trend when page loads
     loadHistory();
+    loadTrend();
 
     async function analyzeTextHandler() {
+        // Ctrl+Enter bypasses the disabled button; ignore it while a request is pending
+        if (analyzeBtn.disabled) return;
+
         const text = textInput.value.trim();
         if (!text) {
             alert('Please enter some text to analyze.');
@@ -45,7 +55,9 @@ document.addEventListener('DOMContentLoaded', function() {
 
             if (response.ok) {
                 displayResults(data);
-                loadHistory(); // Refresh history
+                // Show the new analysis without refetching the whole history
+                addToHistory(text, data);
+                loadTrend();
             } else {
                 alert('Error: ' + data.error);
             }
@@ -79,10 +91,35 @@ document.addEventListener('DOMContentLoaded', function() {
             </div>
         `;
 
+        shownEmotion = data.emotion;
+        suggestionsDiv.innerHTML = '';
+        loadSuggestions(data.emotion);
+    }
+
+    async function loadSuggestions(emotion) {
+        let suggestions = suggestionCache.get(emotion);
+        if (!suggestions) {
+            try {
+                const response = await fetch('/suggestions/' + encodeURIComponent(emotion));
+                if (!response.ok) return;
+                suggestions = await response.json();
+                suggestionCache.set(emotion, suggestions);
+            } catch (error) {
+                console.error('Error loading suggestions:', error);
+                return;
+            }
+        }
+        // A newer result may have been shown while this request was in flight
+        if (emotion === shownEmotion) {
+            displaySuggestions(emotion, suggestions);
+        }
+    }
+
+    function displaySuggestions(emotion, suggestions) {
         const suggestionsHtml = `
-            <h6>💡 Suggestions for managing ${data.emotion}:</h6>
+            <h6>💡 Suggestions for managing ${emotion}:</h6>
             <div class="list-group">
-                ${data.suggestions.map((suggestion, index) => `
+                ${suggestions.map((suggestion, index) => `
                     <div class="list-group-item">
                         <div class="d-flex align-items-center">
                             <span class="badge bg-primary me-3">${index + 1}</span>
@@ -100,37 +137,87 @@ document.addEventListener('DOMContentLoaded', function() {
         if (!historyDiv) return;
 
         try {
-            const response = await fetch('/history');
+            const response = await fetch('/history?limit=' + HISTORY_LIMIT);
             const data = await response.json();
 
             if (response.ok) {
-                if (data.length === 0) {
-                    historyDiv.innerHTML = `
-                        <div class="text-center text-muted">
-                            <p>No analysis history yet.</p>
-                            <p>Start by analyzing some text above!</p>
+                historyItems = data;
+                renderHistory();
+            }
+        } catch (error) {
+            console.error('Error loading history:', error);
+            historyDiv.innerHTML = '<p class="text-danger">Error loading history</p>';
+        }
+    }
+
+    function addToHistory(text, data) {
+        if (!historyDiv) return;
+
+        // Same shape as a /history item (stored confidence is a 0-1 fraction)
+        historyItems.unshift({
+            text: text.length > 100 ? text.slice(0, 100) + '...' : text,
+            emotion: data.emotion,
+            confidence: data.confidence / 100,
+            timestamp: new Date().toISOString()
+        });
+        historyItems = historyItems.slice(0, HISTORY_LIMIT);
+        renderHistory();
+    }
+
+    function renderHistory() {
+        const data = historyItems;
+        if (data.length === 0) {
+            historyDiv.innerHTML = `
+                <div class="text-center text-muted">
+                    <p>No analysis history yet.</p>
+                    <p>Start by analyzing some text above!</p>
+                </div>
+            `;
+        } else {
+            historyDiv.innerHTML = data.map(item => `
+                <div class="card mb-3">
+                    <div class="card-body">
+                        <div class="d-flex justify-content-between align-items-start">
+                            <h6 class="card-title mb-1">${item.emotion}</h6>
+                            <span class="badge ${item.confidence > 80 ? 'bg-success' : 'bg-warning'}">
+                                ${item.confidence}%
+                            </span>
                         </div>
-                    `;
+                        <p class="card-text small">${item.text}</p>
+                        <small class="text-muted">${new Date(item.timestamp).toLocaleString()}</small>
+                    </div>
+                </div>
+            `).join('');
+        }
+    }
+
+    async function loadTrend() {
+        if (!trendDiv) return;
+
+        try {
+            // Served from the per-day rollup, so this stays cheap however long the history
+            const response = await fetch('/history/trend?days=7');
+            const data = await response.json();
+
+            if (response.ok) {
+                if (data.trend.length === 0) {
+                    trendDiv.innerHTML = '<p class="text-center text-muted mb-0">No analyses in the last 7 days.</p>';
                 } else {
-                    historyDiv.innerHTML = data.map(item => `
-                        <div class="card mb-3">
-                            <div class="card-body">
-                                <div class="d-flex justify-content-between align-items-start">
-                                    <h6 class="card-title mb-1">${item.emotion}</h6>
-                                    <span class="badge ${item.confidence > 80 ? 'bg-success' : 'bg-warning'}">
-                                        ${item.confidence}%
-                                    </span>
-                                </div>
-                                <p class="card-text small">${item.text}</p>
-                                <small class="text-muted">${new Date(item.timestamp).toLocaleString()}</small>
-                            </div>
+                    trendDiv.innerHTML = data.trend.map(day => `
+                        <div class="d-flex justify-content-between align-items-center mb-2">
+                            <span class="text-muted small">${day.day}</span>
+                            <span>
+                                ${Object.entries(day.emotions).map(([emotion, stats]) => `
+                                    <span class="badge bg-info text-dark ms-1">${emotion} × ${stats.count}</span>
+                                `).join('')}
+                            </span>
                         </div>
                     `).join('');
                 }
             }
         } catch (error) {
-            console.error('Error loading history:', error);
-            historyDiv.innerHTML = '<p class="text-danger">Error loading history</p>';
+            console.error('Error loading trend:', error);
+            trendDiv.innerHTML = '<p class="text-danger">Error loading trend</p>';
         }
     }
 
@@ -4,51 +4,53 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from models.final_emotion_model import FinalEmotionAnalyzer
 
+# Optimized test cases with specific expectations
+TEST_CASES = [
+    # Depression & Hopelessness
+    ("I don't see the point in anything anymore. Everything feels meaningless.", "Depression"),
+    ("Can't get out of bed today. The weight is just too heavy to carry.", "Depression"),
+    ("I feel empty inside, like nothing matters and no one cares.", "Depression"),
+    ("I'm so hopeless about my future. Nothing ever works out for me.", "Hopelessness"),
+    ("I want to die and end it all. Everything is hopeless.", "Depression"),
+
+    # Anxiety & Fear
+    ("I keep worrying about everything that could go wrong tomorrow.", "Anxiety"),
+    ("My heart is racing and I can't stop thinking about all my deadlines.", "Anxiety"),
+    ("I'm terrified about what might happen if I fail this important test.", "Fear"),
+    ("I'm having a panic attack and can't breathe!", "Panic"),
+
+    # Anger & Frustration
+    ("I'm so furious about what happened today! It's completely unfair!", "Anger"),
+    ("Why do people have to be so difficult? I'm tired of this nonsense!", "Frustration"),
+    ("This situation makes my blood boil! I can't believe it!", "Anger"),
+    ("I'm so irritated by all these constant interruptions!", "Irritability"),
+
+    # Stress & Overwhelm - FIXED CASES
+    ("Too many deadlines, not enough time. I feel completely stretched thin.", "Stress"),
+    ("I feel so overwhelmed by everything I have to do this week.", "Overwhelm"),
+    ("Juggling work, family, and personal life is exhausting me.", "Overwhelm"),
+    ("I have so much on my plate I don't know where to start.", "Overwhelm"),
+
+    # Loneliness - FIXED CASES
+    ("I feel completely alone and no one cares about me.", "Loneliness"),
+    ("I'm so lonely and isolated from everyone.", "Loneliness"),
+    ("No one cares about me, I'm all alone", "Loneliness"),
+
+    # Positive Emotions - FIXED CASES
+    ("I just got promoted at work and I'm so excited about this new opportunity!", "Excitement"),
+    ("Today was absolutely perfect - great weather, amazing food, and wonderful company.", "Happiness"),
+    ("I finally achieved my goal after months of hard work. I feel incredible!", "Pride"),
+    ("I'm so grateful for all the wonderful people in my life.", "Gratitude"),
+    ("I'm so happy and excited about my promotion!", "Excitement"),  # Changed from Joy to Excitement
+]
+
 def test_final_accuracy():
     print("🎯 FINAL 90%+ ACCURACY TEST")
     print("=" * 70)
     
     analyzer = FinalEmotionAnalyzer()
     
-    # Optimized test cases with specific expectations
-    test_cases = [
-        # Depression & Hopelessness
-        ("I don't see the point in anything anymore. Everything feels meaningless.", "Depression"),
-        ("Can't get out of bed today. The weight is just too heavy to carry.", "Depression"),
-        ("I feel empty inside, like nothing matters and no one cares.", "Depression"),
-        ("I'm so hopeless about my future. Nothing ever works out for me.", "Hopelessness"),
-        ("I want to die and end it all. Everything is hopeless.", "Depression"),
-        
-        # Anxiety & Fear
-        ("I keep worrying about everything that could go wrong tomorrow.", "Anxiety"),
-        ("My heart is racing and I can't stop thinking about all my deadlines.", "Anxiety"),
-        ("I'm terrified about what might happen if I fail this important test.", "Fear"),
-        ("I'm having a panic attack and can't breathe!", "Panic"),
-        
-        # Anger & Frustration
-        ("I'm so furious about what happened today! It's completely unfair!", "Anger"),
-        ("Why do people have to be so difficult? I'm tired of this nonsense!", "Frustration"),
-        ("This situation makes my blood boil! I can't believe it!", "Anger"),
-        ("I'm so irritated by all these constant interruptions!", "Irritability"),
-        
-        # Stress & Overwhelm - FIXED CASES
-        ("Too many deadlines, not enough time. I feel completely stretched thin.", "Stress"),
-        ("I feel so overwhelmed by everything I have to do this week.", "Overwhelm"),
-        ("Juggling work, family, and personal life is exhausting me.", "Overwhelm"),
-        ("I have so much on my plate I don't know where to start.", "Overwhelm"),
-        
-        # Loneliness - FIXED CASES
-        ("I feel completely alone and no one cares about me.", "Loneliness"),
-        ("I'm so lonely and isolated from everyone.", "Loneliness"),
-        ("No one cares about me, I'm all alone", "Loneliness"),
-        
-        # Positive Emotions - FIXED CASES
-        ("I just got promoted at work and I'm so excited about this new opportunity!", "Excitement"),
-        ("Today was absolutely perfect - great weather, amazing food, and wonderful company.", "Happiness"),
-        ("I finally achieved my goal after months of hard work. I feel incredible!", "Pride"),
-        ("I'm so grateful for all the wonderful people in my life.", "Gratitude"),
-        ("I'm so happy and excited about my promotion!", "Excitement"),  # Changed from Joy to Excitement
-    ]
+    test_cases = TEST_CASES
     
     correct = 0
     total = len(test_cases)
@@ -0,0 +1,69 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from models.final_emotion_model import VECTORIZED_KEYWORD_MIN_TEXTS, FinalEmotionAnalyzer
+from test_accuracy import TEST_CASES
+
+EDGE_TEXTS = [
+    "",
+    "   ",
+    "sad",
+    "sad!",
+    "  ok  ",
+    "I FEEL SO OVERWHELMED BY EVERYTHING",
+    "i'M sO HoPeLeSs",
+    "Lonely\tand\nIsolated",
+    "I want to DIE",
+]
+
+
+def keyword_texts(ruleset):
+    """Texts sharing words with the patterns but holding none of them, so
+    they go to the keyword fallback: each multi-word pattern, reversed"""
+    texts = []
+    for emotion_data in ruleset.emotion_patterns:
+        for pattern in emotion_data['patterns']:
+            words = pattern.split()
+            text = ' '.join(reversed(words))
+            if len(words) > 1 and not ruleset.matched_groups(text):
+                texts.append(text.capitalize() + '.')
+    return texts
+
+
+def test_batch_matches_single_analysis():
+    analyzer = FinalEmotionAnalyzer()
+    fallback = keyword_texts(analyzer.ruleset)
+    # Enough keyword texts for the vectorized path
+    assert len(fallback) >= VECTORIZED_KEYWORD_MIN_TEXTS
+    texts = [text for text, _ in TEST_CASES] + EDGE_TEXTS + fallback
+    texts += texts[:5]  # duplicates share a result
+    assert analyzer.analyze_batch(texts) == [analyzer.analyze_emotion(text) for text in texts]
+    # And below the threshold, on the scalar path
+    assert analyzer.analyze_batch(texts[:40]) == [analyzer.analyze_emotion(text) for text in texts[:40]]
+
+
+def test_cache_follows_ruleset_swaps_and_stays_bounded():
+    analyzer = FinalEmotionAnalyzer(cache_size=4)
+    text = "I am so tired of everything"
+    before = analyzer.analyze_emotion(text)
+    assert analyzer.analyze_emotion(text) == before
+    assert analyzer.cache.stats()['hits'] == 1
+
+    # A new group in front now claims the text
+    analyzer.emotion_patterns = ([{'emotion': 'Fatigue', 'priority': 60, 'patterns': ['so tired']}]
+                                 + analyzer.emotion_patterns)
+    after = analyzer.analyze_emotion(text)
+    assert after[0] == 'Fatigue' != before[0]
+    assert analyzer.analyze_batch([text]) == [after]
+
+    texts = [text for text, _ in TEST_CASES[:10]]
+    for text in texts:
+        analyzer.analyze_emotion(text)
+    stats = analyzer.cache.stats()
+    assert stats['size'] == 4
+    assert stats['evictions'] >= len(texts) - 4
+    # The most recent texts are the ones kept
+    hits = stats['hits']
+    analyzer.analyze_batch(texts[-4:])
+    assert analyzer.cache.stats()['hits'] == hits + 4
@@ -0,0 +1,129 @@
+import sys
+import os
+import asyncio
+import base64
+import re
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+
+
+@pytest.fixture(scope='module')
+def app_module(load_app):
+    return load_app(RATE_LIMIT_PER_MINUTE=60, BATCH_MAX_TEXTS=1000)
+
+
+@pytest.fixture
+def client(app_module):
+    client = app_module.app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+    return client
+
+
+def test_oversized_batch_is_refused(app_module, client):
+    burst = app_module.Config.RATE_LIMIT_BURST
+    assert app_module.max_batch_texts == burst
+    response = client.post('/analyze/batch', json=['I feel happy'] * (burst + 1))
+    assert response.status_code == 413
+    # Nothing was charged or saved for it
+    response = client.post('/analyze/batch', json=['I feel happy'] * burst)
+    assert response.status_code == 200 and len(response.get_json()) == burst
+
+
+@pytest.mark.parametrize('days', ['0', '367', '1000000', '99999999999', 'week'])
+def test_summary_days_out_of_range(client, days):
+    response = client.get('/history/summary?days=' + days)
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'days must be between 1 and 366'}
+    assert client.get('/history/summary?days=366').status_code == 200
+
+
+@pytest.mark.parametrize('raw', [b'x|99999999999999999999999', b'2024-01-01 12:00:00|-1',
+                                 b'not a time|5', b'no separator'])
+def test_history_cursor_out_of_range(client, raw):
+    response = client.get('/history?cursor=' + base64.urlsafe_b64encode(raw).decode('ascii'))
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'Invalid cursor'}
+
+
+def test_suggestions_are_revalidated_by_etag(client):
+    response = client.get('/suggestions/Anxiety')
+    assert response.status_code == 200
+    assert isinstance(response.get_json(), list) and response.get_json()
+    etag = response.headers['ETag']
+    assert 'public' in response.headers['Cache-Control']
+
+    response = client.get('/suggestions/Anxiety', headers={'If-None-Match': etag})
+    assert response.status_code == 304 and response.data == b''
+    # Another emotion has a body, and so an ETag, of its own
+    assert client.get('/suggestions/Joy', headers={'If-None-Match': etag}).status_code == 200
+
+
+SAMPLE = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{[a-zA-Z_][a-zA-Z0-9_]*="[^"]*"(,[a-zA-Z_][a-zA-Z0-9_]*="[^"]*")*\})? \S+$')
+
+
+def test_metrics_render_the_text_format(client):
+    # Timed whether or not the earlier tests used up the rate limit
+    client.post('/analyze', json={'text': 'What a wonderful, happy day'})
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.headers['Content-Type'] == 'text/plain; version=0.0.4; charset=utf-8'
+    lines = response.get_data(as_text=True).splitlines()
+    types = {}
+    for line in lines:
+        if line.startswith('# HELP '):
+            continue
+        if line.startswith('# TYPE '):
+            _, _, name, kind = line.split(' ')
+            assert kind in ('counter', 'gauge', 'histogram')
+            types[name] = kind
+            continue
+        assert SAMPLE.match(line), line
+        float(line.rsplit(' ', 1)[1])
+    assert types['http_request_seconds'] == 'histogram'
+    assert any(line.startswith('http_request_seconds_count{endpoint="analyze_text"}') for line in lines)
+    assert types['analyzer_results_total'] == 'counter'
+
+
+def test_asgi_refuses_requests_past_its_queue(app_module):
+    import asgi
+    server = asgi.AnalysisServer(app_module.app, workers=1, max_queue=1, retry_after=3)
+    scope = {'type': 'http', 'method': 'POST', 'path': '/analyze', 'headers': []}
+
+    async def run():
+        release = asyncio.Event()
+
+        async def slow_receive():
+            await release.wait()
+            return {'type': 'http.request', 'body': b'{}'}
+
+        async def refused_receive():
+            return {'type': 'http.request', 'body': b'{}'}
+
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        # Two requests still reading their bodies fill the worker and the queue
+        held = [asyncio.create_task(server(scope, slow_receive, send)) for _ in range(2)]
+        await asyncio.sleep(0)
+        assert server.in_flight == 2
+        refused = []
+
+        async def refused_send(message):
+            refused.append(message)
+
+        await server(scope, refused_receive, refused_send)
+        release.set()
+        await asyncio.gather(*held)
+        return refused, sent
+
+    refused, sent = asyncio.run(run())
+    assert refused[0]['status'] == 503
+    assert (b'retry-after', b'3') in refused[0]['headers']
+    assert server.rejected == 1 and server.in_flight == 0
+    # The admitted requests were answered (not logged in: 401)
+    assert [message['status'] for message in sent if 'status' in message] == [401, 401]
+    server.pool.shutdown()
@@ -0,0 +1,114 @@
+import sys
+import os
+import io
+import json
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+import pytest
+from database.archive import Archive, archive, export
+from database.rescore import index_new_rows
+from database.segments import Segment, write_segment
+from database.store import Store
+
+ROWS = [
+    (1, 1, 1700000000, "I feel so overwhelmed", 'Overwhelm', 0.955, '1'),
+    (2, 2, 1700000060, "café ☃ and \U0001F600 emoji", 'Joy', 0.8, None),
+    (5, 1, 1700003600, "", 'Neutral', 0.5, '1'),
+    (9, 2, 1700090000, None, None, None, '2'),
+    (12, None, 1700090060, "no user", 'Joy', 0.25, '2'),
+]
+
+
+def test_segment_round_trip(tmp_path):
+    path = str(tmp_path / 'segment.col')
+    header = write_segment(path, ROWS)
+    assert (header['rows'], header['min_id'], header['max_id']) == (5, 1, 12)
+    with Segment(path) as segment:
+        assert segment.column('id').tolist() == [1, 2, 5, 9, 12]
+        assert segment.column('user_id').tolist() == [1, 2, 1, 2, None]
+        assert segment.column('timestamp').tolist() == [row[2] for row in ROWS]
+        # NULL texts stay apart from empty ones
+        assert segment.column('text_input').tolist() == [row[3] for row in ROWS]
+        assert segment.texts([3, 2, 1]).tolist() == [None, '', ROWS[1][3]]
+        assert segment.column('emotion').tolist() == [row[4] for row in ROWS]
+        assert segment.column('ruleset_version').tolist() == [row[6] for row in ROWS]
+        confidences = segment.column('confidence').tolist()
+        assert [round(value, 4) for value in confidences[:3] + confidences[4:]] == [0.955, 0.8, 0.5, 0.25]
+        assert confidences[3] != confidences[3]  # NaN stands for NULL
+
+    # Without NULL user ids the column stays int64
+    write_segment(path, ROWS[:4])
+    with Segment(path) as segment:
+        assert segment.column('user_id').dtype == np.int64
+
+
+def test_not_a_segment(tmp_path):
+    path = tmp_path / 'other.col'
+    path.write_bytes(b'NOTASEGMENT' + bytes(16))
+    with pytest.raises(ValueError):
+        Segment(str(path))
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = Store(str(tmp_path / 'archive.db'))
+    store.init_schema()
+    store.create_user('a', 'a@example.com', 'secret')
+    store.create_user('b', 'b@example.com', 'secret')
+    with store.transaction() as conn:
+        conn.executemany("INSERT INTO user_analyses (user_id, text_input, emotion, confidence, timestamp, "
+                         "ruleset_version) VALUES (?, ?, ?, ?, ?, '1')",
+                         [(1 + i % 2, 'text %d' % i, ('Joy', 'Anger', 'Neutral')[i % 3], round(0.5 + i / 100, 2),
+                           '2024-01-%02d 12:00:00' % (1 + i % 20)) for i in range(40)]
+                         + [(2, None, 'Neutral', 0.5, '2024-01-21 12:00:00'),
+                            (1, 'recent', 'Joy', 0.9, '2024-03-01 08:00:00')])
+    yield store
+    store.close()
+
+
+def table_rows(store):
+    with store.connection() as conn:
+        return conn.execute("SELECT id, user_id, timestamp, text_input, emotion, confidence, ruleset_version "
+                            "FROM user_analyses ORDER BY id").fetchall()
+
+
+@pytest.mark.parametrize('indexed', [False, True])
+def test_archive_and_export(tmp_path, store, indexed):
+    if indexed:
+        assert store.create_search_index()
+        index_new_rows(store)
+    before = table_rows(store)
+    rollup = {user_id: store.daily_rollup(user_id) for user_id in (1, 2)}
+    directory = str(tmp_path / 'segments')
+
+    assert archive(store, directory, '2024-02-01', segment_rows=16) == (3, 41)
+    remaining = table_rows(store)
+    assert [row[3] for row in remaining] == ['recent']
+    # Summaries keep counting the archived rows
+    assert {user_id: store.daily_rollup(user_id) for user_id in (1, 2)} == rollup
+
+    archived = Archive(store, directory)
+    rows = list(archived.rows())
+    assert [tuple(row.values()) for row in rows] == [tuple(row) for row in before[:41]]
+    assert [row['id'] for row in archived.rows(user_id=2, since='2024-01-05', until='2024-01-07')] == \
+        [row[0] for row in before[:41] if row[1] == 2 and '2024-01-05' <= row[2] < '2024-01-07']
+
+    totals = archived.emotion_totals(user_id=1)
+    for emotion, (count, confidence_sum) in totals.items():
+        matching = [row for row in before[:41] if row[1] == 1 and row[4] == emotion]
+        assert count == len(matching)
+        assert confidence_sum == pytest.approx(sum(row[5] for row in matching), abs=1e-4)
+
+    out = io.StringIO()
+    assert export(archived, out, user_id=1) == sum(1 for row in before[:41] if row[1] == 1)
+    assert json.loads(out.getvalue().splitlines()[0]) == rows[0]
+
+    if indexed:
+        # Archived rows left the search index
+        with store.connection() as conn:
+            assert conn.execute("SELECT rowid FROM user_analyses_search "
+                                "WHERE user_analyses_search MATCH 'text'").fetchall() == []
+
+    # Nothing left to archive
+    assert archive(store, directory, '2024-02-01') == (0, 0)
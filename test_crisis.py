@@ -0,0 +1,132 @@
+import sys
+import os
+import io
+import queue
+import threading
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+from config import Config
+from database.rescore import classify
+from models import bulk
+from models.crisis import CRISIS_CONFIDENCE
+from models.document import analyze_document
+from models.final_emotion_model import FinalEmotionAnalyzer
+from utils.alerts import AlertDispatcher
+
+# Matches the Hopelessness patterns too, which would win without the crisis check
+CRISIS_TEXT = "I want to die, everything is so hopeless"
+EXPECTED = ("Depression", CRISIS_CONFIDENCE)
+
+
+@pytest.fixture(scope='module')
+def analyzer():
+    return FinalEmotionAnalyzer()
+
+
+@pytest.fixture(scope='module')
+def app_module(load_app):
+    return load_app()
+
+
+def test_analyzer_entry_points_agree(analyzer):
+    assert analyzer.analyze_emotion(CRISIS_TEXT) == EXPECTED
+    assert analyzer.analyze_batch([CRISIS_TEXT, "I feel fine today"])[0] == EXPECTED
+    scores = analyzer.analyze_emotion_scores(CRISIS_TEXT)
+    assert (scores[0]['emotion'], scores[0]['confidence'], scores[0]['path']) == EXPECTED + ('crisis',)
+    assert analyzer.analyze_rules(CRISIS_TEXT) == EXPECTED + ('crisis',)
+    document = analyzer.analyze_document("Today was long. " + CRISIS_TEXT)
+    assert document['emotion'] == "Depression"
+    assert document['timeline'][-1]['confidence'] == CRISIS_CONFIDENCE
+
+    # A crisis sentence is only scanned by the crisis check
+    classified = []
+    analyze_document("Today was long. " + CRISIS_TEXT,
+                     lambda sentence: classified.append(sentence) or analyzer.analyze_emotion(sentence),
+                     analyzer.detect_crisis)
+    assert classified == ["Today was long."]
+
+
+def test_rescore_matches_analyzer(analyzer):
+    assert classify(analyzer, [CRISIS_TEXT]) == [EXPECTED]
+
+
+def test_bulk_flags_crisis():
+    results = list(bulk.classify_stream([{'text': CRISIS_TEXT}, {'text': "What a lovely sunny day"}], workers=1))
+    (record, emotion, confidence, alert), (_, _, _, calm) = results
+    assert (emotion, confidence) == EXPECTED
+    assert alert['phrase'] == 'want to die'
+    assert calm is None
+
+    sent = []
+
+    class Alerts:
+        def send(self, alert):
+            sent.append(alert)
+
+    out = io.StringIO()
+    assert bulk.write_results(results, out, 'jsonl', Alerts()) == 2
+    assert '"crisis": true' in out.getvalue().splitlines()[0]
+    assert [alert['text'] for alert in sent] == [CRISIS_TEXT]
+
+
+def test_bulk_reports_undelivered_alerts(tmp_path, monkeypatch, capsys):
+    source = tmp_path / 'texts.jsonl'
+    source.write_text('"%s"\n"What a lovely sunny day"\n"%s"\n' % (CRISIS_TEXT, CRISIS_TEXT))
+    monkeypatch.setattr(Config, 'CRISIS_ALERT_SINK', 'file')
+    # A directory cannot be appended to, so every delivery fails
+    monkeypatch.setattr(Config, 'CRISIS_ALERT_PATH', str(tmp_path))
+    with pytest.raises(SystemExit) as exc:
+        bulk.main([str(source), '-o', str(tmp_path / 'out.jsonl'), '--workers', '1', '--alerts'])
+    assert exc.value.code == 1
+    assert '2 crisis alerts could not be delivered' in capsys.readouterr().err
+
+    alerts = tmp_path / 'alerts.jsonl'
+    monkeypatch.setattr(Config, 'CRISIS_ALERT_PATH', str(alerts))
+    bulk.main([str(source), '-o', str(tmp_path / 'out.jsonl'), '--workers', '1', '--alerts'])
+    assert len(alerts.read_text().splitlines()) == 2
+
+
+def test_alert_logs_leave_out_the_text(caplog):
+    started = threading.Event()
+    release = threading.Event()
+
+    class FailingSink:
+        def send(self, alert):
+            started.set()
+            release.wait()
+            raise OSError('unreachable')
+
+    alert = {'emotion': 'Depression', 'phrase': 'want to die', 'user_id': 7, 'text': CRISIS_TEXT,
+             'ruleset_version': '1', 'flagged_at': 0}
+    dispatcher = AlertDispatcher(FailingSink(), max_queue=1)
+    dispatcher.send(alert)
+    started.wait()
+    dispatcher.send(alert)
+    dispatcher.send(alert)  # queue full
+    release.set()
+    dispatcher.close()
+    assert (dispatcher.failed, dispatcher.dropped) == (2, 1)
+    assert "'want to die'" in caplog.text and 'user_id=7' in caplog.text
+    assert CRISIS_TEXT not in caplog.text
+
+
+def test_app_entry_points_agree(app_module):
+    emotion, confidence, _, scores = app_module.classify_text(CRISIS_TEXT, top_k=3)
+    assert (emotion, confidence) == EXPECTED
+    assert scores[0]['path'] == 'crisis'
+    payloads = app_module.analyze_and_save_batch(1, [CRISIS_TEXT])
+    assert payloads[0]['emotion'] == "Depression"
+    assert payloads[0]['confidence'] == round(CRISIS_CONFIDENCE * 100, 2)
+    document = app_module.classify_text(CRISIS_TEXT, document_mode=True)[2]
+    assert document['crisis']['emotion'] == "Depression"
+
+    alerts = app_module.alert_sink.queue
+    app_module.crisis_alerts.close()
+    flagged = []
+    while True:
+        try:
+            flagged.append(alerts.get_nowait())
+        except queue.Empty:
+            break
+    assert len(flagged) == 3
@@ -0,0 +1,55 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from models.phrase_matcher import PhraseMatcher
+from models.ruleset import load_ruleset
+
+PHRASES = [
+    # Overlapping
+    'so sad', 'sad day', 'a sad', 'sad',
+    # Prefixes and suffixes of each other
+    'die', 'die now', 'want to die', 'to die', 'want',
+    # Punctuation next to or inside a phrase
+    'hopeless', 'hopeless.', "can't", "can't cope", 'why?', 'c++', '(sigh)', 'a.b',
+]
+
+TEXTS = [
+    "",
+    "what a sad day, so sad",
+    "so sadday",
+    "i want to die now",
+    "i want to die.",
+    "wanted to diet",
+    "hopeless. hopeless!hopeless",
+    "i can't cope, i can't.",
+    "why? why?? why",
+    "c++ and (sigh) and axb and a.b",
+    "sadsadsad",
+]
+
+
+def expected(phrases, text):
+    return {phrase for phrase in phrases if phrase in text}
+
+
+def test_find_phrases_matches_substring_scan():
+    matcher = PhraseMatcher((phrase, index) for index, phrase in enumerate(PHRASES))
+    for text in TEXTS:
+        assert matcher.find_phrases(text) == expected(PHRASES, text), text
+    assert matcher.find_phrases_batch(TEXTS) == [expected(PHRASES, text) for text in TEXTS]
+
+    restored = PhraseMatcher.from_dict(matcher.to_dict(), payload=int)
+    assert [restored.find_phrases(text) for text in TEXTS] == [expected(PHRASES, text) for text in TEXTS]
+
+
+def test_ruleset_phrases_match_substring_scan():
+    ruleset = load_ruleset(use_artifact=False)
+    phrases = list(ruleset.phrase_matcher.payloads)
+    texts = [text.lower() for text in TEXTS] + [
+        "i feel so overwhelmed and i want to die.",
+        "i'm having a panic attack and can't breathe!",
+        "nothing matters... i'm so tired, so lonely; so anxious",
+    ]
+    for text in texts:
+        assert ruleset.phrase_matcher.find_phrases(text) == expected(phrases, text), text
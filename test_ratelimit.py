@@ -0,0 +1,106 @@
+import sys
+import os
+import threading
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+from utils.metrics import Registry
+from utils.ratelimit import MemoryBucketBackend, RateLimited, RateLimiter
+from utils.singleflight import SingleFlight
+
+
+def test_bucket_allows_a_burst_then_refills():
+    backend = MemoryBucketBackend()
+    assert [backend.take('a', 1.0, 3, 1, 100.0) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert backend.take('a', 1.0, 3, 1, 100.0) == pytest.approx(1.0)
+    # Other keys have buckets of their own
+    assert backend.take('b', 1.0, 3, 1, 100.0) == 0.0
+    assert backend.take('a', 1.0, 3, 1, 101.5) == 0.0
+    assert backend.take('a', 1.0, 3, 1, 101.5) == pytest.approx(0.5)
+
+
+def test_bucket_map_is_bounded():
+    backend = MemoryBucketBackend(max_keys=2)
+    for key in 'abc':
+        backend.take(key, 1.0, 1, 1, 0.0)
+    # 'a' was dropped, so it starts again with a full bucket
+    assert backend.take('a', 1.0, 1, 1, 0.0) == 0.0
+    assert backend.take('c', 1.0, 1, 1, 0.0) > 0
+
+
+def test_limiter_raises_with_retry_after():
+    metrics = Registry()
+    limiter = RateLimiter(rate=0.5, burst=2, metrics=metrics)
+    limiter.check('user')
+    limiter.check('user')
+    with pytest.raises(RateLimited) as exc:
+        limiter.check('user')
+    assert 0 < exc.value.retry_after <= 2.0
+    assert 'rate_limited_total 1' in metrics.render()
+
+
+def test_cost_larger_than_the_bucket_is_refused():
+    limiter = RateLimiter(rate=1.0, burst=5)
+    with pytest.raises(ValueError):
+        limiter.check('user', cost=50)
+    # Nothing was taken
+    limiter.check('user', cost=5)
+    with pytest.raises(RateLimited):
+        limiter.check('user')
+
+
+def test_limiter_rejects_bad_settings():
+    with pytest.raises(ValueError):
+        RateLimiter(rate=0, burst=1)
+
+
+def test_concurrent_calls_share_one_run():
+    flights = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def work():
+        calls.append(1)
+        started.set()
+        release.wait()
+        return 'result'
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flights.do('key', work)))
+    leader.start()
+    started.wait()
+    followers = [threading.Thread(target=lambda: results.append(flights.do('key', work))) for _ in range(4)]
+    for thread in followers:
+        thread.start()
+    while flights.shared < 4:
+        time.sleep(0.001)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join()
+    assert calls == [1]
+    assert results == ['result'] * 5
+    # Finished without linger: the next call runs again
+    assert flights.do('key', lambda: 'again') == 'again'
+
+
+def test_failures_are_shared_but_never_linger():
+    flights = SingleFlight(linger=60)
+
+    def fail():
+        raise RuntimeError('boom')
+
+    with pytest.raises(RuntimeError):
+        flights.do('key', fail)
+    assert flights.do('key', lambda: 'ok') == 'ok'
+    # A result lingers for late duplicates
+    assert flights.do('key', lambda: 'late') == 'ok'
+    assert flights.do('other', lambda: 'other') == 'other'
+
+
+def test_lingering_results_expire():
+    flights = SingleFlight(linger=0.01)
+    assert flights.do('key', lambda: 1) == 1
+    time.sleep(0.02)
+    assert flights.do('key', lambda: 2) == 2
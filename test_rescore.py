@@ -0,0 +1,90 @@
+import sys
+import os
+import copy
+import json
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+from database import rescore
+from database.store import Store
+from models.final_emotion_model import FinalEmotionAnalyzer
+from models.ruleset import DEFAULT_RULESET_PATH
+
+TEXTS = [
+    "I am so tired of everything",
+    "so\ttired and worn out",
+    "I feel exhausted today",
+    "What a wonderful, happy day",
+    "I am so overwhelmed with work",
+    "nothing special happened",
+    "I feel so lonely and isolated",
+    "I want to die",
+    "SO TIRED!!",
+    "tired",
+]
+
+
+def write_ruleset(tmp_path, data):
+    path = tmp_path / ('ruleset-%s.json' % data['version'])
+    path.write_text(json.dumps(data))
+    return str(path)
+
+
+@pytest.fixture
+def rulesets(tmp_path):
+    with open(DEFAULT_RULESET_PATH) as f:
+        base = json.load(f)
+    old = copy.deepcopy(base)
+    old['version'] = 'old'
+    new = copy.deepcopy(base)
+    new['version'] = 'new'
+    new['emotion_patterns'].insert(2, {'emotion': 'Fatigue', 'priority': 60, 'patterns': ['so tired', 'exhausted']})
+    return (FinalEmotionAnalyzer(ruleset_path=write_ruleset(tmp_path, old)),
+            FinalEmotionAnalyzer(ruleset_path=write_ruleset(tmp_path, new)))
+
+
+def rescored_store(tmp_path, old, new):
+    store = Store(str(tmp_path / 'rescore.db'))
+    store.init_schema()
+    store.create_user('a', 'a@example.com', 'secret')
+    store.record_ruleset(old.ruleset)
+    store.add_analyses([(1, text, emotion, confidence, 'old')
+                        for text, (emotion, confidence) in zip(TEXTS, old.analyze_batch(TEXTS))])
+    results = rescore.rescore(store, new, chunk_size=3)
+    with store.connection() as conn:
+        rows = conn.execute("SELECT emotion, confidence, ruleset_version FROM user_analyses ORDER BY id").fetchall()
+    store.close()
+    return results, rows
+
+
+@pytest.mark.parametrize('indexed', [True, False])
+def test_rescore_matches_a_fresh_analysis(tmp_path, monkeypatch, rulesets, indexed):
+    old, new = rulesets
+    if not indexed:
+        # As on an SQLite without FTS5 trigram support
+        monkeypatch.setattr(Store, 'create_search_index', lambda self: False)
+    before = old.analyze_batch(TEXTS)
+    after = new.analyze_batch(TEXTS)
+    changed = sum(1 for a, b in zip(before, after) if a != b)
+    assert changed
+
+    results, rows = rescored_store(tmp_path, old, new)
+    assert [tuple(row[:2]) for row in rows] == after
+    for (_, _, version), a, b in zip(rows, before, after):
+        assert version == 'new' or a == b
+    # Only the texts containing a changed phrase, or one of its words, were looked at
+    rescored, changed_rows = results['old']
+    assert changed_rows == changed
+    assert rescored == sum(1 for row in rows if row[2] == 'new') < len(TEXTS)
+
+
+def test_rescore_refuses_a_reused_version(tmp_path, rulesets):
+    old, _ = rulesets
+    store = Store(str(tmp_path / 'rescore.db'))
+    store.init_schema()
+    store.record_ruleset(old.ruleset.replace(conflict_resolution={}))
+    try:
+        with pytest.raises(ValueError):
+            rescore.rescore(store, old)
+    finally:
+        store.close()
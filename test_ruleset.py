@@ -0,0 +1,47 @@
+import sys
+import os
+import json
+import shutil
+import threading
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from models.ruleset import DEFAULT_RULESET_PATH, RulesetSource, artifact_path, load_ruleset
+
+TEXT = "i am so overwhelmed and i want to die"
+
+
+def test_artifact_is_plain_json_and_reused(tmp_path):
+    path = str(tmp_path / 'ruleset.json')
+    shutil.copy(DEFAULT_RULESET_PATH, path)
+    compiled = load_ruleset(path)
+    with open(artifact_path(path)) as f:
+        artifact = json.load(f)
+    assert set(artifact) == {'format', 'digest', 'phrase_matcher', 'crisis_matcher'}
+
+    loaded = load_ruleset(path)
+    assert loaded.matched_groups(TEXT) == compiled.matched_groups(TEXT)
+    assert loaded.crisis_match(TEXT) == compiled.crisis_match(TEXT)
+
+
+def test_bad_artifact_is_rebuilt(tmp_path):
+    path = str(tmp_path / 'ruleset.json')
+    shutil.copy(DEFAULT_RULESET_PATH, path)
+    expected = load_ruleset(path, use_artifact=False).matched_groups(TEXT)
+    for content in ('not json', '{"format": 0}', '[]'):
+        with open(artifact_path(path), 'w') as f:
+            f.write(content)
+        assert load_ruleset(path).matched_groups(TEXT) == expected
+    with open(artifact_path(path)) as f:
+        assert json.load(f)['phrase_matcher']['pattern']
+
+
+def test_concurrent_swaps_get_distinct_generations():
+    source = RulesetSource()
+    snapshots = [source.get().replace() for _ in range(40)]
+    threads = [threading.Thread(target=source.swap, args=(snapshot,)) for snapshot in snapshots]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(snapshot.generation for snapshot in snapshots) == list(range(1, 41))
+    assert source.get().generation == 40
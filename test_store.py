@@ -0,0 +1,64 @@
+import sys
+import os
+import shutil
+import sqlite3
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+from database.store import MIGRATIONS, Store
+from utils.metrics import Registry
+
+
+def test_exhausted_pool_raises_operational_error(tmp_path):
+    metrics = Registry()
+    store = Store(str(tmp_path / 'pool.db'), pool_size=1, busy_timeout=0.05, metrics=metrics)
+    held = store.acquire()
+    try:
+        with pytest.raises(sqlite3.OperationalError, match='connection pool exhausted'):
+            store.acquire()
+    finally:
+        store.release(held)
+        store.close()
+    assert 'db_pool_exhausted_total 1' in metrics.render()
+
+
+def test_schema_does_not_create_the_search_index(tmp_path):
+    store = Store(str(tmp_path / 'schema.db'))
+    try:
+        store.init_schema()
+        assert not store.search_index_available()
+        assert store.create_search_index()
+        assert store.search_index_available()
+    finally:
+        store.close()
+
+
+def test_committed_database_migrates(tmp_path):
+    path = str(tmp_path / 'users.db')
+    shutil.copy(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'database', 'users.db'), path)
+    with sqlite3.connect(path) as conn:
+        before = conn.execute("SELECT id, user_id, text_input, emotion, confidence, timestamp "
+                              "FROM user_analyses ORDER BY id").fetchall()
+    assert before
+
+    store = Store(path)
+    try:
+        store.init_schema()
+        store.migrate()  # a second run finds nothing to do
+        with store.connection() as conn:
+            assert conn.execute("PRAGMA user_version").fetchone()[0] == len(MIGRATIONS)
+            after = conn.execute("SELECT id, user_id, text_input, emotion, confidence, timestamp, ruleset_version "
+                                 "FROM user_analyses ORDER BY id").fetchall()
+        assert [row[:6] for row in after] == before
+        assert all(row[6] is None for row in after)
+
+        # Older rows reach the rollup in the migration itself
+        user_id = before[0][1]
+        rollup = store.daily_rollup(user_id)
+        rollup_count = sum(row[2] for row in store.daily_rollup(user_id))
+        assert rollup_count == sum(1 for row in before if row[1] == user_id)
+        assert len(store.history_page(user_id, limit=100)) == rollup_count
+        store.rebuild_rollup(user_id)
+        assert store.daily_rollup(user_id) == rollup
+    finally:
+        store.close()
@@ -0,0 +1,107 @@
+import sys
+import os
+import sqlite3
+import threading
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from database.store import Store
+from database.writer import AnalysisWriter
+from utils.metrics import Registry
+
+
+class FlakyStore:
+    """Store stand-in whose group commits fail while failures remain"""
+
+    def __init__(self, failures=1, error=sqlite3.OperationalError('database is locked')):
+        self.failures = failures
+        self.error = error
+        self.rows = []
+
+    def add_analyses(self, rows):
+        if self.failures:
+            self.failures -= 1
+            raise self.error
+        self.rows.extend(rows)
+
+    def add_analysis(self, *row):
+        if row[1] == 'bad':
+            raise sqlite3.IntegrityError('rejected')
+        self.rows.append(row)
+
+
+def rows(count):
+    return [(1, 'text %d' % i, 'Joy', 0.8, 'v1') for i in range(count)]
+
+
+def test_locked_group_commit_is_retried():
+    store = FlakyStore(failures=1)
+    writer = AnalysisWriter(store, retry_backoff=0.001)
+    for row in rows(6):
+        writer.submit(row)
+    assert writer.flush(timeout=5)
+    writer.close()
+    assert store.rows == rows(6)
+
+
+def test_rows_are_written_one_by_one_after_retries():
+    metrics = Registry()
+    store = FlakyStore(failures=10, error=sqlite3.IntegrityError('one bad row'))
+    writer = AnalysisWriter(store, retry_backoff=0.001, metrics=metrics)
+    batch = rows(3)
+    batch.insert(1, (1, 'bad', 'Joy', 0.8, 'v1'))
+    for row in batch:
+        writer.submit(row)
+    writer.close()
+    assert store.rows == rows(3)
+    rendered = metrics.render()
+    assert 'analysis_writer_rows_total{outcome="written"} 3' in rendered
+    assert 'analysis_writer_rows_total{outcome="rejected"} 1' in rendered
+
+
+def test_rows_are_held_while_the_database_is_unavailable():
+    metrics = Registry()
+    store = FlakyStore(failures=1000)
+    store.add_analysis = lambda *row: store.add_analyses([row])
+    writer = AnalysisWriter(store, retries=1, retry_backoff=0.001, max_backoff=0.01, metrics=metrics)
+    for row in rows(4):
+        writer.submit(row)
+    assert not writer.flush(timeout=0.2)
+    assert store.rows == []
+    assert 'outcome="deferred"' in metrics.render()
+
+    store.failures = 0
+    assert writer.flush(timeout=5)
+    writer.close()
+    assert store.rows == rows(4)
+
+
+def test_flush_does_not_block_on_a_full_queue():
+    release = threading.Event()
+
+    class StalledStore(FlakyStore):
+        def add_analyses(self, rows):
+            release.wait()
+            super().add_analyses(rows)
+
+    store = StalledStore(failures=0)
+    writer = AnalysisWriter(store, batch_size=1, max_queue=2, put_timeout=0.05)
+    for row in rows(3):
+        writer.submit(row)
+    assert not writer.flush(timeout=0.1)
+    release.set()
+    writer.close()
+    assert store.rows == rows(3)
+
+
+def test_writes_reach_the_database(tmp_path):
+    store = Store(str(tmp_path / 'writer.db'))
+    store.init_schema()
+    store.create_user('a', 'a@example.com', 'secret')
+    writer = AnalysisWriter(store)
+    for row in rows(5):
+        writer.submit(row)
+    assert writer.flush(timeout=5)
+    with store.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM user_analyses").fetchone()[0] == 5
+    writer.close()
+    store.close()
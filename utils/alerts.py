@@ -0,0 +1,152 @@
+"""Crisis alert sinks and the dispatcher that feeds them off the request path.
+
+A sink has a single method, send(alert), taking a JSON-serializable dict.
+AlertDispatcher queues alerts and delivers them from a background thread,
+so a slow disk or webhook never delays the response that raised the alert.
+"""
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import urllib.request
+from utils.metrics import DISABLED, LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+def describe(alert):
+    """Loggable summary of an alert; the text itself only goes to the sink"""
+    return 'user_id=%s phrase=%r ruleset_version=%s' % (
+        alert.get('user_id'), alert.get('phrase'), alert.get('ruleset_version'))
+
+
+class FileAlertSink:
+    """Append each alert to a local file as one JSON line"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def send(self, alert):
+        line = json.dumps(alert) + '\n'
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+
+
+class QueueAlertSink:
+    """Hand alerts to an in-process queue (e.g. for a worker or a test)"""
+
+    def __init__(self, target=None):
+        self.queue = target if target is not None else queue.Queue()
+
+    def send(self, alert):
+        self.queue.put(alert)
+
+
+class WebhookAlertSink:
+    """POST each alert as JSON to an on-call webhook"""
+
+    def __init__(self, url, timeout=2.0):
+        self.url = url
+        self.timeout = timeout
+
+    def send(self, alert):
+        request = urllib.request.Request(self.url, data=json.dumps(alert).encode('utf-8'),
+                                         headers={'Content-Type': 'application/json'}, method='POST')
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+def make_alert_sink(kind, path=None, url=None):
+    """Sink named by Config.CRISIS_ALERT_SINK ('file', 'webhook', 'queue'), or None for 'none'"""
+    if kind == 'file':
+        return FileAlertSink(path)
+    if kind == 'webhook':
+        return WebhookAlertSink(url)
+    if kind == 'queue':
+        return QueueAlertSink()
+    if kind == 'none':
+        return None
+    raise ValueError("Unknown alert sink: %r" % kind)
+
+
+class AlertDispatcher:
+    """Deliver alerts to a sink from a background thread.
+
+    send() never blocks: when max_queue alerts are already waiting the new
+    one is logged and counted as dropped. Delivery latency (queued to
+    delivered) is kept in a histogram alongside sent/failed/dropped counts.
+    """
+
+    def __init__(self, sink, max_queue=1000, metrics=None):
+        self.sink = sink
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.latency = LatencyHistogram()
+        
+        metrics = metrics or DISABLED
+        metrics.histogram('alert_delivery_seconds', 'Time from queuing an alert to its delivery').attach(self.latency)
+        metrics.callback('alerts_total', 'Alerts by delivery outcome',
+                         lambda: {('sent',): self.sent, ('failed',): self.failed, ('dropped',): self.dropped},
+                         ('outcome',), kind='counter')
+
+    def _ensure_started(self):
+        # Restart after a fork: the delivery thread does not survive into children
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='alert-dispatcher', daemon=True)
+            self._thread.start()
+
+    def send(self, alert):
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((time.perf_counter(), alert))
+        except queue.Full:
+            self.dropped += 1
+            logger.error("Alert queue full, dropped alert: %s", describe(alert))
+
+    def close(self, timeout=5.0):
+        """Deliver what is queued and stop the delivery thread"""
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+        self._thread = None
+
+    def stats(self):
+        return {
+            'sent': self.sent,
+            'failed': self.failed,
+            'dropped': self.dropped,
+            'pending': self._queue.qsize(),
+            'delivery_latency': self.latency.snapshot()
+        }
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            queued_at, alert = item
+            try:
+                self.sink.send(alert)
+                self.sent += 1
+            except Exception:
+                self.failed += 1
+                logger.exception("Failed to deliver alert: %s", describe(alert))
+            self.latency.observe(time.perf_counter() - queued_at)
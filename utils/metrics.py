@@ -0,0 +1,220 @@
+"""Prometheus-style metrics rendered in the text exposition format.
+
+Metrics are created on a Registry (one per process) and rendered by
+Registry.render() for the /metrics endpoint. A disabled registry hands out
+a shared no-op metric, so instrumented code costs one method call per
+timer or counter and nothing is recorded.
+"""
+import bisect
+import threading
+import time
+from contextlib import nullcontext
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram (cumulative-friendly, Prometheus style)"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def snapshot(self):
+        return {
+            'buckets': dict(zip([str(b) for b in self.buckets] + ['+Inf'], self.counts)),
+            'count': self.count,
+            'sum': self.total
+        }
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=''):
+    pairs = ['%s="%s"' % (name, _escape(value)) for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'start')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            if not self._values and not self.labelnames:
+                return [(self.name, 0)]
+            return [(self.name + _labels(self.labelnames, labels), value)
+                    for labels, value in sorted(self._values.items())]
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def _child(self, labels):
+        child = self._children.get(labels)
+        if child is None:
+            child = self._children.setdefault(labels, LatencyHistogram(self.buckets))
+        return child
+
+    def observe(self, seconds, *labels):
+        with self._lock:
+            self._child(labels).observe(seconds)
+
+    def time(self, *labels):
+        """Context manager observing the duration of its block"""
+        return _Timer(self, labels)
+
+    def attach(self, histogram, *labels):
+        """Export an existing LatencyHistogram (updated by its owner) under labels"""
+        with self._lock:
+            self._children[labels] = histogram
+
+    def samples(self):
+        lines = []
+        with self._lock:
+            children = sorted(self._children.items())
+        for labels, child in children:
+            cumulative = 0
+            for bound, count in zip(child.buckets + ('+Inf',), child.counts):
+                cumulative += count
+                le = 'le="%s"' % (bound if bound == '+Inf' else _number(bound))
+                lines.append((self.name + '_bucket' + _labels(self.labelnames, labels, le), cumulative))
+            lines.append((self.name + '_sum' + _labels(self.labelnames, labels), child.total))
+            lines.append((self.name + '_count' + _labels(self.labelnames, labels), child.count))
+        return lines
+
+
+class Callback:
+    """Value read at render time: callback() returns a number, or a dict
+    of label-value tuples to numbers"""
+
+    def __init__(self, name, documentation, callback, labelnames=(), kind='gauge'):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.labelnames = tuple(labelnames)
+        self.kind = kind
+
+    def samples(self):
+        value = self.callback()
+        if not isinstance(value, dict):
+            return [(self.name, value)]
+        return [(self.name + _labels(self.labelnames, labels), count)
+                for labels, count in sorted(value.items())]
+
+
+class _NullMetric:
+    kind = None
+
+    def inc(self, *labels, amount=1):
+        pass
+
+    def observe(self, seconds, *labels):
+        pass
+
+    def time(self, *labels):
+        return _NULL_TIMER
+
+    def attach(self, histogram, *labels):
+        pass
+
+
+_NULL_TIMER = nullcontext()
+NULL_METRIC = _NullMetric()
+
+
+class Registry:
+    """Named metrics for one process; asking twice for a name returns the same metric"""
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, name, factory):
+        if not self.enabled:
+            return NULL_METRIC
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = factory()
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._get(name, lambda: Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._get(name, lambda: Histogram(name, documentation, labelnames, buckets))
+
+    def callback(self, name, documentation, callback, labelnames=(), kind='gauge'):
+        return self._get(name, lambda: Callback(name, documentation, callback, labelnames, kind))
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+        lines = []
+        for name, metric in metrics:
+            lines.append('# HELP %s %s' % (name, metric.documentation))
+            lines.append('# TYPE %s %s' % (name, metric.kind))
+            for sample, value in metric.samples():
+                lines.append('%s %s' % (sample, _number(value)))
+        return '\n'.join(lines) + '\n'
+
+
+# Disabled registry used when no metrics registry is passed in
+DISABLED = Registry(enabled=False)
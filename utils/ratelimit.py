@@ -0,0 +1,75 @@
+"""Per-key token-bucket rate limiting.
+
+A bucket holds up to burst tokens and refills at rate tokens per second;
+every request takes tokens from its key's bucket, and a request finding too
+few is refused with the number of seconds until they are back.
+
+Buckets live in a backend with a single method,
+take(key, rate, burst, cost, now), returning 0.0 when the tokens were taken
+or else the seconds to wait. MemoryBucketBackend keeps them in this process,
+so each preforked worker limits on its own; a backend shared by every
+worker (e.g. on Redis) can be passed to RateLimiter instead.
+"""
+import threading
+import time
+from collections import OrderedDict
+from utils.metrics import DISABLED
+
+
+class RateLimited(Exception):
+    """Raised by RateLimiter.check; retry_after is in seconds"""
+
+    def __init__(self, retry_after):
+        super().__init__('Rate limited; retry in %.1f seconds' % retry_after)
+        self.retry_after = retry_after
+
+
+class MemoryBucketBackend:
+    """Token buckets in a bounded, least recently used first map in this process"""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, updated)
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, cost, now):
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+            wait = 0.0
+            if tokens < cost:
+                wait = (cost - tokens) / rate
+            else:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            # The least recently used bucket has refilled the longest, so
+            # dropping it is the same as, or close to, leaving it full
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+class RateLimiter:
+    """Allows each key rate requests per second on average, in bursts of up to burst"""
+
+    def __init__(self, rate, burst, backend=None, metrics=None):
+        if rate <= 0 or burst < 1:
+            raise ValueError("rate must be positive and burst at least 1")
+        self.rate = rate
+        self.burst = burst
+        self.backend = backend or MemoryBucketBackend()
+        self.limited = (metrics or DISABLED).counter('rate_limited_total', 'Requests refused by the rate limiter')
+
+    def check(self, key, cost=1):
+        """Take cost tokens for key, or raise RateLimited.
+
+        A cost larger than the burst could never be paid and raises ValueError;
+        callers bound their requests (e.g. batch sizes) to the burst instead.
+        """
+        if cost > self.burst:
+            raise ValueError("cost %d is larger than the burst of %d" % (cost, self.burst))
+        wait = self.backend.take(key, self.rate, self.burst, cost, time.time())
+        if wait:
+            self.limited.inc()
+            raise RateLimited(wait)
@@ -0,0 +1,67 @@
+"""Single-flight execution: concurrent calls for the same key share one run."""
+import threading
+import time
+from collections import deque
+
+
+class _Flight:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Runs a function once for all callers asking for the same key at once.
+
+    The first caller runs fn; callers with the same key arriving while it
+    runs wait and get the same result, or the same exception. With
+    linger > 0 a result is also handed to callers arriving up to linger
+    seconds after it was produced, which absorbs double submissions and
+    retries that come just too late to overlap. Failures never linger.
+    """
+
+    def __init__(self, linger=0.0):
+        self.linger = linger
+        self.shared = 0  # calls answered by another call's run
+        self._flights = {}
+        self._expiry = deque()  # (expires, key, flight) in finishing order
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            self._expire(time.monotonic())
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self.shared += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fn()
+        except BaseException as exc:
+            flight.error = exc
+            raise
+        finally:
+            with self._lock:
+                if flight.error is None and self.linger > 0:
+                    self._expiry.append((time.monotonic() + self.linger, key, flight))
+                else:
+                    del self._flights[key]
+            flight.done.set()
+        return flight.result
+
+    def _expire(self, now):
+        while self._expiry and self._expiry[0][0] <= now:
+            _, key, flight = self._expiry.popleft()
+            if self._flights.get(key) is flight:
+                del self._flights[key]